@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -92,6 +93,15 @@ DATABASES = {
     }
 }
 
+# A local SQLite file instead of PostgreSQL, e.g. to compare backends with bench_suite.
+if os.getenv("SQLITE_DB"):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv("SQLITE_DB"),
+        }
+    }
+
 # Simplify database configuration when running tests
 if 'test' in sys.argv:
     DATABASES = {
@@ -101,6 +111,33 @@ if 'test' in sys.argv:
         }
     }
 
+# Month caches are invalidated through version counters kept in the cache
+# itself, so every process (web workers, run_jobs) must share the backend.
+# The default file-based cache is shared by the processes of one host; use
+# the database cache (createcachetable) when they run on several hosts.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        'LOCATION': os.getenv("CACHE_LOCATION", os.path.join(BASE_DIR, "cache")),
+        # Version keys must not expire; cached data sets its own timeout.
+        'TIMEOUT': None,
+        'OPTIONS': {
+            # Rendered rows take one entry per 100 employees and month; Django's
+            # default of 300 entries would evict them before the next request.
+            'MAX_ENTRIES': int(os.getenv("CACHE_MAX_ENTRIES", "100000")),
+            # Cull by emptying the whole cache: month and row versions are then
+            # never lost without the entries stored under them.
+            'CULL_FREQUENCY': 0,
+        },
+    }
+}
+
+# Tests run in one process.
+if 'test' in sys.argv:
+    CACHES['default'].update({
+        'BACKEND': "django.core.cache.backends.locmem.LocMemCache",
+        'LOCATION': "",
+    })
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -143,6 +180,22 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 # Directory where uploaded media files are stored
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Background jobs (imports/exports): "thread" runs them in an in-process pool,
+# "worker" leaves them for `manage.py run_jobs`, "sync" runs them inline (tests)
+JOB_RUNNER = os.getenv("JOB_RUNNER", "sync" if 'test' in sys.argv else "thread")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Jobs running longer than this (seconds) are presumed dead and marked failed.
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "3600"))
+# Seconds a finished job's result file is kept for download.
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", str(7 * 24 * 3600)))
+
+# Per-request profiling (core.middleware.ProfilingMiddleware), off unless enabled.
+# Profiles are written to PROFILING_DIR and browsed at /admin/profiles/.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "False") == "True"
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(BASE_DIR, "profiles"))
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "50"))
+PROFILING_TOKEN_MAX_AGE = int(os.getenv("PROFILING_TOKEN_MAX_AGE", str(24 * 60 * 60)))
+
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'staticfiles')]
 
 # Default primary key field type
@@ -17,7 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from core.admin import profile_urls
+
 urlpatterns = [
+    path('admin/profiles/', include(profile_urls())),
     path('admin/', admin.site.urls),
     path("", include("core.urls")),
 ]
@@ -1,8 +1,12 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.db import transaction
 from simple_history.admin import SimpleHistoryAdmin
-from django.urls import path
+from django.urls import path, reverse
 from django.shortcuts import render, redirect
 from django.contrib import messages
+from django.http import FileResponse, Http404
 from .models import (
     Department,
     Position,
@@ -12,8 +16,13 @@ from .models import (
     EmployeeServiceRecord,
     Settings,
     ScheduleTemplate,
+    Job,
+    ClosedMonth,
 )
-import openpyxl
+from services.imports import import_employees
+from services.jobs import enqueue
+from services.profiling import list_profiles, load_summary, profile_path, profile_token, top_functions
+from services.snapshots import MonthClosedError, ensure_months_open
 
 @admin.register(Department)
 class DepartmentAdmin(admin.ModelAdmin):
@@ -27,16 +36,65 @@ class PositionAdmin(admin.ModelAdmin):
 class ServiceAdmin(admin.ModelAdmin):
     list_display = ("name", "price")
 
+class OpenMonthForm(forms.ModelForm):
+    """Shows a change to or from a closed month as a form error."""
+
+    def clean(self):
+        cleaned_data = super().clean()
+        field = "date" if self._meta.model is WorkSchedule else "month"
+        dates = [cleaned_data.get(field)]
+        if self.instance.pk is not None:
+            dates.append(getattr(self.instance, field))
+        try:
+            ensure_months_open([day for day in dates if day])
+        except MonthClosedError as exc:
+            raise forms.ValidationError(str(exc))
+        return cleaned_data
+
+
+class OpenMonthAdminMixin:
+    """Edits of closed months end in an error message instead of a server error."""
+
+    form = OpenMonthForm
+
+    def delete_view(self, request, object_id, extra_context=None):
+        try:
+            return super().delete_view(request, object_id, extra_context)
+        except MonthClosedError as exc:
+            self.message_user(request, str(exc), messages.ERROR)
+            return redirect("..")
+
+    def changelist_view(self, request, extra_context=None):
+        # Bulk deletes run here; the atomic block also drops their log entries.
+        try:
+            with transaction.atomic():
+                return super().changelist_view(request, extra_context)
+        except MonthClosedError as exc:
+            self.message_user(request, str(exc), messages.ERROR)
+            return redirect(request.get_full_path())
+
+
 @admin.register(WorkSchedule)
-class WorkScheduleAdmin(SimpleHistoryAdmin):
+class WorkScheduleAdmin(OpenMonthAdminMixin, SimpleHistoryAdmin):
     list_display = ("employee", "date", "shift")
     list_filter = ("shift", "date")
 
 @admin.register(EmployeeServiceRecord)
-class EmployeeServiceRecordAdmin(admin.ModelAdmin):
+class EmployeeServiceRecordAdmin(OpenMonthAdminMixin, admin.ModelAdmin):
     list_display = ("employee", "service", "month", "quantity")
 
 
+@admin.register(ClosedMonth)
+class ClosedMonthAdmin(admin.ModelAdmin):
+    """Months are closed from the report page, which also writes the snapshot."""
+
+    list_display = ("month", "closed_at", "closed_by")
+    readonly_fields = ("month", "closed_at", "closed_by", "salary_file", "advance_file", "report_file")
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(Employee)
 class EmployeeAdmin(admin.ModelAdmin):
     list_display = ("full_name", "department", "position", "is_fixed_salary", "fixed_salary", "bonus")
@@ -60,30 +118,27 @@ class EmployeeAdmin(admin.ModelAdmin):
             return redirect("..")
 
         if request.method == "POST" and request.FILES.get("xlsx_file"):
-            wb = openpyxl.load_workbook(request.FILES["xlsx_file"])
-            ws = wb.active
-            count = 0
-            for i, row in enumerate(ws.iter_rows(min_row=2), start=2):
-                full_name = row[0].value
-                dept_name = row[1].value
-                pos_name = row[2].value
-                day_rate = row[3].value
-                night_rate = row[4].value
-                if not all([full_name, dept_name, pos_name, day_rate, night_rate]):
-                    continue
-                dept, _ = Department.objects.get_or_create(name=dept_name)
-                pos, _ = Position.objects.get_or_create(name=pos_name)
-                Employee.objects.update_or_create(
-                    full_name=full_name,
-                    defaults={
-                        "department": dept,
-                        "position": pos,
-                        "day_shift_rate": day_rate,
-                        "night_shift_rate": night_rate,
-                    }
+            # The preview is shown on this page, so it never goes to the background.
+            if request.POST.get("dry_run"):
+                report = import_employees(request.FILES["xlsx_file"], dry_run=True)
+                return render(request, "admin/import_employees_admin.html", {
+                    "report": report,
+                    "preview_limit": 200,
+                })
+            if request.POST.get("background"):
+                job = enqueue("import_employees", input_file=request.FILES["xlsx_file"], user=request.user)
+                self.message_user(
+                    request,
+                    f"Импорт поставлен в очередь (задача #{job.pk}), статус: {reverse('job_status', args=[job.pk])}",
                 )
-                count += 1
-            self.message_user(request, f"Импортировано {count} сотрудников.")
+                return redirect("..")
+            report = import_employees(request.FILES["xlsx_file"])
+            self.message_user(
+                request,
+                f"Импортировано {report['imported']} сотрудников: добавлено {len(report['created'])}, "
+                f"обновлено {len(report['updated'])}, без изменений {report['unchanged']}, "
+                f"пропущено {len(report['skipped'])}.",
+            )
             return redirect("..")
         return render(request, "admin/import_employees_admin.html")
 
@@ -95,3 +150,51 @@ class SettingsAdmin(admin.ModelAdmin):
 @admin.register(ScheduleTemplate)
 class ScheduleTemplateAdmin(admin.ModelAdmin):
     list_display = ("name",)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "progress", "created_by", "created_at", "finished_at")
+    list_filter = ("kind", "status")
+    readonly_fields = ("started_at", "finished_at", "created_at")
+
+
+def profiles_view(request):
+    """Stored request profiles, newest first."""
+    return render(request, "admin/profiles.html", {
+        **admin.site.each_context(request),
+        "title": "Профили запросов",
+        "profiles": list_profiles(),
+        "enabled": settings.PROFILING_ENABLED,
+        "token": profile_token(),
+    })
+
+
+def profile_detail_view(request, name):
+    summary = load_summary(name)
+    if summary is None:
+        raise Http404
+    sort = request.GET.get("sort") if request.GET.get("sort") in ("cumulative", "tottime", "ncalls") else "cumulative"
+    return render(request, "admin/profile_detail.html", {
+        **admin.site.each_context(request),
+        "title": f"Профиль {name}",
+        "profile": summary,
+        "sort": sort,
+        "functions": top_functions(name, sort),
+    })
+
+
+def profile_download_view(request, name):
+    path = profile_path(name)
+    if path is None:
+        raise Http404
+    return FileResponse(path.open("rb"), as_attachment=True, filename=path.name)
+
+
+def profile_urls():
+    """Admin pages of request profiles; they are files, not models."""
+    return [
+        path("", admin.site.admin_view(profiles_view), name="admin_profiles"),
+        path("<str:name>/", admin.site.admin_view(profile_detail_view), name="admin_profile"),
+        path("<str:name>/download/", admin.site.admin_view(profile_download_view), name="admin_profile_download"),
+    ]
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Month caches are invalidated through versions kept in the cache, so
+    a run_jobs worker needs the same backend as the web processes."""
+    backend = settings.CACHES["default"]["BACKEND"]
+    if backend in LOCAL_CACHES and settings.JOB_RUNNER == "worker":
+        return [Warning(
+            f"{backend} is private to each process: month pages and reports stay stale "
+            "after changes made by run_jobs or another web worker.",
+            hint="Use a shared cache backend, e.g. FileBasedCache or DatabaseCache.",
+            id="core.W001",
+        )]
+    return []
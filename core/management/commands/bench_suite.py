@@ -0,0 +1,217 @@
+import json
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+
+import openpyxl
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from core.models import Employee, Service
+from helpers.utils import add_months
+from services.demo_data import generate_dataset
+from services.imports import import_employees, import_services, import_timesheet
+
+VIEWS = [
+    ("timesheet", {}),
+    ("timesheet_rows", {"html": 1, "page": 2}),
+    ("report", {}),
+    ("export_timesheet", {}),
+    ("export_services", {}),
+    ("export_salary_report", {}),
+    ("export_salary_full", {}),
+    ("export_salary_advance", {}),
+]
+IMPORT_CODES = ["Д", "Н", "В", "В"]
+FILE_CACHE = "django.core.cache.backends.filebased.FileBasedCache"
+LOCMEM_CACHE = "django.core.cache.backends.locmem.LocMemCache"
+
+
+def _workbook(rows) -> BytesIO:
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for row in rows:
+        ws.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer
+
+
+def _import_files(first_day, prefix: str) -> dict:
+    """Sheets in the format each importer expects, built from generated data."""
+    employees = list(
+        Employee.objects.filter(full_name__startswith=prefix)
+        .select_related("department", "position").order_by("full_name")
+    )
+    services = list(Service.objects.filter(name__startswith=prefix).order_by("name"))
+    days = (add_months(first_day, 1) - first_day).days
+    return {
+        "import_timesheet": _workbook(
+            [["ФИО", *range(1, days + 1)]]
+            + [[e.full_name, *(IMPORT_CODES[(i + d) % 4] for d in range(days))] for i, e in enumerate(employees)]
+        ),
+        "import_services": _workbook(
+            [["ФИО", "Месяц", *(s.name for s in services)]]
+            + [[e.full_name, f"{first_day:%Y-%m}", *((i + j) % 4 for j in range(len(services)))]
+               for i, e in enumerate(employees)]
+        ),
+        "import_employees": _workbook(
+            [["ФИО", "Отдел", "Должность", "Дневная ставка", "Ночная ставка"]]
+            + [[e.full_name, e.department.name, e.position.name, e.day_shift_rate + 100, e.night_shift_rate + 100]
+               for e in employees]
+        ),
+    }
+
+
+def _scratch_cache(directory: str) -> dict:
+    """The default cache moved to a location of its own, so clearing it
+    between runs leaves the deployed cache alone. A file-based cache keeps
+    its backend in ``directory``; any other becomes a private LocMemCache."""
+    default = settings.CACHES["default"]
+    if default["BACKEND"] == FILE_CACHE:
+        return {**default, "LOCATION": directory}
+    return {**default, "BACKEND": LOCMEM_CACHE, "LOCATION": "bench_suite"}
+
+
+def _consume(response) -> int:
+    if response.status_code != 200:
+        raise CommandError(f"{response.request['PATH_INFO']} returned {response.status_code}")
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time views, exports and imports on generated data of several sizes: "
+        "wall time, query count and peak memory, compared against a baseline file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="100,1000", help="Comma-separated employee counts")
+        parser.add_argument("--months", type=int, default=3, help="Months of generated schedule")
+        parser.add_argument("--start", default="2024-01", help="First generated month in YYYY-MM format")
+        parser.add_argument("--baseline", default=str(settings.BASE_DIR / "benchmarks" / "baseline.json"))
+        parser.add_argument("--update-baseline", action="store_true", help="Write results into the baseline file")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.5,
+            help="Relative slowdown of wall time or peak memory reported as a regression",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",") if size.strip()]
+            start = datetime.strptime(options["start"], "%Y-%m").date()
+        except ValueError:
+            raise CommandError("Invalid --sizes or --start")
+        # The last generated month is the one measured.
+        first_day = add_months(start, options["months"] - 1)
+        if Employee.objects.exists():
+            raise CommandError(
+                "bench_suite needs an empty scratch database, e.g. "
+                "SQLITE_DB=/tmp/bench.sqlite3 manage.py migrate, then run it with the same SQLITE_DB"
+            )
+
+        results = {}
+        directory = tempfile.mkdtemp(prefix="bench_suite_cache_")
+        try:
+            with override_settings(CACHES={**settings.CACHES, "default": _scratch_cache(directory)}):
+                for size in sizes:
+                    self.stdout.write(f"{connection.vendor}, {size} employees")
+                    results[str(size)] = self._run_size(size, start, first_day, options["months"])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        path = Path(options["baseline"])
+        baseline = json.loads(path.read_text()) if path.exists() else {}
+        regressions = self._compare(baseline.get(connection.vendor, {}), results, options["tolerance"])
+        for line in regressions:
+            self.stdout.write(self.style.WARNING(line))
+
+        if options["update_baseline"]:
+            baseline[connection.vendor] = results
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(baseline, indent=2, sort_keys=True, ensure_ascii=False) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {path}"))
+        elif not regressions:
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def _run_size(self, size, start, first_day, months) -> dict:
+        prefix = f"Бенч{size}"
+        client = Client()
+        params = {"month": f"{first_day:%Y-%m}"}
+        targets = [
+            (name, lambda name=name, extra=extra: _consume(client.get(reverse(name), {**params, **extra})))
+            for name, extra in VIEWS
+        ]
+        results = {}
+        # Everything generated and imported is rolled back afterwards.
+        with transaction.atomic():
+            generate_dataset(
+                departments=max(size // 50, 1), employees=size, months=months, start=start, seed=size, prefix=prefix,
+            )
+            files = _import_files(first_day, prefix)
+            targets += [
+                ("import_timesheet", lambda: import_timesheet(BytesIO(files["import_timesheet"].getvalue()), first_day)),
+                ("import_services", lambda: import_services(BytesIO(files["import_services"].getvalue()))),
+                ("import_employees", lambda: import_employees(BytesIO(files["import_employees"].getvalue()))),
+            ]
+            for name, target in targets:
+                results[name] = self._measure(target)
+                self.stdout.write(
+                    f"  {name:<24} {results[name]['ms']:>9.1f} ms {results[name]['queries']:>6} queries "
+                    f"{results[name]['peak_kib']:>8} KiB"
+                )
+            transaction.set_rollback(True)
+        cache.clear()
+        return results
+
+    def _measure(self, target) -> dict:
+        """Cold run timed with queries counted, then a second cold run under tracemalloc.
+
+        For importers the second run re-imports the same file, so their peak
+        memory is that of the common re-import case.
+        """
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        cache.clear()
+        # Not CaptureQueriesContext: the test client resets connection.queries per request.
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            target()
+            elapsed = time.perf_counter() - started
+        cache.clear()
+        tracemalloc.start()
+        try:
+            target()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {"ms": round(elapsed * 1000, 1), "queries": len(queries), "peak_kib": peak // 1024}
+
+    def _compare(self, baseline: dict, results: dict, tolerance: float) -> list[str]:
+        regressions = []
+        for size, targets in results.items():
+            for name, current in targets.items():
+                previous = baseline.get(size, {}).get(name)
+                if not previous:
+                    continue
+                if current["queries"] > previous["queries"]:
+                    regressions.append(f"{size}/{name}: queries {previous['queries']} -> {current['queries']}")
+                for key in ("ms", "peak_kib"):
+                    if current[key] > previous[key] * (1 + tolerance):
+                        regressions.append(f"{size}/{name}: {key} {previous[key]} -> {current[key]}")
+        return regressions
@@ -0,0 +1,59 @@
+import random
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+
+from core.models import Department, Employee, Position, ShiftType
+from helpers.timesheet_grid import build_timesheet_rows
+from helpers.utils import MonthSchedule
+
+GRID_TEMPLATE = "{% load timesheet_tags %}{% for row in rows %}{% timesheet_row row %}{% endfor %}"
+
+
+class Command(BaseCommand):
+    help = "Measure timesheet grid render time on synthetic in-memory data (no database writes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--employees", type=int, default=1000, help="Number of grid rows")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs to take the best of")
+
+    def handle(self, *args, **options):
+        count = options["employees"]
+        first_day = date(2024, 1, 1)
+        department = Department(id=1, name="Отдел")
+        position = Position(id=1, name="Должность")
+        employees = [
+            Employee(id=i, full_name=f"Сотрудник {i}", department=department, position=position)
+            for i in range(1, count + 1)
+        ]
+        schedule = MonthSchedule(first_day, [e.id for e in employees])
+        shifts = list(ShiftType.values) + [None]
+        rng = random.Random(0)
+        for employee in employees:
+            for day in range(1, schedule.days + 1):
+                schedule.set(employee.id, day, rng.choice(shifts))
+        salary = {e.id: {"day": 10, "night": 5, "total": 20000.0} for e in employees}
+        days_info = [
+            {"num": d, "is_today": False, "is_weekend": date(2024, 1, d).weekday() >= 5}
+            for d in range(1, schedule.days + 1)
+        ]
+        template = Template(GRID_TEMPLATE)
+
+        best_build = best_render = None
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            rows = build_timesheet_rows(employees, schedule, salary, days_info)
+            built = time.perf_counter()
+            html = template.render(Context({"rows": rows}))
+            rendered = time.perf_counter()
+            best_build = min(best_build or 1e9, built - started)
+            best_render = min(best_render or 1e9, rendered - built)
+
+        per_thousand = (best_build + best_render) * 1000 / max(count, 1) * 1000
+        self.stdout.write(
+            f"{count} employees x {schedule.days} days: build {best_build * 1000:.1f} ms, "
+            f"render {best_render * 1000:.1f} ms, {len(html) // 1024} KiB"
+        )
+        self.stdout.write(self.style.SUCCESS(f"{per_thousand:.1f} ms per 1000 employees"))
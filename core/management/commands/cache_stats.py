@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from services.month_cache import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show month cache hit/miss counters of all processes sharing the cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Reset the counters after printing")
+
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        for kind, hits, misses in (("month", "hits", "misses"), ("row", "row_hits", "row_misses")):
+            total = stats[hits] + stats[misses]
+            ratio = f"{stats[hits] / total:.0%}" if total else "-"
+            self.stdout.write(f"{kind}: {stats[hits]} hits, {stats[misses]} misses, hit rate {ratio}")
+        if options["reset"]:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
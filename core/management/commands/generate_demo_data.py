@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from services.demo_data import generate_dataset
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic departments, employees, schedules, services and history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--departments", type=int, default=5)
+        parser.add_argument("--employees", type=int, default=100)
+        parser.add_argument("--months", type=int, default=3, help="Number of months of schedule")
+        parser.add_argument("--start", default="2024-01", help="First month in YYYY-MM format")
+        parser.add_argument("--services", type=int, default=10)
+        parser.add_argument("--edits", type=float, default=0.05, help="Share of cells edited once more")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--prefix", default="Демо", help="Prefix of generated names")
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.strptime(options["start"], "%Y-%m").date()
+        except ValueError:
+            raise CommandError(f"Invalid month {options['start']!r}, expected YYYY-MM")
+        with transaction.atomic():
+            result = generate_dataset(
+                departments=options["departments"],
+                employees=options["employees"],
+                months=options["months"],
+                start=start,
+                services=options["services"],
+                edits=options["edits"],
+                seed=options["seed"],
+                prefix=options["prefix"],
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['employees']} employees, {result['cells']} schedule cells, "
+            f"{result['edits']} edits, {result['service_records']} service records"
+        ))
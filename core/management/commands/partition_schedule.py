@@ -0,0 +1,69 @@
+from datetime import date, datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from services.partitioning import (
+    DEFAULT_AHEAD,
+    PartitioningError,
+    convert_tables,
+    detach_partitions,
+    ensure_partitions,
+    is_supported,
+)
+
+
+def _month(value: str) -> date:
+    try:
+        return datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise CommandError(f"Invalid month {value!r}, expected YYYY-MM")
+
+
+class Command(BaseCommand):
+    help = "Maintain monthly partitions of the schedule and schedule history tables (PostgreSQL)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert",
+            action="store_true",
+            help="Rebuild unpartitioned tables as partitioned ones (copies all rows)",
+        )
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=DEFAULT_AHEAD,
+            help="Months starting from the current one to create partitions for",
+        )
+        parser.add_argument(
+            "--archive-before",
+            type=_month,
+            help="Detach partitions of months before this one (YYYY-MM)",
+        )
+        parser.add_argument(
+            "--archive-schema",
+            help="Schema to move detached partitions into",
+        )
+
+    def handle(self, *args, **options):
+        if not is_supported():
+            self.stdout.write(self.style.WARNING(
+                f"Partitioning requires PostgreSQL, nothing to do on {connection.vendor}"
+            ))
+            return
+
+        if options["convert"]:
+            try:
+                created = convert_tables()
+            except PartitioningError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(f"Converted, {len(created)} month partitions created")
+
+        today = date.today()
+        for name in ensure_partitions(today.replace(day=1), options["ahead"]):
+            self.stdout.write(f"Created {name}")
+
+        if options["archive_before"]:
+            for name in detach_partitions(options["archive_before"], options["archive_schema"]):
+                self.stdout.write(f"Detached {name}")
+        self.stdout.write(self.style.SUCCESS("Partitions are up to date"))
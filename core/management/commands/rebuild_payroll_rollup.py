@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from services.month_cache import bump_all
+from services.payroll_rollup import rebuild_rollup, rollup_months
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-employee month payroll rollup from schedule and service data"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--month",
+            help="Month in YYYY-MM format. Defaults to every month with data",
+        )
+
+    def handle(self, *args, **options):
+        if options["month"]:
+            try:
+                months = [datetime.strptime(options["month"], "%Y-%m").date()]
+            except ValueError:
+                raise CommandError(f"Invalid month {options['month']!r}, expected YYYY-MM")
+        else:
+            months = rollup_months()
+
+        for first_day in months:
+            rows = rebuild_rollup(first_day)
+            self.stdout.write(f"{first_day:%Y-%m}: {rows} rows")
+        bump_all()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(months)} months"))
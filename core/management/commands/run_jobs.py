@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from services.jobs import run_next_job
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (imports and exports)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run all pending jobs and exit instead of polling",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2.0,
+            help="Seconds to sleep between polls when the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            ran = run_next_job()
+            if ran:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(self.style.SUCCESS("No pending jobs"))
@@ -0,0 +1,97 @@
+import cProfile
+import threading
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from services.profiling import check_token, normalize_sql, save_profile
+
+PROFILE_FLAG = "_profile"
+# cProfile and tracemalloc are process-wide, so one request is profiled at a time.
+_profile_lock = threading.Lock()
+
+
+class ProfilingMiddleware:
+    """Profile single requests on demand.
+
+    Enabled with ``PROFILING_ENABLED``. A request is profiled when it carries
+    ``?_profile=1`` from a staff user, or ``?_profile=<token>`` with a token
+    from the admin profiles page. The profile id is returned in the
+    ``X-Profile-Id`` header. Streamed response bodies are sent after the
+    profile is taken; exports build their workbook before that, in the view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.wants_profile(request) or not _profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request)
+        finally:
+            _profile_lock.release()
+
+    def profile(self, request):
+        queries: dict[str, dict] = {}
+
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                group = queries.setdefault(normalize_sql(sql), {"count": 0, "ms": 0.0})
+                group["count"] += 1
+                group["ms"] += (time.perf_counter() - started) * 1000
+
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(record))
+                started = time.perf_counter()
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+                wall_ms = (time.perf_counter() - started) * 1000
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+
+        sql = sorted(
+            ({"sql": statement, "count": group["count"], "ms": round(group["ms"], 1)}
+             for statement, group in queries.items()),
+            key=lambda group: group["ms"], reverse=True,
+        )
+        response["X-Profile-Id"] = save_profile(profiler, {
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "user": request.user.get_username() if request.user.is_authenticated else "",
+            "wall_ms": round(wall_ms, 1),
+            "queries": sum(group["count"] for group in sql),
+            "sql_ms": round(sum(group["ms"] for group in sql), 1),
+            "peak_kib": peak // 1024,
+            "sql": sql,
+        })
+        return response
+
+    def wants_profile(self, request) -> bool:
+        if not settings.PROFILING_ENABLED:
+            return False
+        flag = request.GET.get(PROFILE_FLAG)
+        if not flag:
+            return False
+        if flag == "1":
+            return request.user.is_staff
+        return check_token(flag)
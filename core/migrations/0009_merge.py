@@ -0,0 +1,14 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:16
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_permissions_groups'),
+        ('core', '0008_workschedule_history'),
+    ]
+
+    operations = [
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_merge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Settings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('partial_shift_multiplier', models.DecimalField(decimal_places=2, default=0.5, max_digits=4, verbose_name='Коэффициент неполной смены')),
+                ('vacation_multiplier', models.DecimalField(decimal_places=2, default=1.0, max_digits=4, verbose_name='Коэффициент отпуска')),
+                ('sick_multiplier', models.DecimalField(decimal_places=2, default=1.0, max_digits=4, verbose_name='Коэффициент больничного')),
+            ],
+            options={
+                'verbose_name': 'Настройки расчёта',
+                'verbose_name_plural': 'Настройки расчёта',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='historicalworkschedule',
+            options={'get_latest_by': ('history_date', 'history_id'), 'ordering': ('-history_date', '-history_id'), 'verbose_name': 'historical work schedule', 'verbose_name_plural': 'historical work schedules'},
+        ),
+        migrations.RemoveField(
+            model_name='employee',
+            name='partial_shift_rate',
+        ),
+        migrations.AlterField(
+            model_name='historicalworkschedule',
+            name='history_change_reason',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='historicalworkschedule',
+            name='history_date',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='historicalworkschedule',
+            name='history_id',
+            field=models.AutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='historicalworkschedule',
+            name='history_type',
+            field=models.CharField(choices=[('+', 'Created'), ('~', 'Changed'), ('-', 'Deleted')], max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='workschedule',
+            name='shift',
+            field=models.CharField(choices=[('day', 'День'), ('night', 'Ночь'), ('weekend', 'Выходной'), ('vacation', 'Отпуск'), ('sick', 'Больничный'), ('partial', 'Неполная')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['full_name'], name='employee_full_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['department', 'full_name'], name='employee_dept_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employeeservicerecord',
+            index=models.Index(fields=['month'], name='servicerecord_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workschedule',
+            index=models.Index(fields=['date', 'employee'], name='workschedule_date_emp_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_schedule_and_name_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployeePayrollMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='1-е число месяца')),
+                ('day', models.PositiveIntegerField(default=0, verbose_name='Дневных')),
+                ('night', models.PositiveIntegerField(default=0, verbose_name='Ночных')),
+                ('weekend', models.PositiveIntegerField(default=0, verbose_name='Выходных')),
+                ('vacation', models.PositiveIntegerField(default=0, verbose_name='Отпуск')),
+                ('sick', models.PositiveIntegerField(default=0, verbose_name='Больничный')),
+                ('partial', models.PositiveIntegerField(default=0, verbose_name='Неполных')),
+                ('day_1_15', models.PositiveIntegerField(default=0, verbose_name='Дневных 1-15')),
+                ('night_1_15', models.PositiveIntegerField(default=0, verbose_name='Ночных 1-15')),
+                ('shift_pay', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма смен')),
+                ('bonus', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Премия')),
+                ('services', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма услуг')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Итого')),
+                ('advance', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Аванс')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payroll_months', to='core.employee')),
+            ],
+            options={
+                'verbose_name': 'Расчёт за месяц',
+                'verbose_name_plural': 'Расчёты за месяц',
+                'indexes': [models.Index(fields=['month'], name='payrollmonth_month_idx')],
+                'unique_together': {('employee', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_employeepayrollmonth'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClosedMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='1-е число месяца', unique=True)),
+                ('closed_at', models.DateTimeField(auto_now_add=True)),
+                ('salary_file', models.FileField(blank=True, upload_to='closed_months/')),
+                ('advance_file', models.FileField(blank=True, upload_to='closed_months/')),
+                ('report_file', models.FileField(blank=True, upload_to='closed_months/')),
+                ('closed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Закрытый месяц',
+                'verbose_name_plural': 'Закрытые месяцы',
+                'ordering': ('-month',),
+                'permissions': [('close_month', 'Can close and reopen months')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PayrollSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.PositiveIntegerField(default=0, verbose_name='Дневных')),
+                ('night', models.PositiveIntegerField(default=0, verbose_name='Ночных')),
+                ('weekend', models.PositiveIntegerField(default=0, verbose_name='Выходных')),
+                ('vacation', models.PositiveIntegerField(default=0, verbose_name='Отпуск')),
+                ('sick', models.PositiveIntegerField(default=0, verbose_name='Больничный')),
+                ('partial', models.PositiveIntegerField(default=0, verbose_name='Неполных')),
+                ('day_1_15', models.PositiveIntegerField(default=0, verbose_name='Дневных 1-15')),
+                ('night_1_15', models.PositiveIntegerField(default=0, verbose_name='Ночных 1-15')),
+                ('shift_pay', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма смен')),
+                ('bonus', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Премия')),
+                ('services', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма услуг')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Итого')),
+                ('advance', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Аванс')),
+                ('full_name', models.CharField(max_length=255, verbose_name='ФИО')),
+                ('department_name', models.CharField(max_length=100, verbose_name='Отдел')),
+                ('position_name', models.CharField(max_length=100, verbose_name='Должность')),
+                ('closed_month', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='core.closedmonth')),
+                ('department', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.department')),
+                ('employee', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.employee')),
+            ],
+            options={
+                'verbose_name': 'Снимок расчёта',
+                'verbose_name_plural': 'Снимки расчётов',
+                'unique_together': {('closed_month', 'employee')},
+            },
+        ),
+    ]
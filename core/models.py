@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from simple_history.models import HistoricalRecords
 
@@ -33,6 +34,10 @@ class Employee(models.Model):
         permissions = [
             ("import_employees", "Can import employees from Excel"),
         ]
+        indexes = [
+            models.Index(fields=["full_name"], name="employee_full_name_idx"),
+            models.Index(fields=["department", "full_name"], name="employee_dept_name_idx"),
+        ]
 
 
 class ShiftType(models.TextChoices):
@@ -52,6 +57,11 @@ class WorkSchedule(models.Model):
 
     class Meta:
         unique_together = ('employee', 'date')
+        indexes = [
+            # Month queries filter by a date range first; the unique
+            # (employee, date) index cannot serve them.
+            models.Index(fields=["date", "employee"], name="workschedule_date_emp_idx"),
+        ]
         permissions = [
             ("export_timesheet", "Can export timesheet"),
             ("export_salary", "Can export salary reports"),
@@ -78,6 +88,9 @@ class EmployeeServiceRecord(models.Model):
 
     class Meta:
         unique_together = ('employee', 'service', 'month')
+        indexes = [
+            models.Index(fields=["month"], name="servicerecord_month_idx"),
+        ]
         permissions = [
             ("export_services", "Can export services"),
         ]
@@ -109,6 +122,91 @@ class Settings(models.Model):
         return cls.objects.first() or cls.objects.create()
 
 
+class PayrollFields(models.Model):
+    """Shift counts and money columns of one employee's month payroll."""
+
+    day = models.PositiveIntegerField(default=0, verbose_name="Дневных")
+    night = models.PositiveIntegerField(default=0, verbose_name="Ночных")
+    weekend = models.PositiveIntegerField(default=0, verbose_name="Выходных")
+    vacation = models.PositiveIntegerField(default=0, verbose_name="Отпуск")
+    sick = models.PositiveIntegerField(default=0, verbose_name="Больничный")
+    partial = models.PositiveIntegerField(default=0, verbose_name="Неполных")
+    day_1_15 = models.PositiveIntegerField(default=0, verbose_name="Дневных 1-15")
+    night_1_15 = models.PositiveIntegerField(default=0, verbose_name="Ночных 1-15")
+    shift_pay = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Сумма смен")
+    bonus = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Премия")
+    services = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Сумма услуг")
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Итого")
+    advance = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Аванс")
+
+    class Meta:
+        abstract = True
+
+
+class EmployeePayrollMonth(PayrollFields):
+    """Month payroll of one employee, kept up to date by services.payroll_rollup."""
+
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name="payroll_months")
+    month = models.DateField(help_text="1-е число месяца")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("employee", "month")
+        indexes = [
+            models.Index(fields=["month"], name="payrollmonth_month_idx"),
+        ]
+        verbose_name = "Расчёт за месяц"
+        verbose_name_plural = "Расчёты за месяц"
+
+    def __str__(self):
+        return f"{self.employee} - {self.month:%Y-%m}"
+
+
+class ClosedMonth(models.Model):
+    """A paid month: payroll is frozen in PayrollSnapshot and writes are rejected."""
+
+    month = models.DateField(unique=True, help_text="1-е число месяца")
+    closed_at = models.DateTimeField(auto_now_add=True)
+    closed_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    salary_file = models.FileField(upload_to="closed_months/", blank=True)
+    advance_file = models.FileField(upload_to="closed_months/", blank=True)
+    report_file = models.FileField(upload_to="closed_months/", blank=True)
+
+    class Meta:
+        ordering = ("-month",)
+        verbose_name = "Закрытый месяц"
+        verbose_name_plural = "Закрытые месяцы"
+        permissions = [
+            ("close_month", "Can close and reopen months"),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m}"
+
+
+class PayrollSnapshot(PayrollFields):
+    """Frozen payroll row of a closed month.
+
+    Names are copied so the snapshot does not change when the employee is
+    renamed, moved or deleted later.
+    """
+
+    closed_month = models.ForeignKey(ClosedMonth, on_delete=models.CASCADE, related_name="rows")
+    employee = models.ForeignKey(Employee, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    department = models.ForeignKey(Department, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    full_name = models.CharField(max_length=255, verbose_name="ФИО")
+    department_name = models.CharField(max_length=100, verbose_name="Отдел")
+    position_name = models.CharField(max_length=100, verbose_name="Должность")
+
+    class Meta:
+        unique_together = ("closed_month", "employee")
+        verbose_name = "Снимок расчёта"
+        verbose_name_plural = "Снимки расчётов"
+
+    def __str__(self):
+        return f"{self.full_name} - {self.closed_month}"
+
+
 class ScheduleTemplate(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название шаблона")
     sequence = models.JSONField(verbose_name="Последовательность смен")
@@ -119,3 +217,39 @@ class ScheduleTemplate(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class JobStatus(models.TextChoices):
+    PENDING = "pending", "В очереди"
+    RUNNING = "running", "Выполняется"
+    DONE = "done", "Готово"
+    FAILED = "failed", "Ошибка"
+
+
+class Job(models.Model):
+    kind = models.CharField(max_length=50, verbose_name="Тип задачи")
+    status = models.CharField(max_length=10, choices=JobStatus.choices, default=JobStatus.PENDING, db_index=True)
+    params = models.JSONField(default=dict, blank=True)
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name="Прогресс, %")
+    message = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    input_file = models.FileField(upload_to="jobs/input/", blank=True)
+    result_file = models.FileField(upload_to="jobs/output/", blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("-created_at",)
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.get_status_display()})"
+
+    def set_progress(self, progress: int, message: str = ""):
+        """Persist progress without touching the rest of the row."""
+        self.progress = max(0, min(100, int(progress)))
+        self.message = message
+        Job.objects.filter(pk=self.pk).update(progress=self.progress, message=message)
@@ -0,0 +1,128 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from services.month_cache import bump_month, bump_all, bump_rows
+from services.payroll_rollup import apply_cell_changes, refresh_rollup
+from services.snapshots import ensure_months_open
+
+from .models import (
+    WorkSchedule,
+    EmployeeServiceRecord,
+    Employee,
+    Service,
+    Settings,
+    Department,
+    Position,
+    ClosedMonth,
+)
+
+
+@receiver(pre_save, sender=WorkSchedule)
+def remember_saved_cell(sender, instance, raw=False, **kwargs):
+    """Keep the stored cell for the rollup and skip history of no-op saves."""
+    if raw or instance.pk is None:
+        return
+    current = sender.objects.filter(pk=instance.pk).values_list("employee_id", "date", "shift").first()
+    instance._stored_cell = current
+    if current == (instance.employee_id, instance.date, instance.shift) and not hasattr(
+        instance, "skip_history_when_saving"
+    ):
+        instance._history_skipped = True
+        instance.skip_history_when_saving = True
+
+
+@receiver(pre_save, sender=WorkSchedule)
+@receiver(pre_save, sender=EmployeeServiceRecord)
+@receiver(pre_delete, sender=WorkSchedule)
+@receiver(pre_delete, sender=EmployeeServiceRecord)
+def reject_closed_month_writes(sender, instance, raw=False, origin=None, **kwargs):
+    # Deleting an employee or a service still removes their rows; the
+    # snapshot keeps a copy.
+    if raw or getattr(origin, "model", type(origin)) in (Employee, Service):
+        return
+    dates = [instance.date if sender is WorkSchedule else instance.month]
+    stored = instance.__dict__.get("_stored_cell")
+    if stored is not None:
+        dates.append(stored[1])
+    ensure_months_open(dates)
+
+
+@receiver(post_save, sender=WorkSchedule)
+def update_rollup_on_save(sender, instance, raw=False, **kwargs):
+    # Registered after simple_history's own receiver, so it already ran.
+    if instance.__dict__.pop("_history_skipped", False):
+        del instance.skip_history_when_saving
+    stored = instance.__dict__.pop("_stored_cell", None)
+    if raw:
+        return
+    changes = [(instance.employee_id, instance.date, None, instance.shift)]
+    if stored is not None:
+        employee_id, day, shift = stored
+        if (employee_id, day) == (instance.employee_id, instance.date):
+            changes = [(employee_id, day, shift, instance.shift)]
+        else:
+            changes.append((employee_id, day, shift, None))
+    apply_cell_changes(changes)
+
+
+@receiver(post_delete, sender=WorkSchedule)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    apply_cell_changes([(instance.employee_id, instance.date, instance.shift, None)])
+
+
+@receiver([post_save, post_delete], sender=EmployeeServiceRecord)
+def refresh_rollup_services(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_rollup(instance.month, [instance.employee_id])
+
+
+@receiver(post_save, sender=Employee)
+def refresh_rollup_rates(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        refresh_rollup(employee_ids=[instance.pk])
+
+
+@receiver(pre_save, sender=Service)
+def remember_service_price(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        instance._stored_price = sender.objects.filter(pk=instance.pk).values_list("price", flat=True).first()
+
+
+@receiver(post_save, sender=Service)
+def refresh_rollup_prices(sender, instance, created=False, raw=False, **kwargs):
+    """Recompute rows of open months that use the service, after a price change.
+
+    Deleting a service needs nothing here: its records are deleted with it
+    and refresh their rows one by one.
+    """
+    stored = instance.__dict__.pop("_stored_price", None)
+    if raw or created or stored == instance.price:
+        return
+    touched: dict = {}
+    for month, employee_id in (
+        EmployeeServiceRecord.objects.filter(service=instance)
+        .exclude(month__in=ClosedMonth.objects.values("month"))
+        .values_list("month", "employee_id")
+        .distinct()
+    ):
+        touched.setdefault(month, set()).add(employee_id)
+    for month, employee_ids in touched.items():
+        refresh_rollup(month, employee_ids)
+
+
+@receiver([post_save, post_delete], sender=WorkSchedule)
+@receiver([post_save, post_delete], sender=EmployeeServiceRecord)
+def invalidate_month(sender, instance, **kwargs):
+    first_day = instance.date if sender is WorkSchedule else instance.month
+    bump_month(first_day)
+    bump_rows(first_day, [instance.employee_id])
+
+
+@receiver([post_save, post_delete], sender=Employee)
+@receiver([post_save, post_delete], sender=Service)
+@receiver([post_save, post_delete], sender=Settings)
+@receiver([post_save, post_delete], sender=Department)
+@receiver([post_save, post_delete], sender=Position)
+@receiver([post_save, post_delete], sender=ClosedMonth)
+def invalidate_all_months(sender, **kwargs):
+    bump_all()
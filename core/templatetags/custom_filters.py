@@ -1,16 +1,15 @@
+from collections.abc import Mapping
+
 from django import template
 
 register = template.Library()
 
 @register.filter
 def get_item(dictionary, key):
-    if isinstance(dictionary, dict):
+    if isinstance(dictionary, Mapping):
         return dictionary.get(key)
     return None
 @register.filter
-def filter_for(services, is_fixed_salary):
-    return services.filter(for_salary_based=is_fixed_salary)
-@register.filter
 def get_day_label(day):
     import calendar
     # Пн - 0, Вс - 6
@@ -0,0 +1,9 @@
+from django import template
+
+register = template.Library()
+
+
+@register.inclusion_tag("core/_timesheet_row.html")
+def timesheet_row(row):
+    """Render one employee row of the timesheet grid from a precomputed payload."""
+    return {"row": row, "employee": row["employee"]}
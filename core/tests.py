@@ -1,9 +1,22 @@
-from datetime import date
-from io import BytesIO
+from datetime import date, timedelta
+from io import BytesIO, StringIO
 import json
+from pathlib import Path
+import pickle
+import shutil
+import tempfile
+import time
+from unittest import mock, skipIf, skipUnless
 
-from django.test import TestCase, RequestFactory
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 import openpyxl
 
 from .models import (
@@ -14,10 +27,46 @@ from .models import (
     Service,
     EmployeeServiceRecord,
     ScheduleTemplate,
+    Job,
+    JobStatus,
+    EmployeePayrollMonth,
+    ClosedMonth,
 )
+from .checks import check_shared_cache
 
-from helpers.utils import parse_month
-from services.payroll import calculate_shift_salary, calculate_service_sum
+from helpers.utils import MonthSchedule, add_months, parse_month, get_shift_counts, month_bounds
+from services.payroll import (
+    calculate_service_sum,
+    compute_month_payroll,
+)
+from services.payroll_rollup import read_month_payroll
+from services.month_close import close_month, reopen_month
+from services.snapshots import MonthClosedError
+from services.service_records import bulk_upsert_service_records
+from services.month_cache import (
+    ROW_BUMP_LIMIT,
+    bump_month,
+    bump_month_rows,
+    bump_rows,
+    cache_stats,
+    get_month_payroll,
+    get_month_schedule,
+    month_version,
+    reset_cache_stats,
+    row_versions,
+)
+from services.demo_data import generate_dataset
+from services.imports import import_employees, import_services
+from services.jobs import JOB_KINDS, fail_stale_jobs, run_job
+from services.profiling import list_profile_names, normalize_sql, profile_token
+from services.schedule import bulk_upsert_schedule, compact_schedule_history
+from services.partitioning import (
+    convert_tables,
+    detach_partitions,
+    ensure_partitions,
+    partition_name,
+)
+from utils.excel_export import SheetWriter
 
 
 class TimesheetViewTests(TestCase):
@@ -36,6 +85,64 @@ class TimesheetViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(self.employee, list(response.context["employees"]))
 
+    def test_get_timesheet_renders_schedule(self):
+        WorkSchedule.objects.create(employee=self.employee, date=date(2024, 1, 2), shift="night")
+        response = self.client.get(reverse("timesheet") + "?month=2024-01")
+        self.assertContains(response, f'name="shift_{self.employee.id}_2" value="night"')
+        self.assertContains(response, f'name="shift_{self.employee.id}_3" value=""')
+
+    def test_timesheet_rows_api_pages(self):
+        second = Employee.objects.create(
+            full_name="Zed", department=self.department, position=self.position,
+        )
+        WorkSchedule.objects.create(employee=second, date=date(2024, 1, 3), shift="day")
+        WorkSchedule.objects.create(employee=second, date=date(2023, 12, 31), shift="night")
+
+        url = reverse("timesheet_rows") + "?month=2024-01&page_size=1&page=2&html=1"
+        data = self.client.get(url).json()
+
+        self.assertEqual((data["page"], data["pages"], data["count"], data["has_next"]), (2, 2, 2, False))
+        row = data["rows"][0]
+        self.assertEqual(row["id"], second.id)
+        self.assertEqual(len(row["cells"]), 31)
+        self.assertEqual(row["cells"][2], "day")
+        self.assertEqual(row["last_shift"], "night")
+        self.assertEqual(row["salary"]["day"], 1)
+        self.assertIn(f'name="shift_{second.id}_3" value="day"', data["html"])
+
+    def test_timesheet_rows_reads_only_page_employees(self):
+        for i in range(3):
+            Employee.objects.create(full_name=f"Zed {i}", department=self.department, position=self.position)
+        read_month_payroll(date(2024, 1, 1))
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 3), "day")])
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            data = self.client.get(reverse("timesheet_rows"), {"month": "2024-01", "page_size": 2}).json()
+
+        self.assertEqual(data["rows"][0]["cells"][2], "day")
+        month_reads = [sql for sql in queries if "core_workschedule" in sql or "core_employeepayrollmonth" in sql]
+        self.assertTrue(month_reads)
+        for sql in month_reads:
+            self.assertIn('"employee_id" IN (%s, %s)', sql)
+
+    @mock.patch("core.views.TIMESHEET_PAGE_SIZE", 2)
+    def test_timesheet_first_page_only(self):
+        for i in range(3):
+            Employee.objects.create(full_name=f"Extra {i}", department=self.department, position=self.position)
+        response = self.client.get(reverse("timesheet") + "?month=2024-01")
+        self.assertEqual(len(response.context["rows"]), 2)
+        self.assertContains(response, 'data-next-page="2"')
+
+    def test_bench_timesheet_render_command(self):
+        out = StringIO()
+        call_command("bench_timesheet_render", "--employees", "5", "--repeat", "1", stdout=out)
+        self.assertIn("per 1000 employees", out.getvalue())
+
     def test_post_timesheet_creates_schedule(self):
         month = date.today().strftime("%Y-%m")
         url = reverse("timesheet") + f"?month={month}"
@@ -75,6 +182,88 @@ class TimesheetViewTests(TestCase):
                     WorkSchedule.objects.filter(employee=emp, date=date(first_day.year, first_day.month, d), shift="day").exists()
                 )
 
+    def test_apply_schedule_bulk_template_rotation(self):
+        emp2 = Employee.objects.create(full_name="Jane", department=self.department, position=self.position)
+        template = ScheduleTemplate.objects.create(name="2/2", sequence=["day", "day", "weekend", "weekend"])
+        WorkSchedule.objects.create(employee=emp2, date=date(2023, 12, 31), shift="day")
+        payload = {
+            "department_id": self.department.id,
+            "template_id": template.id,
+            "start_day": 1,
+            "end_day": 4,
+            "month": "2024-01",
+            "offsets": {str(self.employee.id): 2},
+        }
+        resp = self.client.post(reverse("apply_schedule_bulk"), data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["inserted"], 8)
+
+        def shifts(emp):
+            qs = WorkSchedule.objects.filter(employee=emp, date__month=1).order_by("date")
+            return list(qs.values_list("shift", flat=True))
+
+        self.assertEqual(shifts(self.employee), ["weekend", "weekend", "day", "day"])
+        self.assertEqual(shifts(emp2), ["day", "weekend", "weekend", "day"])
+
+    def _post_cells(self, loaded_at, cells):
+        payload = {"month": "2024-01", "loaded_at": loaded_at, "cells": cells}
+        return self.client.post(
+            reverse("save_timesheet_cells"), data=json.dumps(payload), content_type="application/json"
+        )
+
+    def test_save_timesheet_cells_applies_delta(self):
+        loaded_at = self.client.get(reverse("timesheet") + "?month=2024-01").context["loaded_at"]
+        resp = self._post_cells(loaded_at, [{"employee": self.employee.id, "day": 3, "shift": "night"}])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["inserted"], 1)
+        self.assertEqual(WorkSchedule.objects.get(employee=self.employee).date, date(2024, 1, 3))
+
+    def test_save_timesheet_cells_rejects_stale_cells(self):
+        loaded_at = self.client.get(reverse("timesheet") + "?month=2024-01").context["loaded_at"]
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 3), "sick")])
+        resp = self._post_cells(loaded_at, [
+            {"employee": self.employee.id, "day": 3, "shift": "night"},
+            {"employee": self.employee.id, "day": 4, "shift": "night"},
+        ])
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()["conflicts"], [{"employee": self.employee.id, "day": 3, "shift": "sick"}])
+        self.assertEqual(WorkSchedule.objects.get(employee=self.employee).shift, "sick")
+
+    def test_save_timesheet_cells_accepts_naive_loaded_at(self):
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 3), "sick")])
+        resp = self._post_cells("2024-01-01T10:00:00", [{"employee": self.employee.id, "day": 3, "shift": "night"}])
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()["conflicts"], [{"employee": self.employee.id, "day": 3, "shift": "sick"}])
+
+    def test_save_timesheet_cells_rejects_unknown_employee(self):
+        loaded_at = timezone.now().isoformat()
+        resp = self._post_cells(loaded_at, [
+            {"employee": self.employee.id, "day": 3, "shift": "night"},
+            {"employee": self.employee.id + 100, "day": 3, "shift": "night"},
+        ])
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(WorkSchedule.objects.exists())
+
+    def test_save_cell_of_page_loaded_after_concurrent_edit(self):
+        loaded_at = self.client.get(reverse("timesheet") + "?month=2024-01").context["loaded_at"]
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 3), "sick")])
+        # The row arrives on a later page, after the concurrent edit.
+        page = self.client.get(reverse("timesheet_rows"), {"month": "2024-01", "page": 1}).json()
+        self.assertEqual(page["rows"][0]["cells"][2], "sick")
+
+        resp = self._post_cells(loaded_at, [
+            {"employee": self.employee.id, "day": 3, "shift": "night", "loaded_at": page["loaded_at"]},
+        ])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(WorkSchedule.objects.get(employee=self.employee).shift, "night")
+
+        # A later edit still conflicts with that page.
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 3), "day")])
+        resp = self._post_cells(loaded_at, [
+            {"employee": self.employee.id, "day": 3, "shift": "vacation", "loaded_at": page["loaded_at"]},
+        ])
+        self.assertEqual(resp.status_code, 409)
+
 
 class ServicesViewTests(TestCase):
     def setUp(self):
@@ -109,6 +298,44 @@ class ServicesViewTests(TestCase):
         )
         self.assertEqual(record.quantity, 2)
 
+    def test_summary_uses_employee_quantities(self):
+        cache.clear()
+        EmployeeServiceRecord.objects.create(
+            employee=self.employee, service=self.service, month=date(2024, 1, 1), quantity=3
+        )
+        response = self.client.get(reverse("services") + "?month=2024-01")
+        self.assertContains(response, 'value="3"')
+        self.assertRegex(response.content.decode(), r"text-green-800\">\s*300\s*<")
+
+    def _add_employees(self, count):
+        for i in range(count):
+            Employee.objects.create(
+                full_name=f"Extra {i}", department=self.department, position=self.position,
+                is_fixed_salary=bool(i % 2),
+            )
+        Service.objects.create(name="Salaried", price=50, for_salary_based=True)
+
+    def _count_queries(self, method, data=None):
+        cache.clear()
+        url = reverse("services") + "?month=2024-01"
+        with CaptureQueriesContext(connection) as ctx:
+            getattr(self.client, method)(url, data or {})
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_headcount(self):
+        self._add_employees(2)
+        small = (self._count_queries("get"), self._count_queries("post", self._post_all()))
+        self._add_employees(10)
+        large = (self._count_queries("get"), self._count_queries("post", self._post_all()))
+        self.assertEqual(small, large)
+
+    def _post_all(self):
+        return {
+            f"s_{employee.id}_{service.id}": "1"
+            for employee in Employee.objects.all()
+            for service in Service.objects.filter(for_salary_based=employee.is_fixed_salary)
+        }
+
 
 class ImportServicesTests(TestCase):
     def setUp(self):
@@ -142,6 +369,150 @@ class ImportServicesTests(TestCase):
         self.assertEqual(rec_a.quantity, 1)
         self.assertEqual(rec_b.quantity, 2)
 
+    def test_import_services_multi_month_summary(self):
+        wb = self._create_workbook()
+        ws = wb.active
+        ws.append(["John Doe", "2024-02", 3, None])
+        ws.append(["Nobody", "2024-02", 1, 1])
+        ws.append(["John Doe", "bad", 1, 1])
+        buffer = BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+
+        report = import_services(buffer)
+
+        self.assertEqual(report["months"], {
+            "2024-01": {"records": 2, "quantity": 3},
+            "2024-02": {"records": 1, "quantity": 3},
+        })
+        self.assertEqual(report["inserted"], 3)
+        self.assertEqual(report["unmatched_names"], ["Nobody"])
+        self.assertEqual(report["invalid_rows"], [5])
+        self.assertEqual(
+            EmployeeServiceRecord.objects.get(service=self.service_a, month=date(2024, 2, 1)).quantity, 3
+        )
+
+
+class ImportEmployeesTests(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name="Dep")
+        self.position = Position.objects.create(name="Worker")
+        self.existing = Employee.objects.create(
+            full_name="John Doe", department=self.department, position=self.position,
+            day_shift_rate=1000, night_shift_rate=1500,
+        )
+        self.unchanged = Employee.objects.create(
+            full_name="Jane Smith", department=self.department, position=self.position,
+            day_shift_rate=1000, night_shift_rate=1500,
+        )
+
+    def _workbook(self, extra_rows=()):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(["ФИО", "Отдел", "Должность", "Ставка дневная", "Ставка ночная"])
+        ws.append(["John Doe", "Dep", "Worker", 1200, 1500])
+        ws.append(["Jane Smith", "Dep", "Worker", 1000, 1500])
+        ws.append(["New Person", "New Dep", "Worker", 900, 1100])
+        ws.append(["Broken", "Dep", "Worker", "abc", 1])
+        for row in extra_rows:
+            ws.append(row)
+        buffer = BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+        return buffer
+
+    def test_dry_run_writes_nothing(self):
+        report = import_employees(self._workbook(), dry_run=True)
+        self.assertEqual(report["created"], ["New Person"])
+        self.assertEqual(report["updated"], ["John Doe"])
+        self.assertEqual(report["unchanged"], 1)
+        self.assertEqual(report["departments_created"], ["New Dep"])
+        self.assertEqual([item["name"] for item in report["skipped"]], ["Broken"])
+        self.assertFalse(Department.objects.filter(name="New Dep").exists())
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.day_shift_rate, 1000)
+
+    def test_import_creates_and_updates(self):
+        report = import_employees(self._workbook())
+        self.assertEqual(report["imported"], 2)
+        new = Employee.objects.get(full_name="New Person")
+        self.assertEqual((new.department.name, new.night_shift_rate), ("New Dep", 1100))
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.day_shift_rate, 1200)
+        self.assertEqual(Department.objects.count(), 2)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def count(rows):
+            Employee.objects.filter(pk=self.existing.pk).update(day_shift_rate=1000)
+            with CaptureQueriesContext(connection) as ctx:
+                import_employees(self._workbook(rows))
+            return len(ctx.captured_queries)
+
+        small = count([[f"Small {i}", f"Dept {i}", "Worker", 1, 1] for i in range(2)])
+        large = count([[f"Large {i}", f"Dept L{i}", "Worker", 1, 1] for i in range(40)])
+        self.assertEqual(small, large)
+
+    def test_admin_preview(self):
+        admin = get_user_model().objects.create_superuser("admin", "admin@example.com", "pass")
+        self.client.force_login(admin)
+        resp = self.client.post(
+            reverse("admin:import_employees"),
+            {"xlsx_file": self._workbook(), "dry_run": "1"},
+        )
+        self.assertContains(resp, "New Person")
+        self.assertFalse(Employee.objects.filter(full_name="New Person").exists())
+
+
+    @override_settings(JOB_RUNNER="sync")
+    def test_admin_preview_with_background_writes_nothing(self):
+        admin = get_user_model().objects.create_superuser("admin", "admin@example.com", "pass")
+        self.client.force_login(admin)
+        resp = self.client.post(
+            reverse("admin:import_employees"),
+            {"xlsx_file": self._workbook(), "dry_run": "1", "background": "1"},
+        )
+        self.assertContains(resp, "New Person")
+        self.assertFalse(Job.objects.exists())
+        self.assertFalse(Employee.objects.filter(full_name="New Person").exists())
+
+class ImportTimesheetTests(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name="Dep")
+        self.position = Position.objects.create(name="Worker")
+        self.employee = Employee.objects.create(
+            full_name="John Doe",
+            department=self.department,
+            position=self.position,
+        )
+
+    def _upload(self, rows):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(["ФИО"] + [f"{d:02d}" for d in range(1, 32)])
+        for row in rows:
+            ws.append(row)
+        buffer = BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+        url = reverse("import_timesheet") + "?month=2024-01"
+        return self.client.post(url, {"xlsx_file": buffer}, format="multipart")
+
+    def test_import_timesheet_writes_cells_and_reports(self):
+        resp = self._upload([
+            [" John Doe ", "Д", "Н", "X", None, "нп"],
+            ["Nobody", "Д"],
+        ])
+        self.assertEqual(resp.status_code, 200)
+        report = resp.context["report"]
+        self.assertEqual(report["rows"], 1)
+        self.assertEqual(report["inserted"], 3)
+        self.assertEqual(report["unmatched_names"], ["Nobody"])
+        self.assertEqual(report["unknown_codes"], ["X"])
+        shifts = dict(
+            WorkSchedule.objects.filter(employee=self.employee).values_list("date__day", "shift")
+        )
+        self.assertEqual(shifts, {1: "day", 2: "night", 5: "partial"})
+
 
 class ParseMonthTests(TestCase):
     def setUp(self):
@@ -165,6 +536,249 @@ class ParseMonthTests(TestCase):
         self.assertEqual(result, date(today.year, today.month, 1))
 
 
+class MonthScheduleTests(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name="Dep")
+        position = Position.objects.create(name="Worker")
+        self.first = Employee.objects.create(full_name="A", department=department, position=position)
+        self.second = Employee.objects.create(full_name="B", department=department, position=position)
+        for day, shift in [(1, "day"), (2, "night"), (16, "night"), (29, "vacation")]:
+            WorkSchedule.objects.create(employee=self.first, date=date(2024, 2, day), shift=shift)
+        WorkSchedule.objects.create(employee=self.first, date=date(2024, 3, 1), shift="day")
+
+    def test_load_rows_and_counts(self):
+        schedule = MonthSchedule.load(date(2024, 2, 1), [self.first.id, self.second.id])
+        self.assertEqual(len(schedule.cells), 2 * 29)
+
+        row = schedule.row(self.first.id)
+        self.assertEqual((row[0], row[1], row[2], row[28]), ("day", "night", "", "vacation"))
+        self.assertEqual(schedule.row(self.second.id), [""] * 29)
+        self.assertEqual(dict(schedule.get(self.first.id)), {1: "day", 2: "night", 16: "night", 29: "vacation"})
+
+        self.assertEqual(schedule.counts(self.first.id)["night"], 2)
+        self.assertEqual(schedule.counts(self.first.id, 1, 15)["night"], 1)
+        self.assertEqual(schedule.counts(self.first.id, 1, 15)["day"], 1)
+
+    def test_pickle_roundtrip(self):
+        schedule = MonthSchedule.load(date(2024, 2, 1))
+        restored = pickle.loads(pickle.dumps(schedule))
+        self.assertEqual(restored.row(self.first.id), schedule.row(self.first.id))
+        self.assertNotIn(self.second.id, restored)
+
+
+class QueryPlanTests(TestCase):
+    """Month-range and name lookups must be served by the indexes from 0012."""
+
+    def explain(self, queryset) -> str:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # Tiny test tables are always cheaper to scan; make the planner
+                # show whether an index is usable at all.
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    def test_month_bounds_half_open(self):
+        self.assertEqual(month_bounds(date(2024, 2, 1)), (date(2024, 2, 1), date(2024, 3, 1)))
+        self.assertEqual(month_bounds(date(2024, 12, 15)), (date(2024, 12, 1), date(2025, 1, 1)))
+
+    def test_schedule_month_range_uses_date_index(self):
+        start, end = month_bounds(date(2024, 2, 1))
+        plan = self.explain(WorkSchedule.objects.filter(date__gte=start, date__lt=end))
+        self.assertIn("workschedule_date_emp_idx", plan)
+
+    def test_employee_name_lookup_uses_index(self):
+        plan = self.explain(Employee.objects.filter(full_name="A"))
+        self.assertIn("employee_full_name_idx", plan)
+
+    def test_service_records_month_uses_index(self):
+        plan = self.explain(EmployeeServiceRecord.objects.filter(month=date(2024, 2, 1)))
+        self.assertIn("servicerecord_month_idx", plan)
+
+
+class MonthCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_cache_stats()
+        self.department = Department.objects.create(name="Dep")
+        position = Position.objects.create(name="Worker")
+        self.employee = Employee.objects.create(
+            full_name="A", department=self.department, position=position,
+            day_shift_rate=1000, night_shift_rate=1500,
+        )
+        WorkSchedule.objects.create(employee=self.employee, date=date(2024, 1, 2), shift="day")
+        self.month = date(2024, 1, 1)
+
+    def test_hit_after_miss(self):
+        first = get_month_payroll(self.month)
+        with self.assertNumQueries(0):
+            second = get_month_payroll(self.month)
+        self.assertEqual(first, second)
+        self.assertEqual(cache_stats(), {"hits": 1, "misses": 1, "row_hits": 0, "row_misses": 0})
+
+    def test_schedule_write_invalidates_month_only(self):
+        get_month_payroll(self.month)
+        get_month_payroll(date(2024, 2, 1))
+        WorkSchedule.objects.create(employee=self.employee, date=date(2024, 1, 3), shift="night")
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 4), "day")])
+
+        self.assertEqual(get_month_payroll(self.month)[self.employee.id]["total"], 3500)
+        get_month_payroll(date(2024, 2, 1))
+        self.assertEqual(cache_stats(), {"hits": 1, "misses": 3, "row_hits": 0, "row_misses": 0})
+
+    def test_rate_change_invalidates_all_months(self):
+        get_month_payroll(self.month)
+        self.employee.day_shift_rate = 2000
+        self.employee.save()
+        self.assertEqual(get_month_payroll(self.month)[self.employee.id]["total"], 2000)
+
+    def test_versions_do_not_expire(self):
+        backend = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "TIMEOUT": 1}}
+        with override_settings(CACHES=backend):
+            bump_month(self.month)
+            bump_rows(self.month, [self.employee.id])
+            version = month_version(self.month)
+            rows = row_versions(self.month, [self.employee.id])
+            with mock.patch("time.time", return_value=time.time() + 3600):
+                self.assertEqual(month_version(self.month), version)
+                self.assertEqual(row_versions(self.month, [self.employee.id]), rows)
+
+    def test_month_row_bump_invalidates_every_row(self):
+        bump_rows(self.month, [self.employee.id])
+        before = row_versions(self.month, [self.employee.id, 999])
+        other_month = row_versions(date(2024, 2, 1), [self.employee.id])
+        bump_month_rows(self.month)
+        after = row_versions(self.month, [self.employee.id, 999])
+        self.assertNotEqual(after[self.employee.id], before[self.employee.id])
+        self.assertNotEqual(after[999], before[999])
+        self.assertEqual(row_versions(date(2024, 2, 1), [self.employee.id]), other_month)
+
+    def test_bulk_row_bump_is_one_write(self):
+        ids = list(range(1, ROW_BUMP_LIMIT + 2))
+        before = row_versions(self.month, ids)
+        with mock.patch.object(LocMemCache, "set", autospec=True, side_effect=LocMemCache.set) as cache_set:
+            bump_rows(self.month, ids)
+        self.assertEqual(cache_set.call_count, 1)
+        after = row_versions(self.month, ids)
+        self.assertTrue(all(after[i] != before[i] for i in ids))
+
+    def test_stats_are_not_written_per_lookup(self):
+        get_month_payroll(self.month)
+        self.assertIsNone(cache.get("month-cache:stats:misses"))
+        self.assertEqual(cache_stats()["misses"], 1)
+
+    def test_file_based_backend(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        backend = {"default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": tmpdir,
+        }}
+        with override_settings(CACHES=backend):
+            schedule = get_month_schedule(self.month, self.department.id)
+            self.assertEqual(get_month_schedule(self.month, self.department.id).row(self.employee.id),
+                             schedule.row(self.employee.id))
+            WorkSchedule.objects.create(employee=self.employee, date=date(2024, 1, 3), shift="night")
+            self.assertEqual(get_month_schedule(self.month, self.department.id).row(self.employee.id)[2], "night")
+            # Counters live in the shared backend too.
+            self.assertEqual(cache_stats(), {"hits": 1, "misses": 2, "row_hits": 0, "row_misses": 0})
+            out = StringIO()
+            call_command("cache_stats", "--reset", stdout=out)
+            self.assertIn("month: 1 hits, 2 misses, hit rate 33%", out.getvalue())
+            self.assertEqual(cache_stats()["misses"], 0)
+
+    def test_private_cache_with_worker_runner_warns(self):
+        self.assertEqual(check_shared_cache(None), [])
+        with override_settings(JOB_RUNNER="worker"):
+            self.assertEqual([w.id for w in check_shared_cache(None)], ["core.W001"])
+
+
+class RowFragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_cache_stats()
+        self.user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pass")
+        self.client.force_login(self.user)
+        department = Department.objects.create(name="Dep")
+        position = Position.objects.create(name="Worker")
+        self.first = Employee.objects.create(full_name="A", department=department, position=position)
+        self.second = Employee.objects.create(full_name="B", department=department, position=position)
+        self.service = Service.objects.create(name="S", price=10, for_salary_based=False)
+
+    def _get(self, name):
+        return self.client.get(reverse(name) + "?month=2024-01")
+
+    def _get_recording(self, name, tables):
+        """GET the page and return it with the SELECTs it ran on ``tables``."""
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = self._get(name)
+        return response, [
+            sql for sql in queries if sql.startswith("SELECT") and any(f'FROM "{table}"' in sql for table in tables)
+        ]
+
+    def test_timesheet_rerenders_only_edited_row(self):
+        self._get("timesheet")
+        WorkSchedule.objects.create(employee=self.first, date=date(2024, 1, 5), shift="night")
+        reset_cache_stats()
+
+        response, reads = self._get_recording("timesheet", ["core_workschedule", "core_employeepayrollmonth"])
+
+        stats = cache_stats()
+        self.assertEqual((stats["row_hits"], stats["row_misses"]), (1, 1))
+        self.assertContains(response, f'name="shift_{self.first.id}_5" value="night"')
+        # Only the edited row is read back, not the whole month; the page's
+        # last shifts of the previous month are one query for the whole page.
+        month_reads = [sql for sql in reads if '"date" = %s' not in sql]
+        self.assertEqual(len(month_reads), 2)
+        for sql in month_reads:
+            self.assertIn('"employee_id" IN (%s)', sql)
+
+    def test_services_rerenders_only_edited_row(self):
+        self._get("services")
+        EmployeeServiceRecord.objects.create(
+            employee=self.second, service=self.service, month=date(2024, 1, 1), quantity=4
+        )
+        reset_cache_stats()
+
+        response, reads = self._get_recording("services", ["core_employeeservicerecord"])
+
+        stats = cache_stats()
+        self.assertEqual((stats["row_hits"], stats["row_misses"]), (1, 1))
+        self.assertContains(response, f'name="s_{self.second.id}_{self.service.id}"')
+        self.assertEqual(len(reads), 1)
+        self.assertIn('"employee_id" IN (%s)', reads[0])
+
+    def test_cold_page_writes_no_key_per_employee(self):
+        department = Department.objects.get()
+        position = Position.objects.get()
+        Employee.objects.bulk_create(
+            Employee(full_name=f"Bulk {i:04d}", department=department, position=position) for i in range(400)
+        )
+        with mock.patch.object(LocMemCache, "set", autospec=True, side_effect=LocMemCache.set) as cache_set:
+            self._get("services")
+        # Five row chunks, session and version keys.
+        self.assertLess(cache_set.call_count, 10)
+
+    def test_second_render_hits_beyond_default_max_entries(self):
+        department = Department.objects.get()
+        position = Position.objects.get()
+        Employee.objects.bulk_create(
+            Employee(full_name=f"Bulk {i:04d}", department=department, position=position) for i in range(400)
+        )
+        self._get("services")
+        reset_cache_stats()
+
+        self._get("services")
+
+        self.assertEqual(cache_stats()["row_hits"], Employee.objects.count())
+        self.assertEqual(cache_stats()["row_misses"], 0)
+
+
 class ExcelExportTests(TestCase):
     def setUp(self):
         self.department = Department.objects.create(name="Dep")
@@ -178,7 +792,7 @@ class ExcelExportTests(TestCase):
         self.service = Service.objects.create(name="Test Service", price=100)
 
     def _load_workbook(self, response):
-        return openpyxl.load_workbook(BytesIO(response.content))
+        return openpyxl.load_workbook(BytesIO(b"".join(response.streaming_content)))
 
     def test_timesheet_export_dimensions(self):
         url = reverse("export_timesheet") + "?month=2024-01"
@@ -201,6 +815,15 @@ class ExcelExportTests(TestCase):
         self.assertEqual(ws.max_row, Employee.objects.count() + 1)
         self.assertEqual(ws.max_column, 3 + Service.objects.count() + 1)
 
+    def test_services_export_quantities(self):
+        EmployeeServiceRecord.objects.create(
+            employee=self.emp2, service=self.service, month=date(2024, 1, 1), quantity=3
+        )
+        resp = self.client.get(reverse("export_services") + "?month=2024-01")
+        rows = {row[0]: row for row in self._load_workbook(resp).active.iter_rows(min_row=2, values_only=True)}
+        self.assertEqual(rows["Jane Smith"][3:], (3, 300))
+        self.assertEqual(rows["John Doe"][3:], (0, 0))
+
     def test_salary_report_export_dimensions(self):
         url = reverse("export_salary_report") + "?month=2024-01"
         resp = self.client.get(url)
@@ -212,6 +835,37 @@ class ExcelExportTests(TestCase):
         self.assertEqual(ws.max_column, 8)
 
 
+class SheetWriterTests(TestCase):
+    def _roundtrip(self, wb):
+        buffer = BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+        return openpyxl.load_workbook(buffer).active
+
+    def test_widths_tracked_while_appending(self):
+        wb = openpyxl.Workbook(write_only=True)
+        sheet = SheetWriter(wb, "Test")
+        sheet.append(["ФИО", "N"], bold=True)
+        sheet.append(["Very Long Employee Name", 12345])
+        sheet.close()
+        ws = self._roundtrip(wb)
+        self.assertEqual(ws.column_dimensions["A"].width, len("Very Long Employee Name") + 2)
+        self.assertEqual(ws.column_dimensions["B"].width, 7)
+        self.assertTrue(ws["A1"].font.bold)
+        self.assertEqual(ws.max_row, 2)
+
+    def test_rows_after_sample_are_not_measured(self):
+        wb = openpyxl.Workbook(write_only=True)
+        sheet = SheetWriter(wb, "Test", sample_rows=2)
+        sheet.append(["a"])
+        sheet.append(["bb"])
+        sheet.append(["much longer value"])
+        sheet.close()
+        ws = self._roundtrip(wb)
+        self.assertEqual(ws.column_dimensions["A"].width, 4)
+        self.assertEqual(ws.max_row, 3)
+
+
 class PayrollCalculationTests(TestCase):
     def setUp(self):
         self.department = Department.objects.create(name="Dep")
@@ -227,16 +881,788 @@ class PayrollCalculationTests(TestCase):
         self.service_a = Service.objects.create(name="A", price=100)
         self.service_b = Service.objects.create(name="B", price=50)
 
-    def test_fixed_employee_salary(self):
-        salary = calculate_shift_salary(self.fixed_emp, 5, 3)
-        self.assertEqual(salary, 35000)
-
-    def test_piece_employee_salary(self):
-        salary = calculate_shift_salary(self.piece_emp, 2, 1)
-        self.assertEqual(salary, 3500)
-
     def test_calculate_service_sum(self):
         qty = {self.service_a.id: 3, self.service_b.id: 2}
         result = calculate_service_sum(Service.objects.all(), qty)
         self.assertEqual(result, 400)
 
+    def test_compute_month_payroll(self):
+        # January 2024 has 23 working days.
+        for day, shift in [(2, "day"), (10, "night"), (20, "day"), (21, "vacation")]:
+            WorkSchedule.objects.create(employee=self.piece_emp, date=date(2024, 1, day), shift=shift)
+            WorkSchedule.objects.create(employee=self.fixed_emp, date=date(2024, 1, day), shift=shift)
+        EmployeeServiceRecord.objects.create(
+            employee=self.piece_emp, service=self.service_a, month=date(2024, 1, 1), quantity=3
+        )
+
+        payroll = compute_month_payroll(date(2024, 1, 1)).to_dict("index")
+
+        piece = payroll[self.piece_emp.id]
+        self.assertEqual((piece["day"], piece["night"], piece["vacation"]), (2, 1, 1))
+        self.assertEqual((piece["day_1_15"], piece["night_1_15"]), (1, 1))
+        self.assertEqual(piece["shift_pay"], 3500)
+        self.assertEqual(piece["services"], 300)
+        self.assertEqual(piece["total"], 3800)
+        self.assertEqual(piece["advance"], 2500)
+
+        fixed = payroll[self.fixed_emp.id]
+        self.assertEqual(fixed["shift_pay"], 3913.04)
+        self.assertEqual(fixed["advance"], 2608.70)
+        self.assertEqual(fixed["total"], 8913.04)
+
+    def test_get_shift_counts_single_query(self):
+        for day, shift in [(1, "day"), (15, "night"), (16, "night"), (31, "sick")]:
+            WorkSchedule.objects.create(employee=self.piece_emp, date=date(2024, 1, day), shift=shift)
+        WorkSchedule.objects.create(employee=self.piece_emp, date=date(2024, 2, 1), shift="day")
+
+        with self.assertNumQueries(1):
+            counts = get_shift_counts(date(2024, 1, 1), split_day=15)
+
+        self.assertEqual(list(counts), [self.piece_emp.id])
+        piece = counts[self.piece_emp.id]
+        self.assertEqual((piece["day"], piece["night"], piece["sick"], piece["vacation"]), (1, 2, 1, 0))
+        self.assertEqual((piece["day_1_15"], piece["night_1_15"]), (1, 1))
+
+    def test_compute_month_payroll_department_filter(self):
+        other = Department.objects.create(name="Other")
+        Employee.objects.create(full_name="Elsewhere", department=other, position=self.position)
+        payroll = compute_month_payroll(date(2024, 1, 1), self.department.id)
+        self.assertEqual(set(payroll.index), {self.fixed_emp.id, self.piece_emp.id})
+        self.assertEqual(payroll.loc[self.fixed_emp.id, "total"], 5000)
+
+
+
+class PayrollRollupTests(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name="Dep")
+        position = Position.objects.create(name="Worker")
+        self.fixed_emp = Employee.objects.create(
+            full_name="Fixed", department=department, position=position,
+            is_fixed_salary=True, fixed_salary=30000, bonus=5000
+        )
+        self.piece_emp = Employee.objects.create(
+            full_name="Piece", department=department, position=position,
+            day_shift_rate=1000, night_shift_rate=1500
+        )
+        self.service = Service.objects.create(name="A", price=100)
+        self.month = date(2024, 1, 1)
+
+    def assertMatchesRaw(self):
+        self.assertEqual(read_month_payroll(self.month), compute_month_payroll(self.month).to_dict("index"))
+
+    def test_incremental_updates_match_full_computation(self):
+        self.assertMatchesRaw()
+        self.assertEqual(EmployeePayrollMonth.objects.filter(month=self.month).count(), 2)
+
+        bulk_upsert_schedule([
+            (emp.id, date(2024, 1, day), shift)
+            for emp in (self.fixed_emp, self.piece_emp)
+            for day, shift in [(2, "day"), (10, "night"), (20, "day"), (21, "vacation")]
+        ])
+        self.assertMatchesRaw()
+
+        cell = WorkSchedule.objects.get(employee=self.piece_emp, date=date(2024, 1, 2))
+        cell.shift = "night"
+        cell.save()
+        cell.date = date(2024, 1, 25)
+        cell.save()
+        WorkSchedule.objects.get(employee=self.fixed_emp, date=date(2024, 1, 10)).delete()
+        self.assertMatchesRaw()
+
+        bulk_upsert_service_records([(self.piece_emp.id, self.service.id, self.month, 3)])
+        EmployeeServiceRecord.objects.create(
+            employee=self.fixed_emp, service=self.service, month=self.month, quantity=1
+        )
+        self.assertMatchesRaw()
+
+        self.piece_emp.day_shift_rate = 1200
+        self.piece_emp.save()
+        self.service.price = 80
+        self.service.save()
+        self.assertMatchesRaw()
+
+    def test_price_change_refreshes_only_open_months_using_service(self):
+        other = Service.objects.create(name="B", price=10)
+        feb = date(2024, 2, 1)
+        bulk_upsert_service_records([
+            (self.piece_emp.id, self.service.id, self.month, 3),
+            (self.piece_emp.id, self.service.id, feb, 1),
+            (self.fixed_emp.id, other.id, feb, 2),
+        ])
+        ClosedMonth.objects.create(month=self.month)
+
+        with mock.patch("core.signals.refresh_rollup") as refresh:
+            self.service.name = "A2"
+            self.service.save()
+            refresh.assert_not_called()
+
+            self.service.price = 80
+            self.service.save()
+            refresh.assert_called_once_with(feb, {self.piece_emp.id})
+
+    def test_reads_rows_without_scanning_schedule(self):
+        bulk_upsert_schedule([(self.piece_emp.id, date(2024, 1, 2), "day")])
+        read_month_payroll(self.month)
+        with CaptureQueriesContext(connection) as ctx:
+            payroll = read_month_payroll(self.month)
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertFalse(any("core_workschedule" in q["sql"] for q in ctx.captured_queries))
+        self.assertEqual(payroll[self.piece_emp.id]["total"], 1000)
+
+    def test_rebuild_command_and_employee_delete(self):
+        read_month_payroll(self.month)
+        WorkSchedule.objects.bulk_create([WorkSchedule(employee=self.piece_emp, date=date(2024, 1, 3), shift="day")])
+        self.assertEqual(read_month_payroll(self.month)[self.piece_emp.id]["day"], 0)
+
+        out = StringIO()
+        call_command("rebuild_payroll_rollup", stdout=out)
+        self.assertIn("2024-01: 2 rows", out.getvalue())
+        self.assertEqual(read_month_payroll(self.month)[self.piece_emp.id]["day"], 1)
+
+        self.piece_emp.delete()
+        self.assertEqual(set(read_month_payroll(self.month)), {self.fixed_emp.id})
+
+
+class MonthCloseTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.department = Department.objects.create(name="Dep")
+        position = Position.objects.create(name="Worker")
+        self.employee = Employee.objects.create(
+            full_name="Piece", department=self.department, position=position,
+            day_shift_rate=1000, night_shift_rate=1500,
+        )
+        self.service = Service.objects.create(name="A", price=100)
+        self.month = date(2024, 1, 1)
+        bulk_upsert_schedule([
+            (self.employee.id, date(2024, 1, 2), "day"),
+            (self.employee.id, date(2024, 1, 20), "night"),
+        ])
+        bulk_upsert_service_records([(self.employee.id, self.service.id, self.month, 2)])
+        self.user = get_user_model().objects.create_superuser("admin", "a@example.com", "pass")
+
+    def test_close_freezes_payroll_and_rejects_writes(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse("close_month") + "?month=2024-01")
+        self.assertRedirects(resp, reverse("report") + "?month=2024-01", fetch_redirect_response=False)
+
+        self.employee.day_shift_rate = 2000
+        self.employee.save()
+        self.assertEqual(get_month_payroll(self.month)[self.employee.id]["total"], 2700)
+
+        with self.assertRaises(MonthClosedError):
+            bulk_upsert_schedule([(self.employee.id, date(2024, 1, 3), "day")])
+        with self.assertRaises(MonthClosedError):
+            bulk_upsert_service_records([(self.employee.id, self.service.id, self.month, 5)])
+        cell = WorkSchedule.objects.get(date=date(2024, 1, 2))
+        cell.shift = "sick"
+        with self.assertRaises(MonthClosedError):
+            cell.save()
+        resp = self.client.post(
+            reverse("save_timesheet_cells"),
+            data=json.dumps({
+                "month": "2024-01", "loaded_at": timezone.now().isoformat(),
+                "cells": [{"employee": self.employee.id, "day": 5, "shift": "day"}],
+            }),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 409)
+        bulk_upsert_schedule([(self.employee.id, date(2024, 2, 1), "day")])
+
+        reopen_month(self.month)
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 3), "day")])
+        self.assertEqual(get_month_payroll(self.month)[self.employee.id]["total"], 5700)
+
+    def test_reads_and_exports_served_from_snapshot(self):
+        closed = close_month(self.month, self.user)
+        self.assertEqual(closed.closed_by, self.user)
+        self.assertTrue(closed.salary_file.name.endswith(".xlsx"))
+        with self.assertRaises(MonthClosedError):
+            close_month(self.month)
+
+        # Deleting an employee is still possible and does not change the report.
+        self.employee.delete()
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse("report") + "?month=2024-01")
+        self.assertFalse(any("core_workschedule" in q["sql"] for q in ctx.captured_queries))
+        [row] = resp.context["salary_summary"]
+        self.assertEqual((row["employee"].full_name, row["day"], row["total"]), ("Piece", 1, 2700))
+        self.assertEqual(resp.context["department_totals"][self.department.id]["total"], 2700)
+
+        for name, expected in [("export_salary_full", 2700), ("export_salary_advance", 1000)]:
+            resp = self.client.get(reverse(name) + "?month=2024-01")
+            ws = openpyxl.load_workbook(BytesIO(b"".join(resp.streaming_content))).active
+            self.assertEqual(ws.cell(row=2, column=1).value, "Piece")
+            self.assertEqual(ws.cell(row=2, column=9).value, expected)
+
+    def test_deleting_service_removes_closed_month_records(self):
+        close_month(self.month, self.user)
+        self.service.delete()
+        self.assertFalse(EmployeeServiceRecord.objects.exists())
+        self.assertEqual(get_month_payroll(self.month)[self.employee.id]["services"], 200)
+
+    def test_admin_edits_of_closed_month_are_rejected(self):
+        close_month(self.month, self.user)
+        self.client.force_login(self.user)
+        cell = WorkSchedule.objects.get(date=date(2024, 1, 2))
+
+        resp = self.client.post(reverse("admin:core_workschedule_change", args=[cell.pk]), {
+            "employee": self.employee.id, "date": "2024-02-02", "shift": "sick",
+        })
+        self.assertContains(resp, "Месяц закрыт")
+        resp = self.client.post(reverse("admin:core_workschedule_delete", args=[cell.pk]), {"post": "yes"})
+        self.assertEqual(resp.status_code, 302)
+        resp = self.client.post(reverse("admin:core_workschedule_changelist"), {
+            "action": "delete_selected", "_selected_action": [cell.pk], "post": "yes",
+        })
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(WorkSchedule.objects.get(pk=cell.pk).shift, "day")
+
+    def test_close_requires_permission(self):
+        resp = self.client.post(reverse("close_month") + "?month=2024-01")
+        self.assertEqual(resp.status_code, 302)
+        self.assertFalse(ClosedMonth.objects.exists())
+        WorkSchedule.objects.filter(date=date(2024, 1, 2)).delete()
+
+
+class BulkUpsertScheduleTests(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name="Dep")
+        self.position = Position.objects.create(name="Worker")
+        self.employee = Employee.objects.create(
+            full_name="John Doe", department=self.department, position=self.position
+        )
+
+    def test_counts_inserted_updated_unchanged(self):
+        WorkSchedule.objects.create(employee=self.employee, date=date(2024, 1, 1), shift="day")
+        WorkSchedule.objects.create(employee=self.employee, date=date(2024, 1, 2), shift="day")
+        result = bulk_upsert_schedule([
+            (self.employee.id, date(2024, 1, 1), "day"),
+            (self.employee.id, date(2024, 1, 2), "night"),
+            (self.employee.id, date(2024, 1, 3), "weekend"),
+            (self.employee.id, date(2024, 1, 4), "bogus"),
+        ])
+        self.assertEqual(result, {"inserted": 1, "updated": 1, "unchanged": 1})
+        shifts = dict(
+            WorkSchedule.objects.filter(employee=self.employee).values_list("date__day", "shift")
+        )
+        self.assertEqual(shifts, {1: "day", 2: "night", 3: "weekend"})
+
+    def test_history_written_only_for_changes(self):
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 1), "day")])
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 1), "day")])
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 1), "sick")])
+        history = WorkSchedule.history.filter(employee_id=self.employee.id).order_by("history_id")
+        self.assertEqual([h.history_type for h in history], ["+", "~"])
+        self.assertEqual(history.last().shift, "sick")
+        self.assertEqual(history.last().id, WorkSchedule.objects.get().id)
+
+    def test_query_count_independent_of_cells(self):
+        counts = []
+        for month, last_day in [(1, 2), (3, 31)]:
+            cells = [(self.employee.id, date(2024, month, d), "day") for d in range(1, last_day + 1)]
+            with CaptureQueriesContext(connection) as ctx:
+                bulk_upsert_schedule(cells)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class HistoryCompactionTests(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name="Dep")
+        position = Position.objects.create(name="Worker")
+        self.employee = Employee.objects.create(full_name="A", department=department, position=position)
+        self.history = WorkSchedule.history.filter(employee_id=self.employee.id)
+
+    def test_save_without_change_writes_no_history(self):
+        schedule = WorkSchedule.objects.create(employee=self.employee, date=date(2024, 1, 1), shift="day")
+        schedule.save()
+        WorkSchedule.objects.update_or_create(
+            employee=self.employee, date=date(2024, 1, 1), defaults={"shift": "day"}
+        )
+        schedule.shift = "night"
+        schedule.save()
+        self.assertEqual([h.history_type for h in self.history.order_by("history_id")], ["+", "~"])
+
+    def test_keeps_first_and_last_old_records(self):
+        for shift in ["day", "night", "sick", "day"]:
+            bulk_upsert_schedule([(self.employee.id, date(2024, 1, 1), shift)])
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 2), "day")])
+        old = timezone.now() - timedelta(days=400)
+        self.history.update(history_date=old)
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 1), "night")])
+        first, *_, last = self.history.filter(date=date(2024, 1, 1)).order_by("history_id")
+
+        self.assertEqual(
+            compact_schedule_history(old + timedelta(days=1), dry_run=True), {"cells": 1, "deleted": 2}
+        )
+        self.assertEqual(self.history.count(), 6)
+
+        out = StringIO()
+        call_command("compact_schedule_history", "--days", "30", "--batch-size", "1", stdout=out)
+        self.assertIn("Deleted 2 history rows of 1 cells", out.getvalue())
+        remaining = self.history.filter(date=date(2024, 1, 1)).order_by("history_id")
+        self.assertEqual([h.shift for h in remaining], ["day", "day", "night"])
+        self.assertEqual(remaining[0].history_id, first.history_id)
+        self.assertEqual(remaining[2].history_id, last.history_id)
+        self.assertEqual(self.history.filter(date=date(2024, 1, 2)).count(), 1)
+
+
+class PartitioningTests(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name="Dep")
+        position = Position.objects.create(name="Worker")
+        self.employee = Employee.objects.create(full_name="A", department=department, position=position)
+
+    def test_month_helpers(self):
+        self.assertEqual(add_months(date(2024, 11, 1), 3), date(2025, 2, 1))
+        self.assertEqual(add_months(date(2024, 1, 1), -1), date(2023, 12, 1))
+        self.assertEqual(partition_name("core_workschedule", date(2024, 2, 1)), "core_workschedule_p2024_02")
+
+    @skipIf(connection.vendor == "postgresql", "fallback of other backends")
+    def test_noop_without_postgres(self):
+        out = StringIO()
+        call_command("partition_schedule", "--convert", "--archive-before", "2024-01", stdout=out)
+        self.assertIn("requires PostgreSQL", out.getvalue())
+        self.assertEqual(ensure_partitions(date(2024, 1, 1)), [])
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 1), "day")])
+        self.assertEqual(WorkSchedule.objects.count(), 1)
+
+    @skipUnless(connection.vendor == "postgresql", "declarative partitioning")
+    def test_convert_create_and_detach(self):
+        bulk_upsert_schedule([(self.employee.id, date(2024, 1, 5), "day")])
+        self.assertIn("core_workschedule_p2024_01", convert_tables())
+
+        # Rows of months without a partition land in the default one and
+        # are moved out when the month partition is created.
+        bulk_upsert_schedule([(self.employee.id, date(2024, 3, 1), "night")])
+        self.assertIn("core_workschedule_p2024_03", ensure_partitions(date(2024, 2, 1), 2))
+        result = bulk_upsert_schedule([(self.employee.id, date(2024, 3, 1), "sick")])
+        self.assertEqual(result["updated"], 1)
+        self.assertEqual(WorkSchedule.history.filter(date=date(2024, 3, 1)).count(), 2)
+
+        rows = row_versions(date(2024, 1, 1), [self.employee.id])
+        detached = detach_partitions(date(2024, 2, 1))
+        self.assertIn("core_workschedule_p2024_01", detached)
+        self.assertNotEqual(row_versions(date(2024, 1, 1), [self.employee.id]), rows)
+        self.assertFalse(WorkSchedule.objects.filter(date__lt=date(2024, 2, 1)).exists())
+        self.assertEqual(WorkSchedule.objects.get().shift, "sick")
+
+
+class DemoDataTests(TestCase):
+    def test_generate_dataset(self):
+        result = generate_dataset(departments=2, employees=6, months=2, start=date(2024, 1, 1), services=3, seed=1)
+        self.assertEqual(result["employees"], 6)
+        self.assertEqual(result["cells"], 6 * (31 + 29))
+        self.assertEqual(WorkSchedule.objects.count(), result["cells"])
+        self.assertEqual(WorkSchedule.history.count(), result["cells"] + result["edits"])
+        self.assertEqual(EmployeeServiceRecord.objects.count(), result["service_records"])
+        self.assertEqual(
+            read_month_payroll(date(2024, 2, 1)),
+            compute_month_payroll(date(2024, 2, 1)).to_dict("index"),
+        )
+
+    def test_bench_suite_writes_and_compares_baseline(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        baseline = f"{tmp}/baseline.json"
+        call_command("bench_suite", "--sizes", "3", "--months", "1", "--baseline", baseline,
+                     "--update-baseline", stdout=StringIO())
+        with open(baseline) as f:
+            results = json.load(f)[connection.vendor]["3"]
+        self.assertEqual(set(results["report"]), {"ms", "queries", "peak_kib"})
+        self.assertIn("import_timesheet", results)
+        self.assertFalse(Employee.objects.exists())
+
+        out = StringIO()
+        call_command("bench_suite", "--sizes", "3", "--months", "1", "--baseline", baseline,
+                     "--tolerance", "1000", stdout=out)
+        self.assertIn("No regressions", out.getvalue())
+
+    def test_bench_suite_leaves_deployed_data_alone(self):
+        cache.set("sentinel", 1)
+        call_command("bench_suite", "--sizes", "3", "--months", "1", "--baseline", "/nonexistent", stdout=StringIO())
+        self.assertEqual(cache.get("sentinel"), 1)
+
+        department = Department.objects.create(name="Dep")
+        Employee.objects.create(full_name="A", department=department, position=Position.objects.create(name="P"))
+        with self.assertRaisesMessage(CommandError, "empty scratch database"):
+            call_command("bench_suite", "--sizes", "3", "--months", "1", stdout=StringIO())
+
+
+class BackgroundJobTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.department = Department.objects.create(name="Dep")
+        self.position = Position.objects.create(name="Worker")
+        self.employee = Employee.objects.create(
+            full_name="John Doe", department=self.department, position=self.position
+        )
+        self.user = get_user_model().objects.create_superuser("admin", "a@example.com", "pass")
+
+    def test_export_job_runs_and_downloads(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse("start_job", args=["export_timesheet"]) + "?month=2024-01")
+        self.assertEqual(resp.status_code, 202)
+        job = resp.json()
+        self.assertEqual(job["status"], JobStatus.DONE)
+        status = self.client.get(job["status_url"]).json()
+        self.assertEqual(status["progress"], 100)
+        download = self.client.get(status["download_url"])
+        self.assertEqual(download.status_code, 200)
+        ws = openpyxl.load_workbook(BytesIO(b"".join(download.streaming_content))).active
+        self.assertEqual(ws.max_row, 2)
+
+    def test_import_job_reports_result(self):
+        self.client.force_login(self.user)
+        wb = openpyxl.Workbook()
+        wb.active.append(["ФИО", "01"])
+        wb.active.append(["John Doe", "Д"])
+        buffer = BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+        buffer.name = "tabel.xlsx"
+        resp = self.client.post(
+            reverse("start_job", args=["import_timesheet"]) + "?month=2024-01", {"xlsx_file": buffer}
+        )
+        self.assertEqual(resp.json()["result"]["inserted"], 1)
+        self.assertTrue(WorkSchedule.objects.filter(employee=self.employee, date=date(2024, 1, 1)).exists())
+        # The upload is not kept once the import has run.
+        self.assertFalse(Job.objects.get().input_file)
+        self.assertEqual(list(Path(self.media_root, "jobs", "input").iterdir()), [])
+
+    def test_stale_running_job_is_failed(self):
+        self.client.force_login(self.user)
+        job = Job.objects.create(
+            kind="export_services", params={"month": "2024-01"}, created_by=self.user,
+            status=JobStatus.RUNNING, started_at=timezone.now() - timedelta(hours=2),
+        )
+        fresh = Job.objects.create(
+            kind="export_services", params={"month": "2024-01"},
+            status=JobStatus.RUNNING, started_at=timezone.now(),
+        )
+
+        resp = self.client.get(reverse("job_status", args=[job.pk]))
+        self.assertEqual(resp.json()["status"], JobStatus.FAILED)
+
+        job.status = JobStatus.RUNNING
+        job.save()
+        call_command("run_jobs", "--once", stdout=StringIO())
+        self.assertEqual(Job.objects.get(pk=job.pk).status, JobStatus.FAILED)
+        self.assertEqual(Job.objects.get(pk=fresh.pk).status, JobStatus.RUNNING)
+
+    def test_job_failed_as_stale_while_running_stays_failed(self):
+        def handler(job):
+            Job.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=2))
+            fail_stale_jobs()
+            return {"rows": 1}
+
+        job = Job.objects.create(kind="slow")
+        with mock.patch.dict(JOB_KINDS, {"slow": (handler, None)}):
+            run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertIsNone(job.result)
+
+    def test_old_result_files_are_deleted(self):
+        self.client.force_login(self.user)
+        old = self.client.post(reverse("start_job", args=["export_services"]) + "?month=2024-01").json()
+        Job.objects.filter(pk=old["id"]).update(finished_at=timezone.now() - timedelta(days=8))
+        self.client.post(reverse("start_job", args=["export_services"]) + "?month=2024-01")
+
+        self.assertFalse(Job.objects.get(pk=old["id"]).result_file)
+        self.assertEqual(len(list(Path(self.media_root, "jobs", "output").iterdir())), 1)
+        self.assertNotIn("download_url", self.client.get(old["status_url"]).json())
+
+    def test_start_job_requires_permission(self):
+        resp = self.client.post(reverse("start_job", args=["export_salary_full"]))
+        self.assertEqual(resp.status_code, 403)
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(JOB_RUNNER="worker")
+    def test_worker_command_runs_pending_jobs(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse("start_job", args=["export_services"]) + "?month=2024-01")
+        self.assertEqual(resp.json()["status"], JobStatus.PENDING)
+        call_command("run_jobs", "--once", stdout=StringIO())
+        self.assertEqual(Job.objects.get().status, JobStatus.DONE)
+
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        profiling = override_settings(PROFILING_ENABLED=True, PROFILING_DIR=self.profile_dir, PROFILING_KEEP=2)
+        profiling.enable()
+        self.addCleanup(profiling.disable)
+
+        department = Department.objects.create(name="Dep")
+        position = Position.objects.create(name="Worker")
+        Employee.objects.create(full_name="A", department=department, position=position)
+        self.staff = get_user_model().objects.create_superuser("admin", "a@example.com", "pass")
+        self.user = get_user_model().objects.create_user("user", "u@example.com", "pass")
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE id IN (%s, %s, %s) AND a = 'x' LIMIT 21"),
+            "SELECT * FROM t WHERE id IN (%s, ...) AND a = ? LIMIT N",
+        )
+
+    def test_staff_flag_records_profile(self):
+        self.client.force_login(self.staff)
+        resp = self.client.get(reverse("timesheet"), {"month": "2024-01", "_profile": "1"})
+        name = resp["X-Profile-Id"]
+        self.assertEqual(list_profile_names(), [name])
+        with open(f"{self.profile_dir}/{name}.json") as f:
+            summary = json.load(f)
+        self.assertEqual(summary["status"], 200)
+        self.assertEqual(summary["queries"], sum(group["count"] for group in summary["sql"]))
+        self.assertGreater(summary["queries"], 0)
+        self.assertGreater(summary["template_ms"], 0)
+        self.assertGreater(summary["peak_kib"], 0)
+
+    def test_flag_requires_staff_or_token(self):
+        self.client.force_login(self.user)
+        self.assertNotIn("X-Profile-Id", self.client.get(reverse("report"), {"_profile": "1"}))
+        self.assertNotIn("X-Profile-Id", self.client.get(reverse("report"), {"_profile": "forged:token"}))
+        self.assertIn("X-Profile-Id", self.client.get(reverse("report"), {"_profile": profile_token()}))
+        with override_settings(PROFILING_ENABLED=False):
+            self.assertNotIn("X-Profile-Id", self.client.get(reverse("report"), {"_profile": profile_token()}))
+
+    def test_keeps_last_profiles_and_admin_pages(self):
+        self.client.force_login(self.staff)
+        names = [self.client.get(reverse("report"), {"_profile": "1"})["X-Profile-Id"] for _ in range(3)]
+        self.assertEqual(sorted(list_profile_names()), sorted(names[1:]))
+
+        resp = self.client.get(reverse("admin_profiles"))
+        self.assertContains(resp, reverse("admin_profile_download", args=[names[-1]]))
+        resp = self.client.get(reverse("admin_profile", args=[names[-1]]), {"sort": "tottime"})
+        self.assertContains(resp, "core_department")
+        resp = self.client.get(reverse("admin_profile_download", args=[names[-1]]))
+        self.assertEqual(resp["Content-Disposition"], f'attachment; filename="{names[-1]}.pstats"')
+        b"".join(resp.streaming_content)
+        self.assertEqual(self.client.get(reverse("admin_profile_download", args=["..%2Fsecret"])).status_code, 404)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("admin_profiles")).status_code, 302)
+
+
+BUDGET_MONTH = date(2024, 1, 1)
+# Rows a bulk write may split into per query; on SQLite bulk_create batches
+# are bounded by the 999 parameter limit, so written rows add queries.
+BUDGET_ROWS_PER_BATCH = 100
+
+
+def _batches(rows: int) -> int:
+    return -(-rows // BUDGET_ROWS_PER_BATCH)
+
+
+def _upload(rows, name="upload.xlsx") -> BytesIO:
+    wb = openpyxl.Workbook()
+    for row in rows:
+        wb.active.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    buffer.seek(0)
+    buffer.name = name
+    return buffer
+
+
+class QueryBudgetMixin:
+    """Every view and import must run in a number of queries that does not
+    grow with headcount.
+
+    Each test declares a fixed budget; the same test runs against 10, 100
+    and 1,000 generated employees (one subclass per size), so a query per
+    employee, row or cell fails at the larger sizes. Bulk writes may add
+    ``per_batch`` queries per ``BUDGET_ROWS_PER_BATCH`` written rows.
+    """
+
+    employees = 10
+    import_days = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_dataset(
+            departments=max(cls.employees // 50, 2), employees=cls.employees, months=1,
+            start=BUDGET_MONTH, services=4, edits=0.01, seed=0,
+        )
+        # The lazy fill of missing rollup rows is a one-off after bulk loads.
+        read_month_payroll(BUDGET_MONTH)
+        cls.department = Department.objects.order_by("pk").first()
+        cls.staff = list(Employee.objects.select_related("department", "position").order_by("full_name"))
+        cls.services = list(Service.objects.order_by("name"))
+        cls.user = get_user_model().objects.create_superuser("budget", "b@example.com", "pass")
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def assertQueryBudget(self, budget, func, *, rows=0, per_batch=0):
+        # Counted with a wrapper: the test client clears connection.queries per request.
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            response = func()
+            if getattr(response, "streaming", False):
+                b"".join(response.streaming_content)
+        limit = budget + per_batch * _batches(rows)
+        self.assertLessEqual(
+            len(queries), limit,
+            f"{len(queries)} queries for {self.employees} employees, budget {limit}:\n" + "\n".join(queries),
+        )
+        return response
+
+    def get(self, name, **params):
+        return lambda: self.client.get(reverse(name), {"month": f"{BUDGET_MONTH:%Y-%m}", **params})
+
+    def test_timesheet(self):
+        self.assertQueryBudget(11, self.get("timesheet"))
+        self.assertQueryBudget(11, self.get("timesheet", department=self.department.pk))
+
+    def test_timesheet_rows(self):
+        self.assertQueryBudget(7, self.get("timesheet_rows", html=1, page=2, page_size=10))
+
+    def test_services(self):
+        self.assertQueryBudget(6, self.get("services"))
+
+    def test_report(self):
+        self.assertQueryBudget(9, self.get("report"))
+        self.assertQueryBudget(9, self.get("report", type="advance"))
+
+    def test_analytics(self):
+        self.assertQueryBudget(2, self.get("analytics"))
+
+    def test_exports(self):
+        for name in ("export_timesheet", "export_services", "export_salary_report",
+                     "export_salary_full", "export_salary_advance"):
+            with self.subTest(name):
+                cache.clear()
+                self.assertQueryBudget(6, self.get(name))
+
+    def test_send_timesheet(self):
+        self.assertQueryBudget(5, self.get("send_timesheet"))
+
+    def test_timesheet_post(self):
+        data = {f"shift_{e.id}_{day}": "sick" for e in self.staff for day in range(1, self.import_days + 1)}
+        self.assertQueryBudget(
+            14, lambda: self.client.post(reverse("timesheet") + "?month=2024-01", data),
+            rows=len(data), per_batch=2,
+        )
+
+    def test_services_post(self):
+        data = {f"s_{e.id}_{s.id}": 7 for e in self.staff for s in self.services}
+        self.assertQueryBudget(
+            13, lambda: self.client.post(reverse("services") + "?month=2024-01", data),
+            rows=len(data), per_batch=1,
+        )
+
+    def test_apply_schedule_bulk(self):
+        template = ScheduleTemplate.objects.first()
+        payload = {"month": "2024-01", "department_id": self.department.pk, "template_id": template.pk,
+                   "start_day": 1, "end_day": self.import_days}
+        cells = self.department.employee_set.count() * self.import_days
+        self.assertQueryBudget(
+            16, lambda: self.client.post(reverse("apply_schedule_bulk"), json.dumps(payload),
+                                         content_type="application/json"),
+            rows=cells, per_batch=1,
+        )
+
+    def test_save_timesheet_cells(self):
+        cells = [{"employee": e.id, "day": 1, "shift": "vacation"} for e in self.staff]
+        payload = {"month": "2024-01", "loaded_at": timezone.now().isoformat(), "cells": cells}
+        self.assertQueryBudget(
+            17, lambda: self.client.post(reverse("save_timesheet_cells"), json.dumps(payload),
+                                         content_type="application/json"),
+            rows=len(cells), per_batch=3,
+        )
+
+    def timesheet_sheet(self):
+        return _upload(
+            [["ФИО", *range(1, self.import_days + 1)]]
+            + [[e.full_name, *["Б"] * self.import_days] for e in self.staff]
+        )
+
+    def test_import_timesheet(self):
+        rows = len(self.staff) * self.import_days
+        self.assertQueryBudget(
+            15, lambda: self.client.post(reverse("import_timesheet") + "?month=2024-01",
+                                         {"xlsx_file": self.timesheet_sheet()}),
+            rows=rows, per_batch=3,
+        )
+
+    def test_import_services(self):
+        sheet = _upload(
+            [["ФИО", "Месяц", *(s.name for s in self.services)]]
+            + [[e.full_name, "2024-01", *[9] * len(self.services)] for e in self.staff]
+        )
+        self.assertQueryBudget(
+            12, lambda: self.client.post(reverse("import_services"), {"xlsx_file": sheet}),
+            rows=len(self.staff) * len(self.services), per_batch=2,
+        )
+
+    def test_admin_import_employees(self):
+        sheet = _upload(
+            [["ФИО", "Отдел", "Должность", "Дневная ставка", "Ночная ставка"]]
+            + [[e.full_name, e.department.name, e.position.name, 5000, 6000] for e in self.staff]
+        )
+        self.assertQueryBudget(
+            13, lambda: self.client.post(reverse("admin:import_employees"), {"xlsx_file": sheet}),
+            rows=len(self.staff), per_batch=2,
+        )
+
+    def test_jobs(self):
+        response = self.assertQueryBudget(
+            15, lambda: self.client.post(reverse("start_job", args=["export_salary_full"]) + "?month=2024-01"),
+        )
+        job_id = response.json()["id"]
+        self.assertQueryBudget(3, lambda: self.client.get(reverse("job_status", args=[job_id])))
+        self.assertQueryBudget(3, lambda: self.client.get(reverse("job_download", args=[job_id])))
+        self.assertQueryBudget(
+            19, lambda: self.client.post(reverse("start_job", args=["import_timesheet"]) + "?month=2024-01",
+                                         {"xlsx_file": self.timesheet_sheet()}),
+            rows=len(self.staff) * self.import_days, per_batch=3,
+        )
+
+    def test_close_and_reopen_month(self):
+        self.assertQueryBudget(
+            17, lambda: self.client.post(reverse("close_month") + "?month=2024-01", {"action": "close"}),
+            rows=len(self.staff), per_batch=2,
+        )
+        self.assertTrue(ClosedMonth.objects.exists())
+        self.assertQueryBudget(
+            7, lambda: self.client.post(reverse("close_month") + "?month=2024-01", {"action": "reopen"}),
+        )
+
+
+class QueryBudget10Tests(QueryBudgetMixin, TestCase):
+    employees = 10
+
+
+class QueryBudget100Tests(QueryBudgetMixin, TestCase):
+    employees = 100
+
+
+class QueryBudget1000Tests(QueryBudgetMixin, TestCase):
+    employees = 1000
@@ -1,6 +1,9 @@
 from django.urls import path
 from .views import (
     timesheet_view,
+    timesheet_rows,
+    apply_schedule_bulk,
+    save_timesheet_cells,
     export_timesheet_xlsx,
     import_timesheet_view,
     services_view,
@@ -8,13 +11,21 @@ from .views import (
     import_services_view,
     export_salary_report_xlsx,
     report_view,
+    close_month_view,
     export_salary_full_xlsx,
     export_salary_advance_xlsx,
     send_timesheet_email,
+    analytics_view,
+    start_job,
+    job_status,
+    job_download,
 )
 
 urlpatterns = [
     path("timesheet/", timesheet_view, name="timesheet"),
+    path("timesheet/rows/", timesheet_rows, name="timesheet_rows"),
+    path("timesheet/apply-bulk/", apply_schedule_bulk, name="apply_schedule_bulk"),
+    path("timesheet/cells/", save_timesheet_cells, name="save_timesheet_cells"),
     path("timesheet/import/", import_timesheet_view, name="import_timesheet"),
     path("timesheet/export/", export_timesheet_xlsx, name="export_timesheet"),
     path("timesheet/send/", send_timesheet_email, name="send_timesheet"),
@@ -23,6 +34,11 @@ urlpatterns = [
     path("services/export/", export_services_xlsx, name="export_services"),
     path("report/export/", export_salary_report_xlsx, name="export_salary_report"),
     path("report/", report_view, name="report"),
+    path("report/close/", close_month_view, name="close_month"),
     path("export-advance/", export_salary_advance_xlsx, name="export_salary_advance"),
     path("export-salary/", export_salary_full_xlsx, name="export_salary_full"),
+    path("analytics/", analytics_view, name="analytics"),
+    path("jobs/start/<str:kind>/", start_job, name="start_job"),
+    path("jobs/<int:pk>/", job_status, name="job_status"),
+    path("jobs/<int:pk>/download/", job_download, name="job_download"),
 ]
@@ -1,30 +1,52 @@
-from django.shortcuts import render, redirect
-from datetime import date, timedelta
+from django.shortcuts import render, redirect, get_object_or_404
+from django.core.paginator import Paginator
+from django.template.loader import render_to_string
+from django.http import JsonResponse, FileResponse, Http404
+from django.views.decorators.http import require_POST
+from django.contrib import messages
+from django.core.mail import EmailMessage
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import date, datetime, timedelta
 from calendar import monthrange
 from django.db.models import Q
-from decimal import Decimal
+from io import BytesIO
 
-import openpyxl
-from openpyxl.styles import Font
 import pandas as pd
 import json
 
 from helpers.utils import (
     parse_month,
     get_employees_queryset,
-    get_schedule_maps,
+    MonthSchedule,
+    get_last_shifts,
+    month_bounds,
     build_service_data,
-    get_working_days,
+    partition_services,
 )
-from services.payroll import (
-    count_shifts,
-    calculate_shift_salary,
-    calculate_service_sum,
+from helpers.timesheet_grid import SHIFT_CHOICES, build_timesheet_rows
+from core.templatetags.timesheet_tags import timesheet_row
+from services.month_cache import cached_rows, get_payroll_rows, read_payroll
+from services.month_close import artifact_filenames, close_month, reopen_month
+from services.snapshots import MonthClosedError, get_closed_month
+from services.payroll import calculate_service_sum
+from services.imports import import_timesheet, import_services
+from services.jobs import JOB_KINDS, enqueue, fail_stale_jobs, is_stale
+from services.service_records import bulk_upsert_service_records
+from services.schedule import (
+    bulk_upsert_schedule,
+    apply_schedule_delta,
+    rotation_offsets,
+    rotation_cells,
 )
 from utils.excel_export import (
     workbook_to_response,
-    autofit_columns,
     build_timesheet_workbook,
+    build_services_workbook,
+    build_salary_report_workbook,
+    build_salary_workbook,
 )
 
 from .models import (
@@ -35,117 +57,263 @@ from .models import (
     EmployeeServiceRecord,
     Department,
     ScheduleTemplate,
+    Job,
+    JobStatus,
 )
 
 
-def timesheet_view(request):
+TIMESHEET_PAGE_SIZE = 50
+TIMESHEET_MAX_PAGE_SIZE = 500
 
-    first_day = parse_month(request)
-    year, month = first_day.year, first_day.month
-    days_in_month = monthrange(year, month)[1]
-    today = date.today()
 
+def _days_info(first_day: date) -> list[dict]:
+    today = date.today()
     day_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
     days_info = []
-    for d in range(1, days_in_month + 1):
-        dt = date(year, month, d)
+    for d in range(1, monthrange(first_day.year, first_day.month)[1] + 1):
+        dt = first_day.replace(day=d)
         days_info.append({
             'num': d,
             'weekday': day_names[dt.weekday()],
             'is_today': dt == today,
             'is_weekend': dt.weekday() >= 5,
         })
+    return days_info
 
-    department_id = request.GET.get("department")
-    employees = get_employees_queryset().order_by("department__name", "full_name")
+
+def _timesheet_employees(department_id):
+    employees = get_employees_queryset().order_by("department__name", "full_name", "id")
     if department_id:
         employees = employees.filter(department_id=department_id)
+    return employees
+
+
+def _timesheet_page(first_day: date, department_id, page_number, page_size: int, *, with_data: bool = False):
+    """Return a page of timesheet employees with their rendered rows and last shifts.
+
+    Rows come from the per-row fragment cache; only employees whose schedule
+    changed since their row was cached are rendered again, from their own
+    schedule and payroll rows rather than the whole month's. With ``with_data``
+    the schedule and payroll of the page's employees are read once, used for
+    those rows and returned as well; otherwise ``None`` is returned for them.
+    """
+    page = Paginator(_timesheet_employees(department_id), page_size).get_page(page_number)
+    employees = {e.id: e for e in page.object_list}
+    data = (
+        (MonthSchedule.load(first_day, employee_ids=list(employees)), read_payroll(first_day, employees))
+        if with_data else None
+    )
+
+    def render_rows(missing):
+        schedule, payroll = data or (MonthSchedule.load(first_day, employee_ids=missing), read_payroll(first_day, missing))
+        rows = build_timesheet_rows(
+            [employees[employee_id] for employee_id in missing], schedule, payroll, _days_info(first_day),
+        )
+        return {
+            row["employee"].id: render_to_string("core/_timesheet_row.html", timesheet_row(row))
+            for row in rows
+        }
+
+    today = date.today()
+    html = cached_rows(
+        "timesheet", first_day, employees, render_rows,
+        # The row highlights today's column, so the fragment is per day for the current month.
+        extra=today.isoformat() if (today.year, today.month) == (first_day.year, first_day.month) else "",
+    )
+    rows = [{"employee": employee, "html": html[employee_id]} for employee_id, employee in employees.items()]
+    last_shifts = get_last_shifts(first_day, list(employees))
+    return page, rows, last_shifts, data
+
+
+def timesheet_view(request):
+    """Timesheet grid. Only the first page of rows is rendered here, the rest
+    is loaded by the page from ``timesheet_rows`` while scrolling."""
+    first_day = parse_month(request)
+    year, month = first_day.year, first_day.month
+    days_in_month = monthrange(year, month)[1]
+
+    department_id = request.GET.get("department")
+    employees = _timesheet_employees(department_id)
 
     if request.method == "POST":
-        for employee in employees:
+        cells = []
+        for employee_id in employees.values_list("id", flat=True):
             for day in range(1, days_in_month + 1):
-                field_name = f"shift_{employee.id}_{day}"
-                shift_value = request.POST.get(field_name)
+                shift_value = request.POST.get(f"shift_{employee_id}_{day}")
                 if shift_value:
-                    date_obj = date(year, month, day)
-                    WorkSchedule.objects.update_or_create(
-                        employee=employee,
-                        date=date_obj,
-                        defaults={"shift": shift_value}
-                    )
+                    cells.append((employee_id, date(year, month, day), shift_value))
+        try:
+            result = bulk_upsert_schedule(cells)
+        except MonthClosedError as exc:
+            messages.error(request, str(exc))
+        else:
+            messages.success(
+                request,
+                f"Табель сохранён: добавлено {result['inserted']}, "
+                f"изменено {result['updated']}, без изменений {result['unchanged']}",
+            )
         redirect_url = f"{request.path}?month={first_day.strftime('%Y-%m')}"
         if department_id:
             redirect_url += f"&department={department_id}"
         return redirect(redirect_url)
 
-    schedule_map, last_shift_map = get_schedule_maps(first_day)
-
-    salary_summary = {}
-    for employee in employees:
-        shifts = schedule_map.get(employee.id, {})
-        day_count, night_count = count_shifts(shifts)
-        total_salary = calculate_shift_salary(employee, day_count, night_count)
-
-        salary_summary[employee.id] = {
-            "day": day_count,
-            "night": night_count,
-            "total": float(total_salary),
-        }
+    loaded_at = timezone.now()
+    page, rows, last_shift_map, _ = _timesheet_page(first_day, department_id, 1, TIMESHEET_PAGE_SIZE)
 
     departments = Department.objects.all()
     templates = list(ScheduleTemplate.objects.all())
     templates_json = {t.id: t.sequence for t in templates}
     return render(request, "core/timesheet.html", {
-        "employees": employees,
+        "employees": [row["employee"] for row in rows],
+        "rows": rows,
+        "page": page,
         "days": range(1, days_in_month + 1),
-        "days_info": days_info,
+        "days_info": _days_info(first_day),
         "month": first_day,
-        "schedule": schedule_map,
-        "salary": salary_summary,
-        "shift_choices": [
-        ("day", "Д"),
-        ("night", "Н"),
-        ("weekend", "В"),
-        ("vacation", "О"),
-        ("sick", "Б"),
-        ("partial", "П"),
-        ],
+        "shift_choices": SHIFT_CHOICES,
         "departments": departments,
         "selected_department": department_id,
-        "last_shifts": last_shift_map,
+        "last_shifts_json": json.dumps(last_shift_map),
         "schedule_templates": templates,
         "templates_json": templates_json,
+        "loaded_at": loaded_at.isoformat(),
     })
 
 
+def timesheet_rows(request):
+    """JSON page of timesheet rows: cells, last shift of the previous month, salary.
+
+    Query parameters: ``month``, ``department``, ``page`` and ``page_size``.
+    With ``html=1`` the rendered grid rows are included for the page to insert.
+    ``loaded_at`` is sent back with cells of these rows when they are saved.
+    """
+    first_day = parse_month(request)
+    department_id = request.GET.get("department")
+    try:
+        page_size = min(int(request.GET.get("page_size", TIMESHEET_PAGE_SIZE)), TIMESHEET_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({"status": "error", "message": "Некорректный размер страницы"}, status=400)
+    if page_size < 1:
+        return JsonResponse({"status": "error", "message": "Некорректный размер страницы"}, status=400)
+
+    # Taken before reading, so edits made while the page is built count as newer.
+    loaded_at = timezone.now()
+    # Cells and salaries come from the page's own rows, not the whole month.
+    page, rows, last_shifts, (schedule, payroll) = _timesheet_page(
+        first_day, department_id, request.GET.get("page"), page_size, with_data=True,
+    )
+    payload = {
+        "status": "ok",
+        "loaded_at": loaded_at.isoformat(),
+        "page": page.number,
+        "pages": page.paginator.num_pages,
+        "count": page.paginator.count,
+        "has_next": page.has_next(),
+        "rows": [
+            {
+                "id": row["employee"].id,
+                "full_name": row["employee"].full_name,
+                "department": row["employee"].department.name,
+                "cells": schedule.row(row["employee"].id),
+                "last_shift": last_shifts.get(row["employee"].id, ""),
+                "salary": {
+                    key: payroll.get(row["employee"].id, {}).get(key, 0) for key in ("day", "night", "total")
+                },
+            }
+            for row in rows
+        ],
+    }
+    if request.GET.get("html"):
+        payload["html"] = render_to_string("core/_timesheet_rows.html", {"rows": rows})
+    return JsonResponse(payload)
+
+
 @require_POST
 def apply_schedule_bulk(request):
-    """Apply the same shift to all employees in a department for a date range."""
+    """Apply a shift or a schedule template to a whole department for a date range.
+
+    With ``template_id`` the template sequence is rolled out per employee,
+    continuing from their last shift of the previous month unless an explicit
+    offset is passed in ``offsets`` (``{employee_id: offset}``).
+    """
     try:
         data = json.loads(request.body.decode())
         month_str = data.get("month")
         department_id = data.get("department_id")
         shift = data.get("shift")
+        template_id = data.get("template_id")
         start_day = int(data.get("start_day"))
         end_day = int(data.get("end_day"))
 
-        if not all([month_str, department_id, shift]):
+        if not all([month_str, department_id]) or not (shift or template_id):
             return JsonResponse({"status": "error", "message": "Invalid data"}, status=400)
 
         year, month = [int(p) for p in month_str.split("-")]
-        employees = Employee.objects.filter(department_id=department_id)
-        for emp in employees:
-            for d in range(start_day, end_day + 1):
-                WorkSchedule.objects.update_or_create(
-                    employee=emp,
-                    date=date(year, month, d),
-                    defaults={"shift": shift},
-                )
-        return JsonResponse({"status": "ok"})
+        first_day = date(year, month, 1)
+        days = range(max(start_day, 1), min(end_day, monthrange(year, month)[1]) + 1)
+        employee_ids = list(
+            Employee.objects.filter(department_id=department_id).values_list("id", flat=True)
+        )
+        if template_id:
+            sequence = ScheduleTemplate.objects.get(pk=template_id).sequence
+            offsets = rotation_offsets(sequence, employee_ids, first_day)
+            offsets.update({int(k): int(v) for k, v in (data.get("offsets") or {}).items()})
+            cells = rotation_cells(employee_ids, first_day, days, sequence, offsets)
+        else:
+            cells = [
+                (emp_id, date(year, month, d), shift)
+                for emp_id in employee_ids
+                for d in days
+            ]
+        result = bulk_upsert_schedule(cells)
+        return JsonResponse({"status": "ok", **result})
     except Exception as exc:
         return JsonResponse({"status": "error", "message": str(exc)}, status=400)
 
 
+@require_POST
+def save_timesheet_cells(request):
+    """Save only the cells edited on the timesheet page.
+
+    Expects ``{"month": "YYYY-MM", "loaded_at": iso, "cells": [{"employee", "day", "shift", "loaded_at"}]}``;
+    a cell's own ``loaded_at`` (when its row came from a later page) overrides
+    the top-level one, and a time without an offset is taken in the current
+    time zone. Unknown employees are rejected with 400. Returns 409 with the list of conflicting cells if any
+    of them were changed by someone else after they were loaded.
+    """
+    try:
+        data = json.loads(request.body.decode())
+        year, month = [int(p) for p in data["month"].split("-")]
+        cells = []
+        loaded_at: dict[int, datetime] = {}
+        for c in data.get("cells", []):
+            employee_id = int(c["employee"])
+            cell_loaded_at = parse_datetime(c.get("loaded_at") or data["loaded_at"])
+            if cell_loaded_at is None:
+                raise ValueError("Invalid loaded_at")
+            if timezone.is_naive(cell_loaded_at):
+                cell_loaded_at = timezone.make_aware(cell_loaded_at)
+            loaded_at[employee_id] = min(cell_loaded_at, loaded_at.get(employee_id, cell_loaded_at))
+            cells.append((employee_id, date(year, month, int(c["day"])), c["shift"]))
+    except (KeyError, TypeError, ValueError) as exc:
+        return JsonResponse({"status": "error", "message": str(exc)}, status=400)
+
+    unknown = set(loaded_at) - set(Employee.objects.filter(id__in=list(loaded_at)).values_list("id", flat=True))
+    if unknown:
+        return JsonResponse(
+            {"status": "error", "message": f"Неизвестные сотрудники: {', '.join(map(str, sorted(unknown)))}"},
+            status=400,
+        )
+
+    try:
+        result, conflicts = apply_schedule_delta(cells, loaded_at)
+    except MonthClosedError as exc:
+        return JsonResponse({"status": "error", "message": str(exc)}, status=409)
+    if conflicts:
+        return JsonResponse({"status": "conflict", "conflicts": conflicts}, status=409)
+    return JsonResponse({"status": "ok", "loaded_at": timezone.now().isoformat(), **result})
+
+
 def export_timesheet_xlsx(request):
     first_day = parse_month(request)
     wb = build_timesheet_workbook(first_day)
@@ -181,261 +349,130 @@ def send_timesheet_email(request):
 def import_timesheet_view(request):
     """Import work schedules from uploaded Excel file."""
     first_day = parse_month(request)
-    year, month = first_day.year, first_day.month
-    days_in_month = monthrange(year, month)[1]
 
+    report = None
     if request.method == "POST" and request.FILES.get("xlsx_file"):
-        wb = openpyxl.load_workbook(request.FILES["xlsx_file"])
-        ws = wb.active
-
-        shift_map = {
-            "Д": "day",
-            "д": "day",
-            "Н": "night",
-            "н": "night",
-            "В": "weekend",
-            "в": "weekend",
-            "О": "vacation",
-            "о": "vacation",
-            "Б": "sick",
-            "б": "sick",
-            "П": "partial",
-            "п": "partial",
-            "Нп": "partial",
-            "нп": "partial",
-            "НП": "partial",
-        }
+        try:
+            report = import_timesheet(request.FILES["xlsx_file"], first_day)
+        except MonthClosedError as exc:
+            messages.error(request, str(exc))
 
-        for row in ws.iter_rows(min_row=2):
-            full_name = str(row[0].value).strip() if row[0].value else None
-            if not full_name:
-                continue
-            try:
-                employee = Employee.objects.get(full_name=full_name)
-            except Employee.DoesNotExist:
-                continue
-
-            for day in range(1, min(days_in_month, len(row) - 1) + 1):
-                raw = row[day].value
-                if raw is None:
-                    continue
-                shift = shift_map.get(str(raw).strip())
-                if not shift:
-                    continue
-                date_obj = date(year, month, day)
-                WorkSchedule.objects.update_or_create(
-                    employee=employee,
-                    date=date_obj,
-                    defaults={"shift": shift},
-                )
-
-        return redirect(f"{request.path}?month={first_day.strftime('%Y-%m')}")
-
-    return render(request, "core/import_timesheet.html", {"month": first_day})
+    return render(request, "core/import_timesheet.html", {"month": first_day, "report": report})
 
 def services_view(request):
     first_day = parse_month(request)
-    year, month = first_day.year, first_day.month
     employees = get_employees_queryset()
-    services = Service.objects.all()
+    services = list(Service.objects.all())
+    services_by_kind = partition_services(services)
     selected_department = request.GET.get("department")
 
     if selected_department:
         employees = employees.filter(department_id=selected_department)
 
     if request.method == "POST":
-        for employee in employees:
-            # Используем фильтр по типу сотрудника
-            filtered_services = services.filter(for_salary_based=employee.is_fixed_salary)
-            for service in filtered_services:
-                field = f"s_{employee.id}_{service.id}"
-                qty = request.POST.get(field)
+        records = []
+        for employee_id, is_fixed_salary in employees.values_list("id", "is_fixed_salary"):
+            # Услуги зависят от типа оплаты сотрудника
+            for service in services_by_kind[is_fixed_salary]:
+                qty = request.POST.get(f"s_{employee_id}_{service.id}")
                 if qty:
-                    qty = int(qty)
-                    EmployeeServiceRecord.objects.update_or_create(
-                        employee=employee,
-                        service=service,
-                        month=first_day,
-                        defaults={"quantity": qty}
-                    )
+                    try:
+                        records.append((employee_id, service.id, first_day, int(qty)))
+                    except ValueError:
+                        continue
+        try:
+            result = bulk_upsert_service_records(records)
+        except MonthClosedError as exc:
+            messages.error(request, str(exc))
+        else:
+            messages.success(
+                request,
+                f"Услуги сохранены: добавлено {result['inserted']}, "
+                f"изменено {result['updated']}, без изменений {result['unchanged']}",
+            )
         return redirect(f"{request.path}?month={first_day.strftime('%Y-%m')}&department={selected_department or ''}")
 
-    records = EmployeeServiceRecord.objects.filter(month=first_day)
-    data = build_service_data(records)
-
-    summary = {}
-    for employee in employees:
-        filtered_services = services.filter(for_salary_based=employee.is_fixed_salary)
-        quantities = {sid: data.get((employee.id, sid), 0) for sid in [s.id for s in filtered_services]}
-        summary[employee.id] = float(calculate_service_sum(filtered_services, quantities))
+    employees = {e.id: e for e in employees}
+
+    def render_rows(missing):
+        data = build_service_data(EmployeeServiceRecord.objects.filter(month=first_day, employee_id__in=missing))
+        rows = {}
+        for employee_id in missing:
+            employee = employees[employee_id]
+            quantities = data.get(employee_id, {})
+            rows[employee_id] = render_to_string("core/_services_row.html", {
+                "employee": employee,
+                "services": services,
+                "quantities": quantities,
+                "total": float(calculate_service_sum(services_by_kind[employee.is_fixed_salary], quantities)),
+            })
+        return rows
+
+    html = cached_rows("services", first_day, employees, render_rows)
+    rows = [{"employee": employee, "html": html[employee_id]} for employee_id, employee in employees.items()]
 
     departments = Department.objects.all()
 
     return render(request, "core/services.html", {
-        "employees": employees,
+        "employees": list(employees.values()),
+        "rows": rows,
         "services": services,
         "month": first_day,
-        "data": data,
-        "summary": summary,
         "departments": departments,
         "selected_department": selected_department,
     })
-def export_services_xlsx(request):
-    first_day = parse_month(request)
-    year, month = first_day.year, first_day.month
-
-    employees = get_employees_queryset()
-    services = Service.objects.all()
-    records = EmployeeServiceRecord.objects.filter(month=first_day)
-
-    raw_data = build_service_data(records)
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"Услуги_{year}_{month:02d}"
-
-    headers = ["ФИО", "Отдел", "Должность"] + [s.name for s in services] + ["Итого (₽)"]
-    ws.append(headers)
-
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
 
-    for emp in employees:
-        row = [emp.full_name, emp.department.name, emp.position.name]
-        quantities = {s.id: raw_data.get((emp.id, s.id), 0) for s in services}
-        for s in services:
-            row.append(quantities.get(s.id, 0))
-        total = calculate_service_sum(services, quantities)
-        row.append(round(float(total), 2))
-        ws.append(row)
 
-    autofit_columns(ws)
-    filename = f"uslugi_{year}_{month:02d}.xlsx"
+def export_services_xlsx(request):
+    first_day = parse_month(request)
+    wb = build_services_workbook(first_day)
+    filename = f"uslugi_{first_day.year}_{first_day.month:02d}.xlsx"
     return workbook_to_response(wb, filename)
 
 
 def import_services_view(request):
     """Import employee service records from an Excel file."""
     if request.method == "POST" and request.FILES.get("xlsx_file"):
-        wb = openpyxl.load_workbook(request.FILES["xlsx_file"])
-        ws = wb.active
-        headers = [cell.value for cell in ws[1]]
-        service_names = headers[2:]
-        service_map = {
-            s.name: s for s in Service.objects.filter(name__in=service_names)
-        }
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            full_name = row[0]
-            month_val = row[1]
-            if not full_name or not month_val:
-                continue
-            try:
-                year, month = map(int, str(month_val).split("-")[:2])
-                month_date = date(year, month, 1)
-            except Exception:
-                continue
-            try:
-                employee = Employee.objects.get(full_name=full_name)
-            except Employee.DoesNotExist:
-                continue
-            for idx, service_name in enumerate(service_names, start=2):
-                qty = row[idx]
-                if qty:
-                    service = service_map.get(service_name)
-                    if not service:
-                        continue
-                    EmployeeServiceRecord.objects.update_or_create(
-                        employee=employee,
-                        service=service,
-                        month=month_date,
-                        defaults={"quantity": int(qty)},
-                    )
+        try:
+            report = import_services(request.FILES["xlsx_file"])
+        except MonthClosedError as exc:
+            messages.error(request, str(exc))
+            return redirect("services")
+        months = "; ".join(
+            f"{month}: записей {summary['records']}, количество {summary['quantity']}"
+            for month, summary in report["months"].items()
+        )
+        messages.success(
+            request,
+            f"Импорт услуг: добавлено {report['inserted']}, изменено {report['updated']}, "
+            f"без изменений {report['unchanged']}" + (f" ({months})" if months else ""),
+        )
+        if report["unmatched_names"] or report["ambiguous_names"]:
+            messages.warning(
+                request,
+                "Не загружены сотрудники: " + ", ".join(report["unmatched_names"] + report["ambiguous_names"]),
+            )
         return redirect("services")
     return render(request, "core/import_services.html")
 
 
+def _closed_month_file(first_day: date, field: str):
+    """Pre-generated workbook of a closed month, if there is one."""
+    closed = get_closed_month(first_day)
+    if closed is None or not getattr(closed, field):
+        return None
+    return FileResponse(
+        getattr(closed, field).open("rb"), as_attachment=True, filename=artifact_filenames(first_day)[field],
+    )
+
+
 def export_salary_report_xlsx(request):
     first_day = parse_month(request)
-    year, month = first_day.year, first_day.month
-    days_in_month = monthrange(year, month)[1]
-
-    employees = get_employees_queryset()
-    records = EmployeeServiceRecord.objects.filter(month=first_day)
-    services = Service.objects.all()
-
-    schedule_map, _ = get_schedule_maps(first_day)
-    service_data = build_service_data(records)
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"Зарплата_{year}_{month:02d}"
-
-    headers = [
-        "ФИО", "Отдел", "Должность",
-        "Дневных", "Ночных", "Сумма смен (₽)", "Сумма услуг (₽)", "Итого (₽)"
-    ]
-    ws.append(headers)
-
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-
-    current_dept = None
-    dept_day = dept_night = dept_shift_sum = dept_service_sum = dept_total = 0
-    for emp in employees:
-        if current_dept and emp.department_id != current_dept.id:
-            ws.append([
-                "",
-                f"Итого по отделу {current_dept.name}",
-                "",
-                dept_day,
-                dept_night,
-                round(dept_shift_sum, 2),
-                round(dept_service_sum, 2),
-                round(dept_total, 2),
-            ])
-            dept_day = dept_night = dept_shift_sum = dept_service_sum = dept_total = 0
-
-        shifts = schedule_map.get(emp.id, {})
-        day_count, night_count = count_shifts(shifts)
-        salary_shifts = calculate_shift_salary(emp, day_count, night_count)
-
-        quantities = service_data.get(emp.id, {})
-        service_sum = calculate_service_sum(services, quantities)
-
-        total = round(float(salary_shifts + service_sum), 2)
-
-        ws.append([
-            emp.full_name,
-            emp.department.name,
-            emp.position.name,
-            day_count,
-            night_count,
-            round(float(salary_shifts), 2),
-            round(float(service_sum), 2),
-            total,
-        ])
-
-        dept_day += day_count
-        dept_night += night_count
-        dept_shift_sum += float(salary_shifts)
-        dept_service_sum += float(service_sum)
-        dept_total += total
-        current_dept = emp.department
-
-    if current_dept:
-        ws.append([
-            "",
-            f"Итого по отделу {current_dept.name}",
-            "",
-            dept_day,
-            dept_night,
-            round(dept_shift_sum, 2),
-            round(dept_service_sum, 2),
-            round(dept_total, 2),
-        ])
-
-    autofit_columns(ws)
-    filename = f"zarplata_{year}_{month:02d}.xlsx"
+    response = _closed_month_file(first_day, "report_file")
+    if response:
+        return response
+    wb = build_salary_report_workbook(first_day)
+    filename = f"zarplata_{first_day.year}_{first_day.month:02d}.xlsx"
     return workbook_to_response(wb, filename)
 
 
@@ -444,73 +481,29 @@ def report_view(request):
     selected_department = request.GET.get("department")
     report_type = request.GET.get("type")  # "advance" или "final"
 
-    year, month = first_day.year, first_day.month
-    days_in_month = monthrange(year, month)[1]
-    employees = get_employees_queryset().order_by("department__name", "full_name")
-    if selected_department:
-        employees = employees.filter(department_id=selected_department)
-
-    schedule_map, last_shift_map = get_schedule_maps(first_day)
-
-    services = Service.objects.all()
-    records = EmployeeServiceRecord.objects.filter(month=first_day)
-    service_data = build_service_data(records)
+    advance = report_type == "advance"
 
     salary_summary = []
     department_totals: dict[int, dict[str, float]] = {}
-    working_days_total = get_working_days(year, month)
-    mid_month = 15
-
-    for emp in employees:
-        shifts = schedule_map.get(emp.id, {})
-        day_count, night_count = count_shifts(shifts)
-        total_shift_salary = calculate_shift_salary(emp, day_count, night_count)
-
-        quantities = service_data.get(emp.id, {})
-        service_sum = calculate_service_sum(services, quantities)
-
-        if emp.is_fixed_salary:
-            worked_days = sum(1 for d, s in shifts.items() if s in ["day", "night"])
-            salary_base = (float(emp.fixed_salary) / working_days_total) * worked_days if working_days_total else 0
-            total_salary = salary_base + float(emp.bonus) + float(service_sum)
-
-            if report_type == "advance":
-                worked_days_1_15 = sum(
-                    1 for d, s in shifts.items() if s in ["day", "night"] and d <= mid_month
-                )
-                advance = (
-                    (float(emp.fixed_salary) / working_days_total) * worked_days_1_15
-                    if working_days_total
-                    else 0
-                )
-                row = {
-                    "employee": emp,
-                    "day": worked_days_1_15,
-                    "night": 0,
-                    "shifts_sum": round(advance),
-                    "services_sum": 0,
-                    "total": round(advance),
-                }
-                salary_summary.append(row)
-                totals = department_totals.setdefault(
-                    emp.department_id,
-                    {"day": 0, "night": 0, "total": 0},
-                )
-                totals["day"] += row["day"]
-                totals["night"] += row["night"]
-                totals["total"] += row["total"]
-                continue
+    for emp, pay in get_payroll_rows(first_day, selected_department):
+        if advance:
+            row = {
+                "employee": emp,
+                "day": pay["day_1_15"],
+                "night": pay["night_1_15"],
+                "shifts_sum": round(pay["advance"]),
+                "services_sum": 0,
+                "total": round(pay["advance"]),
+            }
         else:
-            total_salary = float(total_shift_salary + service_sum)
-
-        row = {
-            "employee": emp,
-            "day": day_count,
-            "night": night_count,
-            "shifts_sum": round(float(total_shift_salary)),
-            "services_sum": round(float(service_sum)),
-            "total": round(total_salary),
-        }
+            row = {
+                "employee": emp,
+                "day": pay["day"],
+                "night": pay["night"],
+                "shifts_sum": round(pay["shift_pay"]),
+                "services_sum": round(pay["services"]),
+                "total": round(pay["total"]),
+            }
         salary_summary.append(row)
         totals = department_totals.setdefault(
             emp.department_id,
@@ -527,96 +520,55 @@ def report_view(request):
         "report_type": report_type,
         "salary_summary": salary_summary,
         "department_totals": department_totals,
+        "closed_month": get_closed_month(first_day),
     })
 
 def export_salary_full_xlsx(request):
-    employees = get_employees_queryset()
-    return generate_salary_report(request, employees, full_month=True)
+    return generate_salary_report(request, full_month=True)
 
 def export_salary_advance_xlsx(request):
-    employees = get_employees_queryset()
-    return generate_salary_report(request, employees, full_month=False)
-
-def generate_salary_report(request, employees, full_month=True):
-    from calendar import monthrange
-    from openpyxl import Workbook
-    from openpyxl.styles import Font
+    return generate_salary_report(request, full_month=False)
 
+def generate_salary_report(request, full_month=True):
     first_day = parse_month(request)
-    year, month = first_day.year, first_day.month
-    days_in_month = monthrange(year, month)[1]
-
-    selected_department = request.GET.get("department")
-    if selected_department:
-        employees = employees.filter(department_id=selected_department)
-
-    schedule_map, _ = get_schedule_maps(first_day)
-    records = EmployeeServiceRecord.objects.filter(month=first_day)
-    services = Service.objects.all()
-
-    service_data = build_service_data(records)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Аванс" if not full_month else "Зарплата"
-
-    headers = ["ФИО", "Отдел", "Должность", "Дневных", "Ночных", "Сумма смен (₽)", "Сумма услуг (₽)", "Премия", "Итого (₽)"]
-    ws.append(headers)
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-
-    for emp in employees:
-        shifts = schedule_map.get(emp.id, {})
-
-        if full_month:
-            period_days = range(1, days_in_month + 1)
-        else:
-            period_days = range(1, 16)  # с 1 по 15
+    if not request.GET.get("department"):
+        response = _closed_month_file(first_day, "salary_file" if full_month else "advance_file")
+        if response:
+            return response
+    wb = build_salary_workbook(first_day, full_month, request.GET.get("department"))
+    filename = f"{'avans' if not full_month else 'zarplata'}_{first_day.year}_{first_day.month:02d}.xlsx"
+    return workbook_to_response(wb, filename)
 
-        day_count, night_count = count_shifts(shifts, period_days)
 
-        if emp.is_fixed_salary:
-            total_days = sum(1 for d in range(1, days_in_month + 1) if shifts.get(d) in ["day", "night"])
-            worked_days = sum(1 for d in period_days if shifts.get(d) in ["day", "night"])
-            base = (emp.fixed_salary or 0) / total_days if total_days else 0
-            salary_shift_sum = round(base * worked_days, 2)
+@require_POST
+def close_month_view(request):
+    """Close the month (freeze its payroll) or reopen it."""
+    first_day = parse_month(request)
+    if not request.user.has_perm("core.close_month"):
+        messages.error(request, "Недостаточно прав")
+    else:
+        if request.POST.get("action") == "reopen":
+            if reopen_month(first_day):
+                messages.success(request, f"Месяц {first_day:%m.%Y} открыт для изменений")
         else:
-            salary_shift_sum = round(float(calculate_shift_salary(emp, day_count, night_count)), 2)
-
-        quantities = service_data.get(emp.id, {})
-        service_sum = calculate_service_sum(services, quantities)
-
-        bonus = float(emp.bonus or 0) if full_month else 0
-        total = Decimal(salary_shift_sum) + (Decimal(service_sum) if full_month else Decimal(0)) + Decimal(bonus)
-
-        ws.append([
-            emp.full_name,
-            emp.department.name,
-            emp.position.name,
-            day_count,
-            night_count,
-            salary_shift_sum,
-            round(service_sum if full_month else 0, 2),
-            round(bonus, 2),
-            round(total, 2)
-        ])
-
-    # автоширина
-    autofit_columns(ws)
-
-    filename = f"{'avans' if not full_month else 'zarplata'}_{year}_{month:02d}.xlsx"
-    return workbook_to_response(wb, filename)
+            try:
+                close_month(first_day, request.user)
+            except MonthClosedError as exc:
+                messages.error(request, str(exc))
+            else:
+                messages.success(request, f"Месяц {first_day:%m.%Y} закрыт, расчёт зафиксирован")
+    return redirect(f"{reverse('report')}?month={first_day:%Y-%m}")
 
 
 def analytics_view(request):
     """Сводная аналитика по сменам и услугам по отделам."""
     first_day = parse_month(request)
-    year, month = first_day.year, first_day.month
+    start, end = month_bounds(first_day)
 
     # Данные по сменам
     qs_shifts = (
         WorkSchedule.objects
-        .filter(date__year=year, date__month=month)
+        .filter(date__gte=start, date__lt=end)
         .select_related("employee__department")
     )
     df_shifts = pd.DataFrame.from_records(
@@ -680,3 +632,61 @@ def analytics_view(request):
     }
     return render(request, "core/analytics.html", context)
 
+
+@require_POST
+def start_job(request, kind):
+    """Queue an import or export as a background job."""
+    if kind not in JOB_KINDS:
+        raise Http404
+    _, permission = JOB_KINDS[kind]
+    if permission and not request.user.has_perm(permission):
+        return JsonResponse({"status": "error", "message": "Недостаточно прав"}, status=403)
+    if kind.startswith("import_") and not request.FILES.get("xlsx_file"):
+        return JsonResponse({"status": "error", "message": "Файл не выбран"}, status=400)
+
+    params = {
+        "month": parse_month(request).isoformat(),
+        "department": request.GET.get("department") or None,
+    }
+    job = enqueue(kind, params, request.FILES.get("xlsx_file"), request.user)
+    return JsonResponse(_job_payload(job), status=202)
+
+
+def job_status(request, pk):
+    """Progress of a background job, polled by the page that started it."""
+    job = _get_user_job(request, pk)
+    # With the thread runner nothing else notices a job whose process died.
+    if is_stale(job):
+        fail_stale_jobs([job.pk])
+        job.refresh_from_db()
+    return JsonResponse(_job_payload(job))
+
+
+def job_download(request, pk):
+    job = _get_user_job(request, pk)
+    if job.status != JobStatus.DONE or not job.result_file:
+        raise Http404
+    filename = (job.result or {}).get("filename") or job.result_file.name.rsplit("/", 1)[-1]
+    return FileResponse(job.result_file.open("rb"), as_attachment=True, filename=filename)
+
+
+def _get_user_job(request, pk):
+    job = get_object_or_404(Job, pk=pk)
+    if job.created_by_id and job.created_by_id != request.user.id and not request.user.is_staff:
+        raise Http404
+    return job
+
+
+def _job_payload(job):
+    payload = {
+        "id": job.pk,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "result": job.result,
+        "status_url": reverse("job_status", args=[job.pk]),
+    }
+    if job.status == JobStatus.DONE and job.result_file:
+        payload["download_url"] = reverse("job_download", args=[job.pk])
+    return payload
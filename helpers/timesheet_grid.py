@@ -0,0 +1,99 @@
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
+
+
+SHIFT_CHOICES = [
+    ("day", "Д"),
+    ("night", "Н"),
+    ("weekend", "В"),
+    ("vacation", "О"),
+    ("sick", "Б"),
+    ("partial", "П"),
+]
+SHIFT_LABELS = dict(SHIFT_CHOICES)
+SHIFT_CSS = {
+    "day": "bg-green-100",
+    "night": "bg-blue-100",
+    "vacation": "bg-yellow-100",
+    "sick": "bg-red-200",
+    "weekend": "bg-gray-200",
+}
+EMPTY_CSS = "bg-gray-100"
+
+
+def _options_html(selected: str) -> str:
+    return mark_safe('<option value=""></option>' + format_html_join(
+        "", '<option value="{}"{}>{}</option>',
+        ((key, " selected" if key == selected else "", label) for key, label in SHIFT_CHOICES),
+    ))
+
+
+# Everything that only depends on the cell value is rendered once per value.
+OPTIONS_HTML = {value: _options_html(value) for value in ["", *SHIFT_LABELS]}
+POPOVER_HTML = format_html_join(
+    "", '<div class="cursor-pointer px-2 py-1 hover:bg-gray-100" data-value="{}" data-label="{}">{}</div>',
+    ((key, label, label) for key, label in SHIFT_CHOICES),
+)
+# One grid cell; ``emp`` and ``day`` are integers and everything else comes
+# from the constants above, so plain formatting is safe here.
+CELL_HTML = (
+    '<td class="border px-1 py-1 text-center {td_css}"><div class="relative">'
+    '<button type="button" class="shift-button rounded w-[32px] h-[28px] text-xs font-semibold {css}"'
+    ' data-emp="{emp}" data-day="{day}">{label}</button>'
+    '<select class="shift-select hidden w-[36px] h-[28px] text-xs" data-emp="{emp}" data-day="{day}">{options}</select>'
+    '<input type="text" class="shift-text hidden w-[32px] h-[28px] text-xs text-center border rounded"'
+    ' data-emp="{emp}" data-day="{day}" value="{label}">'
+    '<input type="hidden" name="shift_{emp}_{day}" value="{value}">'
+    '<div class="shift-popover hidden absolute top-full left-0 mt-1 bg-white border rounded shadow text-xs z-50">'
+    + POPOVER_HTML.replace("{", "{{").replace("}", "}}") +
+    '</div></div></td>'
+)
+CELLS = {
+    value: {
+        "value": value,
+        "label": SHIFT_LABELS.get(value, ""),
+        "css": SHIFT_CSS.get(value, EMPTY_CSS),
+        "options": OPTIONS_HTML[value],
+    }
+    for value in OPTIONS_HTML
+}
+
+
+def day_css(info: dict) -> str:
+    if info["is_today"]:
+        return "border-2 border-yellow-500 bg-yellow-100"
+    if info["is_weekend"]:
+        return "bg-gray-50"
+    return ""
+
+
+def build_timesheet_rows(employees, schedule, salary: dict, days_info: list[dict]) -> list[dict]:
+    """Precompute the timesheet grid rows.
+
+    ``schedule`` is a MonthSchedule (or any ``{employee_id: {day: shift}}``
+    mapping) and ``salary`` the month payroll keyed by employee id. The day
+    cells of each row are pre-rendered into one HTML fragment: every
+    (day, value) cell is formatted from :data:`CELL_HTML` once per call with
+    a placeholder for the employee id, so a row is a join and a replace.
+    """
+    marker = "__emp__"
+    day_cells = [
+        (info["num"], {
+            value: CELL_HTML.format(emp=marker, day=info["num"], td_css=day_css(info), **cell)
+            for value, cell in CELLS.items()
+        })
+        for info in days_info
+    ]
+    rows = []
+    for employee in employees:
+        shifts = schedule.get(employee.id) or {}
+        cells_html = "".join(
+            variants.get(shifts.get(num) or "", variants[""]) for num, variants in day_cells
+        ).replace(marker, str(int(employee.id)))
+        rows.append({
+            "employee": employee,
+            "cells_html": mark_safe(cells_html),
+            "salary": salary.get(employee.id) or {},
+            "colspan": len(day_cells) + 4,
+        })
+    return rows
@@ -1,7 +1,11 @@
-from datetime import date, timedelta
+from array import array
 from calendar import monthrange
+from collections.abc import Mapping
+from datetime import date, timedelta
+
+from django.db.models import Count, Q
 
-from core.models import Employee, WorkSchedule, EmployeeServiceRecord
+from core.models import Employee, WorkSchedule, EmployeeServiceRecord, ShiftType
 
 
 def parse_month(request) -> date:
@@ -16,6 +20,23 @@ def parse_month(request) -> date:
     return date(today.year, today.month, 1)
 
 
+def month_bounds(first_day: date) -> tuple[date, date]:
+    """Half-open ``[first day, first day of next month)`` range for date filters.
+
+    Filtering with ``date__gte``/``date__lt`` keeps the column bare so the
+    ``(date, employee)`` index applies, unlike ``date__year``/``date__month``.
+    """
+    start = first_day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def add_months(first_day: date, months: int) -> date:
+    """First day of the month ``months`` after (or before) ``first_day``'s month."""
+    index = first_day.year * 12 + first_day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
 def get_employees_queryset():
     return Employee.objects.select_related("department", "position").all()
 
@@ -25,23 +46,168 @@ def get_working_days(year: int, month: int) -> int:
     return sum(1 for d in range(1, total_days + 1) if date(year, month, d).weekday() < 5)
 
 
-def get_schedule_maps(first_day: date):
-    """Return schedule_map and last_shift_map for given month."""
-    year, month = first_day.year, first_day.month
-    schedule = WorkSchedule.objects.filter(date__year=year, date__month=month)
-    schedule_map: dict[int, dict[int, str]] = {}
-    for s in schedule:
-        schedule_map.setdefault(s.employee_id, {})[s.date.day] = s.shift
+class ScheduleRow(Mapping):
+    """Read-only ``{day: shift}`` view of one employee's row in a MonthSchedule.
+
+    Only days with a shift are present, so it can be used wherever the old
+    per-employee dicts were.
+    """
+
+    __slots__ = ("_cells",)
+
+    def __init__(self, cells: memoryview):
+        self._cells = cells
+
+    def __getitem__(self, day: int) -> str:
+        if not 1 <= day <= len(self._cells) or not self._cells[day - 1]:
+            raise KeyError(day)
+        return MonthSchedule.CODES[self._cells[day - 1]]
+
+    def __iter__(self):
+        return (day for day, code in enumerate(self._cells, start=1) if code)
+
+    def __len__(self) -> int:
+        return len(self._cells) - self._cells.tobytes().count(0)
+
+    def counts(self, first: int = 1, last: int | None = None) -> dict[str, int]:
+        """Count each shift type for days ``first``..``last`` (inclusive)."""
+        period = self._cells[first - 1:last or len(self._cells)].tobytes()
+        return {shift: period.count(code) for code, shift in enumerate(MonthSchedule.CODES) if code}
+
+
+class MonthSchedule(Mapping):
+    """Shifts of one month as an employees × days matrix of one-byte codes.
+
+    Code 0 is an empty cell, the rest index :attr:`CODES`. Rows are looked up
+    through an employee id index and the schedule itself is a read-only
+    ``{employee_id: ScheduleRow}`` mapping. The object pickles to the raw bytes and the
+    id list, so it is cheap to put into the cache.
+    """
+
+    CODES = ("",) + tuple(ShiftType.values)
+    CODE_OF = {shift: code for code, shift in enumerate(CODES)}
+
+    def __init__(self, first_day: date, employee_ids=(), cells: bytes | None = None):
+        self.first_day = first_day
+        self.days = monthrange(first_day.year, first_day.month)[1]
+        self.employee_ids = array("Q", employee_ids)
+        self.cells = bytearray(cells) if cells is not None else bytearray(len(self.employee_ids) * self.days)
+        self._index = {employee_id: i for i, employee_id in enumerate(self.employee_ids)}
 
+    @classmethod
+    def load(cls, first_day: date, employee_ids=None, department_id=None) -> "MonthSchedule":
+        """Read the month from WorkSchedule, optionally for given employees or department only.
+
+        Employees passed in ``employee_ids`` get a row even if they have no
+        shifts; otherwise rows are created for employees found in the month.
+        """
+        schedule = cls(first_day, employee_ids or ())
+        start, end = month_bounds(first_day)
+        rows = WorkSchedule.objects.filter(date__gte=start, date__lt=end)
+        if employee_ids is not None:
+            rows = rows.filter(employee_id__in=list(employee_ids))
+        if department_id:
+            rows = rows.filter(employee__department_id=department_id)
+        for employee_id, day, shift in rows.order_by().values_list("employee_id", "date", "shift"):
+            schedule.set(employee_id, day.day, shift)
+        return schedule
+
+    def __getstate__(self):
+        return {"first_day": self.first_day, "employee_ids": self.employee_ids.tobytes(), "cells": bytes(self.cells)}
+
+    def __setstate__(self, state):
+        employee_ids = array("Q")
+        employee_ids.frombytes(state["employee_ids"])
+        self.__init__(state["first_day"], employee_ids, state["cells"])
+
+    def __getitem__(self, employee_id: int) -> ScheduleRow:
+        offset = self._offset(employee_id)
+        if offset is None:
+            raise KeyError(employee_id)
+        return ScheduleRow(memoryview(self.cells)[offset:offset + self.days])
+
+    def __iter__(self):
+        return iter(self.employee_ids)
+
+    def __contains__(self, employee_id) -> bool:
+        return employee_id in self._index
+
+    def __len__(self) -> int:
+        return len(self.employee_ids)
+
+    def _offset(self, employee_id: int, create: bool = False) -> int | None:
+        i = self._index.get(employee_id)
+        if i is None:
+            if not create:
+                return None
+            i = self._index[employee_id] = len(self.employee_ids)
+            self.employee_ids.append(employee_id)
+            self.cells.extend(bytes(self.days))
+        return i * self.days
+
+    def set(self, employee_id: int, day: int, shift: str | None):
+        self.cells[self._offset(employee_id, create=True) + day - 1] = self.CODE_OF.get(shift or "", 0)
+
+    def row(self, employee_id: int) -> list[str]:
+        """Return shift per day (``""`` for empty cells), day 1 first."""
+        offset = self._offset(employee_id)
+        if offset is None:
+            return [""] * self.days
+        return [self.CODES[code] for code in self.cells[offset:offset + self.days]]
+
+    def counts(self, employee_id: int, first: int = 1, last: int | None = None) -> dict[str, int]:
+        """Count each shift type for days ``first``..``last`` (inclusive)."""
+        row = self.get(employee_id)
+        if row is None:
+            return dict.fromkeys(self.CODES[1:], 0)
+        return row.counts(first, last)
+
+
+def get_last_shifts(first_day: date, employee_ids=None) -> dict[int, str]:
+    """Return each employee's shift on the last day of the previous month."""
     prev_month_last_date = first_day.replace(day=1) - timedelta(days=1)
     prev_schedules = WorkSchedule.objects.filter(date=prev_month_last_date)
-    last_shift_map = {s.employee_id: s.shift for s in prev_schedules}
-    return schedule_map, last_shift_map
+    if employee_ids is not None:
+        prev_schedules = prev_schedules.filter(employee_id__in=list(employee_ids))
+    return dict(prev_schedules.values_list("employee_id", "shift"))
+
+
+def get_shift_counts(first_day: date, department_id=None, split_day: int | None = None, employee_ids=None):
+    """Return ``{employee_id: {shift: count}}`` for given month in one grouped query.
+
+    Every shift type gets a key. With ``split_day`` the day and night shifts
+    up to that day are also counted as ``day_1_<split_day>`` and
+    ``night_1_<split_day>`` (the advance period).
+    """
+    start, end = month_bounds(first_day)
+    schedule = WorkSchedule.objects.filter(date__gte=start, date__lt=end)
+    if department_id:
+        schedule = schedule.filter(employee__department_id=department_id)
+    if employee_ids is not None:
+        schedule = schedule.filter(employee_id__in=list(employee_ids))
+
+    counts = {shift: Count("id", filter=Q(shift=shift)) for shift in ShiftType.values}
+    if split_day:
+        split_date = first_day.replace(day=split_day)
+        for shift in (ShiftType.DAY.value, ShiftType.NIGHT.value):
+            counts[f"{shift}_1_{split_day}"] = Count(
+                "id", filter=Q(shift=shift, date__lte=split_date)
+            )
+    rows = schedule.order_by().values("employee_id").annotate(**counts)
+    return {row.pop("employee_id"): row for row in rows}
+
+
+def partition_services(services) -> dict[bool, list]:
+    """Split services by ``for_salary_based`` into ``{True: [...], False: [...]}``."""
+    partitions: dict[bool, list] = {True: [], False: []}
+    for service in services:
+        partitions[service.for_salary_based].append(service)
+    return partitions
 
 
 def build_service_data(records):
+    """Return ``{employee_id: {service_id: quantity}}`` for a record queryset."""
     data: dict[int, dict[int, int]] = {}
-    for r in records:
-        data.setdefault(r.employee.id, {})[r.service.id] = r.quantity
+    for employee_id, service_id, quantity in records.values_list("employee_id", "service_id", "quantity"):
+        data.setdefault(employee_id, {})[service_id] = quantity
     return data
-
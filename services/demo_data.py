@@ -0,0 +1,117 @@
+"""Synthetic data of realistic shape for benchmarks and manual load testing.
+
+Everything goes through the same bulk writers the application uses, so the
+schedule history, the payroll rollup and the month caches are in the state
+real edits would leave them in.
+"""
+import random
+from datetime import date
+from decimal import Decimal
+
+from core.models import Department, Employee, Position, ScheduleTemplate, Service, ShiftType
+from helpers.utils import add_months
+from services.month_cache import bump_all
+from services.schedule import bulk_upsert_schedule, rotation_cells, rotation_offsets
+from services.service_records import bulk_upsert_service_records
+
+
+TEMPLATES = {
+    "2/2 день": ["day", "day", "weekend", "weekend"],
+    "2/2 день-ночь": ["day", "night", "weekend", "weekend"],
+    "5/2": ["day"] * 5 + ["weekend"] * 2,
+    "Сутки через трое": ["day", "weekend", "weekend", "weekend"],
+}
+POSITIONS = ["Оператор", "Мастер смены", "Кладовщик", "Водитель", "Администратор"]
+# Edited cells become vacation, sick or partial shifts, as in real corrections.
+EDIT_SHIFTS = [ShiftType.VACATION.value, ShiftType.SICK.value, ShiftType.PARTIAL.value]
+EMPLOYEE_CHUNK = 200
+
+
+def generate_dataset(
+    *,
+    departments: int = 5,
+    employees: int = 100,
+    months: int = 3,
+    start: date = date(2024, 1, 1),
+    services: int = 10,
+    edits: float = 0.05,
+    fixed_share: float = 0.2,
+    seed: int = 0,
+    prefix: str = "Демо",
+) -> dict[str, int]:
+    """Create departments, employees, schedules, services and history.
+
+    Schedules follow the ScheduleTemplate rotations month after month; a
+    share ``edits`` of the cells is then changed once more so the history
+    table also holds updates. Returns counts of what was written.
+    """
+    rng = random.Random(seed)
+    start = start.replace(day=1)
+
+    templates = [
+        ScheduleTemplate.objects.get_or_create(name=name, defaults={"sequence": sequence})[0]
+        for name, sequence in TEMPLATES.items()
+    ]
+    dept_objs = Department.objects.bulk_create(
+        [Department(name=f"{prefix} отдел {i}") for i in range(1, departments + 1)]
+    )
+    if any(d.pk is None for d in dept_objs):
+        dept_objs = list(Department.objects.filter(name__startswith=f"{prefix} отдел ").order_by("-pk")[:departments])
+    positions = [Position.objects.get_or_create(name=name)[0] for name in POSITIONS]
+
+    staff = []
+    for i in range(1, employees + 1):
+        fixed = rng.random() < fixed_share
+        day_rate = Decimal(rng.randrange(1500, 3500, 50))
+        staff.append(Employee(
+            full_name=f"{prefix} Сотрудник {i:06d}",
+            department=dept_objs[i % len(dept_objs)],
+            position=rng.choice(positions),
+            day_shift_rate=0 if fixed else day_rate,
+            night_shift_rate=0 if fixed else (day_rate * Decimal("1.3")).quantize(Decimal(1)),
+            is_fixed_salary=fixed,
+            fixed_salary=Decimal(rng.randrange(40000, 90000, 1000)) if fixed else 0,
+            bonus=Decimal(rng.choice([0, 0, 0, 2000, 5000])),
+        ))
+    Employee.objects.bulk_create(staff, batch_size=1000)
+    if any(e.pk is None for e in staff):
+        staff = list(Employee.objects.filter(full_name__startswith=f"{prefix} Сотрудник ").order_by("-pk")[:employees])
+    # bulk_create sends no post_save.
+    bump_all()
+
+    service_objs = Service.objects.bulk_create([
+        Service(name=f"{prefix} услуга {i}", price=Decimal(rng.randrange(100, 2000, 50)), for_salary_based=i % 3 == 0)
+        for i in range(1, services + 1)
+    ])
+    if any(s.pk is None for s in service_objs):
+        service_objs = list(Service.objects.filter(name__startswith=f"{prefix} услуга ").order_by("-pk")[:services])
+    by_kind = {kind: [s for s in service_objs if s.for_salary_based == kind] or service_objs for kind in (True, False)}
+
+    assigned = {employee.id: templates[i % len(templates)] for i, employee in enumerate(staff)}
+    result = {"employees": len(staff), "cells": 0, "edits": 0, "service_records": 0}
+    for offset in range(months):
+        first_day = add_months(start, offset)
+        days = range(1, (add_months(first_day, 1) - first_day).days + 1)
+        for chunk_start in range(0, len(staff), EMPLOYEE_CHUNK):
+            chunk = staff[chunk_start:chunk_start + EMPLOYEE_CHUNK]
+            cells = []
+            for template in templates:
+                ids = [e.id for e in chunk if assigned[e.id] is template]
+                offsets = rotation_offsets(template.sequence, ids, first_day)
+                cells += rotation_cells(ids, first_day, days, template.sequence, offsets)
+            result["cells"] += bulk_upsert_schedule(cells)["inserted"]
+
+            edited = [
+                (employee_id, day, rng.choice(EDIT_SHIFTS))
+                for employee_id, day, _ in cells
+                if rng.random() < edits
+            ]
+            result["edits"] += bulk_upsert_schedule(edited)["updated"]
+
+            records = []
+            for employee in chunk:
+                available = by_kind[employee.is_fixed_salary]
+                for service in rng.sample(available, rng.randint(0, min(3, len(available)))):
+                    records.append((employee.id, service.id, first_day, rng.randint(1, 20)))
+            result["service_records"] += bulk_upsert_service_records(records)["inserted"]
+    return result
@@ -0,0 +1,326 @@
+from calendar import monthrange
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+import openpyxl
+from django.db import transaction
+
+from core.models import Department, Position, Employee, Service
+from services.month_cache import bump_all
+from services.payroll_rollup import refresh_rollup
+from services.schedule import BATCH_SIZE, bulk_upsert_schedule
+from services.service_records import bulk_upsert_service_records
+
+
+SHIFT_CODES = {
+    "Д": "day",
+    "д": "day",
+    "Н": "night",
+    "н": "night",
+    "В": "weekend",
+    "в": "weekend",
+    "О": "vacation",
+    "о": "vacation",
+    "Б": "sick",
+    "б": "sick",
+    "П": "partial",
+    "п": "partial",
+    "Нп": "partial",
+    "нп": "partial",
+    "НП": "partial",
+}
+
+
+def _clean_name(value) -> str | None:
+    return str(value).strip() if value else None
+
+
+def resolve_employee_names(names) -> tuple[dict[str, int], set[str]]:
+    """Map full names to employee ids with one query.
+
+    Returns the name map and the set of names shared by several employees,
+    which are left out of the map.
+    """
+    name_map: dict[str, int] = {}
+    ambiguous: set[str] = set()
+    for pk, full_name in Employee.objects.filter(full_name__in=set(names)).values_list("id", "full_name"):
+        if full_name in name_map:
+            ambiguous.add(full_name)
+        name_map[full_name] = pk
+    for full_name in ambiguous:
+        del name_map[full_name]
+    return name_map, ambiguous
+
+
+def import_timesheet(file, first_day: date, *, batch_size: int = BATCH_SIZE, progress=None) -> dict:
+    """Stream a timesheet sheet into WorkSchedule.
+
+    The sheet is read twice in read-only mode: once to collect names for a
+    single lookup query, once to build cells, which are flushed through
+    ``bulk_upsert_schedule`` every ``batch_size`` cells. ``progress`` is
+    called as ``progress(rows_done, rows_total)`` after each flush.
+    """
+    year, month = first_day.year, first_day.month
+    days_in_month = monthrange(year, month)[1]
+
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        names = {
+            name
+            for (raw,) in ws.iter_rows(min_row=2, max_col=1, values_only=True)
+            if (name := _clean_name(raw))
+        }
+        name_map, ambiguous = resolve_employee_names(names)
+
+        report = {
+            "rows": 0,
+            "inserted": 0,
+            "updated": 0,
+            "unchanged": 0,
+            "unmatched_names": sorted(names - set(name_map) - ambiguous),
+            "ambiguous_names": sorted(ambiguous),
+            "unknown_codes": set(),
+        }
+
+        total_rows = (ws.max_row or 1) - 1
+
+        def flush(cells):
+            for key, value in bulk_upsert_schedule(cells, batch_size=batch_size).items():
+                report[key] += value
+            cells.clear()
+            if progress:
+                progress(report["rows"], total_rows)
+
+        cells = []
+        for row in ws.iter_rows(min_row=2, max_col=days_in_month + 1, values_only=True):
+            employee_id = name_map.get(_clean_name(row[0]))
+            if employee_id is None:
+                continue
+            report["rows"] += 1
+            for day, raw in enumerate(row[1:], start=1):
+                if raw is None:
+                    continue
+                code = str(raw).strip()
+                shift = SHIFT_CODES.get(code)
+                if not shift:
+                    if code:
+                        report["unknown_codes"].add(code)
+                    continue
+                cells.append((employee_id, date(year, month, day), shift))
+            if len(cells) >= batch_size:
+                flush(cells)
+        if cells:
+            flush(cells)
+    finally:
+        wb.close()
+
+    report["unknown_codes"] = sorted(report["unknown_codes"])
+    return report
+
+
+def _parse_month(value) -> date | None:
+    if isinstance(value, date):
+        return value.replace(day=1)
+    try:
+        year, month = map(int, str(value).split("-")[:2])
+        return date(year, month, 1)
+    except (TypeError, ValueError):
+        return None
+
+
+def import_services(file, *, batch_size: int = BATCH_SIZE, progress=None) -> dict:
+    """Stream employee service quantities: ФИО, month (YYYY-MM), one column per service.
+
+    Rows of any number of months may be mixed in one sheet. Names are
+    resolved with a single query, quantities are flushed through
+    ``bulk_upsert_service_records`` every ``batch_size`` cells and the report
+    has a per-month summary (``months``: records and total quantity).
+    """
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        headers = next(ws.iter_rows(max_row=1, values_only=True), ())
+        service_names = [_clean_name(h) for h in headers[2:]]
+        service_map = dict(
+            Service.objects.filter(name__in=[n for n in service_names if n]).values_list("name", "id")
+        )
+        names = {
+            name
+            for (raw,) in ws.iter_rows(min_row=2, max_col=1, values_only=True)
+            if (name := _clean_name(raw))
+        }
+        name_map, ambiguous = resolve_employee_names(names)
+
+        report = {
+            "written": 0,
+            "inserted": 0,
+            "updated": 0,
+            "unchanged": 0,
+            "months": {},
+            "unmatched_names": sorted(names - set(name_map) - ambiguous),
+            "ambiguous_names": sorted(ambiguous),
+            "unknown_services": sorted({n for n in service_names if n and n not in service_map}),
+            "invalid_rows": [],
+        }
+        columns = [
+            (idx, service_map[name])
+            for idx, name in enumerate(service_names, start=2)
+            if name in service_map
+        ]
+        total_rows = (ws.max_row or 1) - 1
+        rows_done = 0
+
+        def flush(records):
+            for key, value in bulk_upsert_service_records(records, batch_size=batch_size).items():
+                report[key] += value
+            records.clear()
+            if progress:
+                progress(rows_done, total_rows)
+
+        records = []
+        for line, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+            rows_done += 1
+            employee_id = name_map.get(_clean_name(row[0]))
+            if employee_id is None:
+                continue
+            month = _parse_month(row[1] if len(row) > 1 else None)
+            if month is None:
+                report["invalid_rows"].append(line)
+                continue
+            summary = report["months"].setdefault(month.strftime("%Y-%m"), {"records": 0, "quantity": 0})
+            for idx, service_id in columns:
+                qty = row[idx] if idx < len(row) else None
+                if not qty:
+                    continue
+                try:
+                    qty = int(qty)
+                except (TypeError, ValueError):
+                    report["invalid_rows"].append(line)
+                    continue
+                records.append((employee_id, service_id, month, qty))
+                summary["records"] += 1
+                summary["quantity"] += qty
+                report["written"] += 1
+            if len(records) >= batch_size:
+                flush(records)
+        if records:
+            flush(records)
+    finally:
+        wb.close()
+
+    report["months"] = dict(sorted(report["months"].items()))
+    report["invalid_rows"] = sorted(set(report["invalid_rows"]))
+    return report
+
+
+EMPLOYEE_FIELDS = ["department_id", "position_id", "day_shift_rate", "night_shift_rate"]
+
+
+def _get_or_bulk_create(model, names: set[str], dry_run: bool) -> tuple[dict[str, int | None], list[str]]:
+    """Map names to ids, creating the missing rows with one bulk_create."""
+    name_map: dict[str, int | None] = {}
+    for pk, name in model.objects.filter(name__in=names).order_by("-pk").values_list("pk", "name"):
+        name_map[name] = pk  # the oldest row wins when names repeat
+    missing = sorted(names - set(name_map))
+    if missing and not dry_run:
+        created = model.objects.bulk_create([model(name=name) for name in missing])
+        if any(obj.pk is None for obj in created):
+            created = model.objects.filter(name__in=missing)
+        name_map.update({obj.name: obj.pk for obj in created})
+    else:
+        name_map.update(dict.fromkeys(missing))
+    return name_map, missing
+
+
+def import_employees(file, *, dry_run: bool = False, batch_size: int = BATCH_SIZE) -> dict:
+    """Import employees: ФИО, department, position, day rate, night rate.
+
+    The sheet is streamed in read-only mode. Missing departments and
+    positions are created with one ``bulk_create`` each, then employees are
+    matched by full name in memory and written with ``bulk_create`` /
+    ``bulk_update`` in batches. With ``dry_run`` nothing is written and the
+    report only lists what would happen.
+    """
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows: dict[str, tuple] = {}
+        skipped: list[dict] = []
+        for line, row in enumerate(wb.active.iter_rows(min_row=2, max_col=5, values_only=True), start=2):
+            full_name, dept_name, pos_name, day_rate, night_rate = (tuple(row) + (None,) * 5)[:5]
+            full_name, dept_name, pos_name = _clean_name(full_name), _clean_name(dept_name), _clean_name(pos_name)
+            if not all([full_name, dept_name, pos_name, day_rate, night_rate]):
+                if any(row):
+                    skipped.append({"row": line, "name": full_name or "", "reason": "не заполнены все поля"})
+                continue
+            try:
+                rates = (Decimal(str(day_rate)), Decimal(str(night_rate)))
+            except InvalidOperation:
+                skipped.append({"row": line, "name": full_name, "reason": "некорректная ставка"})
+                continue
+            rows[full_name] = (dept_name, pos_name, *rates)
+    finally:
+        wb.close()
+
+    report = {
+        "imported": 0,
+        "created": [],
+        "updated": [],
+        "unchanged": 0,
+        "skipped": skipped,
+        "departments_created": [],
+        "positions_created": [],
+        "dry_run": dry_run,
+    }
+    if not rows:
+        return report
+
+    with transaction.atomic():
+        departments, report["departments_created"] = _get_or_bulk_create(
+            Department, {r[0] for r in rows.values()}, dry_run
+        )
+        positions, report["positions_created"] = _get_or_bulk_create(
+            Position, {r[1] for r in rows.values()}, dry_run
+        )
+
+        existing: dict[str, Employee] = {}
+        ambiguous: set[str] = set()
+        for employee in Employee.objects.filter(full_name__in=list(rows)).only("id", "full_name", *EMPLOYEE_FIELDS):
+            if employee.full_name in existing:
+                ambiguous.add(employee.full_name)
+            existing[employee.full_name] = employee
+
+        to_create, to_update = [], []
+        for full_name, (dept_name, pos_name, day_rate, night_rate) in rows.items():
+            if full_name in ambiguous:
+                report["skipped"].append({"row": None, "name": full_name, "reason": "несколько сотрудников с таким ФИО"})
+                continue
+            values = {
+                "department_id": departments[dept_name],
+                "position_id": positions[pos_name],
+                "day_shift_rate": day_rate,
+                "night_shift_rate": night_rate,
+            }
+            employee = existing.get(full_name)
+            if employee is None:
+                to_create.append(Employee(full_name=full_name, **values))
+            elif any(getattr(employee, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(employee, field, value)
+                to_update.append(employee)
+            else:
+                report["unchanged"] += 1
+
+        if not dry_run:
+            Employee.objects.bulk_create(to_create, batch_size=batch_size)
+            Employee.objects.bulk_update(to_update, EMPLOYEE_FIELDS, batch_size=batch_size)
+            if to_update:
+                refresh_rollup(employee_ids=[employee.id for employee in to_update])
+            if to_create or to_update:
+                # bulk writes send no post_save; rates affect every month.
+                bump_all()
+
+    report["created"] = [e.full_name for e in to_create]
+    report["updated"] = [e.full_name for e in to_update]
+    report["imported"] = len(to_create) + len(to_update)
+    return report
@@ -0,0 +1,243 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from core.models import Job, JobStatus
+from services.imports import import_timesheet, import_services, import_employees
+from utils.excel_export import (
+    build_timesheet_workbook,
+    build_services_workbook,
+    build_salary_report_workbook,
+    build_salary_workbook,
+    workbook_to_file,
+)
+
+
+# kind -> (handler, permission required to start it)
+JOB_KINDS: dict[str, tuple] = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def job_handler(kind: str, permission: str | None = None):
+    """Register ``func(job) -> dict`` as the handler for jobs of ``kind``."""
+    def decorator(func):
+        JOB_KINDS[kind] = (func, permission)
+        return func
+    return decorator
+
+
+def enqueue(kind: str, params: dict | None = None, input_file=None, user=None) -> Job:
+    """Create a job and hand it to the configured runner.
+
+    ``JOB_RUNNER`` selects how it is executed: ``"thread"`` (default) uses an
+    in-process thread pool, ``"worker"`` leaves it for ``manage.py run_jobs``
+    and ``"sync"`` runs it immediately (tests).
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job(kind=kind, params=params or {})
+    if user is not None and user.is_authenticated:
+        job.created_by = user
+    if input_file is not None:
+        job.input_file.save(input_file.name, input_file, save=False)
+    job.save()
+
+    runner = getattr(settings, "JOB_RUNNER", "thread")
+    if runner == "sync":
+        run_job(job.pk)
+        job.refresh_from_db()
+    elif runner == "thread":
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+    return job
+
+
+def run_job(job_id: int) -> bool:
+    """Claim a pending job and run it. Returns False if someone else claimed it."""
+    claimed = Job.objects.filter(pk=job_id, status=JobStatus.PENDING).update(
+        status=JobStatus.RUNNING, started_at=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    job = Job.objects.get(pk=job_id)
+    handler, _ = JOB_KINDS[job.kind]
+    try:
+        job.result = handler(job)
+        job.status = JobStatus.DONE
+        job.progress = 100
+        job.message = ""
+    except Exception as exc:
+        job.status = JobStatus.FAILED
+        job.message = str(exc)
+    if job.input_file:
+        job.input_file.delete(save=False)
+    # Only a job still running is finished here: one failed as stale
+    # meanwhile stays failed, and its result is dropped.
+    finished = Job.objects.filter(pk=job.pk, status=JobStatus.RUNNING).update(
+        result=job.result,
+        result_file=job.result_file.name or "",
+        input_file="",
+        status=job.status,
+        progress=job.progress,
+        message=job.message,
+        finished_at=timezone.now(),
+    )
+    if not finished and job.result_file:
+        job.result_file.delete(save=False)
+    expire_job_results()
+    return True
+
+
+def is_stale(job: Job) -> bool:
+    """Running for longer than ``JOB_STALE_AFTER`` seconds: its process is presumed gone."""
+    return (
+        job.status == JobStatus.RUNNING
+        and job.started_at is not None
+        and job.started_at < timezone.now() - timedelta(seconds=settings.JOB_STALE_AFTER)
+    )
+
+
+def fail_stale_jobs(job_ids=None) -> int:
+    """Mark stale running jobs failed and drop their input files. Returns their number."""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_STALE_AFTER)
+    stale = Job.objects.filter(status=JobStatus.RUNNING, started_at__lt=cutoff)
+    if job_ids is not None:
+        stale = stale.filter(pk__in=job_ids)
+    failed = 0
+    for job in stale:
+        # Filtered on status again in case the job finished meanwhile.
+        if Job.objects.filter(pk=job.pk, status=JobStatus.RUNNING).update(
+            status=JobStatus.FAILED, message="Задача прервана: обработчик остановлен", finished_at=timezone.now(),
+        ):
+            failed += 1
+            if job.input_file:
+                job.input_file.delete(save=False)
+                Job.objects.filter(pk=job.pk).update(input_file="")
+    return failed
+
+
+def expire_job_results() -> int:
+    """Delete result files of jobs finished more than ``JOB_RESULT_TTL`` seconds ago.
+
+    Returns the number of files deleted.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_RESULT_TTL)
+    expired = Job.objects.filter(finished_at__lt=cutoff).exclude(result_file="")
+    deleted = 0
+    for job in expired:
+        job.result_file.delete(save=False)
+        Job.objects.filter(pk=job.pk).update(result_file="")
+        deleted += 1
+    return deleted
+
+
+def run_next_job() -> bool:
+    """Run the oldest pending job, if any. Used by the ``run_jobs`` worker,
+    which also fails jobs left running by a process that died."""
+    fail_stale_jobs()
+    pending = Job.objects.filter(status=JobStatus.PENDING).order_by("created_at").values_list("pk", flat=True)
+    for job_id in pending[:10]:
+        if run_job(job_id):
+            return True
+    return False
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "JOB_WORKERS", 2),
+                thread_name_prefix="job",
+            )
+    return _executor
+
+
+def _run_in_thread(job_id: int):
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def _month(job) -> date:
+    return date.fromisoformat(job.params["month"])
+
+
+def _save_workbook(job, wb, filename: str) -> dict:
+    job.set_progress(90, "Сохранение файла")
+    with workbook_to_file(wb) as tmp:
+        job.result_file.save(filename, File(tmp), save=False)
+    return {"filename": filename}
+
+
+@job_handler("export_timesheet", "core.export_timesheet")
+def _export_timesheet(job):
+    first_day = _month(job)
+    job.set_progress(10, "Формирование табеля")
+    wb = build_timesheet_workbook(first_day)
+    return _save_workbook(job, wb, f"tabel_{first_day.year}_{first_day.month:02d}.xlsx")
+
+
+@job_handler("export_services", "core.export_services")
+def _export_services(job):
+    first_day = _month(job)
+    job.set_progress(10, "Формирование отчёта по услугам")
+    wb = build_services_workbook(first_day)
+    return _save_workbook(job, wb, f"uslugi_{first_day.year}_{first_day.month:02d}.xlsx")
+
+
+@job_handler("export_salary_report", "core.export_salary")
+def _export_salary_report(job):
+    first_day = _month(job)
+    job.set_progress(10, "Формирование отчёта по зарплате")
+    wb = build_salary_report_workbook(first_day)
+    return _save_workbook(job, wb, f"zarplata_{first_day.year}_{first_day.month:02d}.xlsx")
+
+
+@job_handler("export_salary_full", "core.export_salary")
+def _export_salary_full(job):
+    first_day = _month(job)
+    job.set_progress(10, "Формирование зарплатной ведомости")
+    wb = build_salary_workbook(first_day, True, job.params.get("department"))
+    return _save_workbook(job, wb, f"zarplata_{first_day.year}_{first_day.month:02d}.xlsx")
+
+
+@job_handler("export_salary_advance", "core.export_salary")
+def _export_salary_advance(job):
+    first_day = _month(job)
+    job.set_progress(10, "Формирование ведомости аванса")
+    wb = build_salary_workbook(first_day, False, job.params.get("department"))
+    return _save_workbook(job, wb, f"avans_{first_day.year}_{first_day.month:02d}.xlsx")
+
+
+@job_handler("import_timesheet", "core.change_workschedule")
+def _import_timesheet(job):
+    def progress(done, total):
+        job.set_progress(done * 100 // max(total, 1), f"Обработано строк: {done}")
+
+    with job.input_file.open("rb") as f:
+        return import_timesheet(f, _month(job), progress=progress)
+
+
+@job_handler("import_services", "core.change_employeeservicerecord")
+def _import_services(job):
+    def progress(done, total):
+        job.set_progress(done * 100 // max(total, 1), f"Обработано строк: {done}")
+
+    with job.input_file.open("rb") as f:
+        return import_services(f, progress=progress)
+
+
+@job_handler("import_employees", "core.import_employees")
+def _import_employees(job):
+    with job.input_file.open("rb") as f:
+        return import_employees(f, dry_run=bool(job.params.get("dry_run")))
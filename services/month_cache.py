@@ -0,0 +1,279 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from datetime import date
+
+from django.core.cache import cache
+from django.db import transaction
+
+from helpers.utils import MonthSchedule, get_employees_queryset
+from services.payroll_rollup import read_month_payroll
+from services.snapshots import get_closed_month, snapshot_payroll, snapshot_rows
+
+
+CACHE_TIMEOUT = 60 * 60 * 24
+GLOBAL_SCOPE = "all"
+# Rendered rows are stored this many per cache entry, so a page of a few
+# thousand employees is a few dozen keys rather than one per row.
+ROW_CHUNK = 100
+# Bumping more rows than this bumps the whole month's rows with one write.
+ROW_BUMP_LIMIT = ROW_CHUNK
+# Hit/miss counters are kept per process and added to the shared ones at
+# most this often (seconds), not written on every lookup.
+STATS_FLUSH_INTERVAL = 10
+
+STATS = ("hits", "misses", "row_hits", "row_misses")
+
+_pending_stats: Counter = Counter()
+_stats_lock = threading.Lock()
+_stats_flushed_at = time.monotonic()
+
+
+def _version_key(scope: str) -> str:
+    return f"month-cache:version:{scope}"
+
+
+def _month_scope(first_day: date) -> str:
+    return first_day.strftime("%Y-%m")
+
+
+def _rows_scope(first_day: date) -> str:
+    return f"rows:{_month_scope(first_day)}"
+
+
+def _new_token() -> int:
+    # Taken from the clock rather than counted from 1 so that a version
+    # evicted from the cache cannot come back at a value older entries were
+    # stored under.
+    return time.time_ns()
+
+
+def _get_version(scope: str) -> int:
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_token(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(scope: str) -> None:
+    # A plain set rather than incr: incr is not atomic on the file and
+    # database backends either, and would re-set the key with the default
+    # timeout.
+    cache.set(_version_key(scope), _new_token(), timeout=None)
+
+
+def _bump_now_and_on_commit(scope: str) -> None:
+    # The immediate bump covers reads inside the writing transaction, the one
+    # on commit drops anything a concurrent reader cached from the old data
+    # in between.
+    _bump(scope)
+    transaction.on_commit(lambda: _bump(scope))
+
+
+def bump_month(first_day: date) -> None:
+    """Invalidate cached data of the month containing ``first_day``."""
+    _bump_now_and_on_commit(_month_scope(first_day))
+
+
+def bump_all() -> None:
+    """Invalidate cached data of every month (rates, services, settings)."""
+    _bump_now_and_on_commit(GLOBAL_SCOPE)
+
+
+def _row_version_key(first_day: date, employee_id: int) -> str:
+    return f"month-cache:row-version:{_month_scope(first_day)}:{employee_id}"
+
+
+def bump_rows(first_day: date, employee_ids) -> None:
+    """Invalidate cached row fragments of given employees for the month.
+
+    Each bumped employee gets a version key of their own; past
+    ``ROW_BUMP_LIMIT`` employees (imports, bulk fills) the month's rows are
+    bumped as a whole instead, so the write count stays small.
+    """
+    keys = [_row_version_key(first_day, employee_id) for employee_id in set(employee_ids)]
+    if not keys:
+        return
+    if len(keys) > ROW_BUMP_LIMIT:
+        bump_month_rows(first_day)
+        return
+
+    def bump():
+        token = _new_token()
+        cache.set_many(dict.fromkeys(keys, token), timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def bump_month_rows(first_day: date) -> None:
+    """Invalidate cached row fragments of every employee for the month."""
+    _bump_now_and_on_commit(_rows_scope(first_day))
+
+
+def row_versions(first_day: date, employee_ids) -> dict[int, tuple[int, int]]:
+    """Current row version of each employee for the month.
+
+    A version is the month's rows version and the employee's own one, which
+    is 0 until their row is first bumped; nothing is written for rows that
+    were never bumped. Row version keys are only lost together with the
+    month's rows version (the cache is culled as a whole), so a lost key
+    cannot make an old fragment current again.
+    """
+    base = _get_version(_rows_scope(first_day))
+    keys = {employee_id: _row_version_key(first_day, employee_id) for employee_id in employee_ids}
+    found = cache.get_many(keys.values())
+    return {employee_id: (base, found.get(key, 0)) for employee_id, key in keys.items()}
+
+
+def month_version(first_day: date) -> str:
+    return f"{_get_version(GLOBAL_SCOPE)}.{_get_version(_month_scope(first_day))}"
+
+
+def cached_month(kind: str, first_day: date, department_id, compute):
+    """Return ``compute()`` cached under (kind, month, department, data version)."""
+    first_day = first_day.replace(day=1)
+    key = f"month-cache:{kind}:{_month_scope(first_day)}:{department_id or '-'}:{month_version(first_day)}"
+    value = cache.get(key)
+    _count("hits" if value is not None else "misses")
+    if value is None:
+        value = compute()
+        cache.set(key, value, CACHE_TIMEOUT)
+    return value
+
+
+def _chunk_key(prefix: str, employee_ids: list[int]) -> str:
+    digest = hashlib.md5(",".join(map(str, employee_ids)).encode()).hexdigest()
+    return f"{prefix}:{digest}"
+
+
+def cached_rows(kind: str, first_day: date, employee_ids, render, extra: str = "") -> dict[int, str]:
+    """Return rendered rows ``{employee_id: html}``, rendering only stale ones.
+
+    Rows are cached in chunks of ``ROW_CHUNK`` consecutive employees under
+    (kind, month, global version, ``extra``, employee ids); each row in a
+    chunk keeps the row version it was rendered at, so a bumped row is
+    re-rendered alone. ``render(missing_ids)`` must return html for every
+    employee it is given.
+    """
+    first_day = first_day.replace(day=1)
+    employee_ids = list(employee_ids)
+    versions = row_versions(first_day, employee_ids)
+    prefix = f"month-cache:rows:{kind}:{_month_scope(first_day)}:{_get_version(GLOBAL_SCOPE)}:{extra}"
+    chunks = {
+        _chunk_key(prefix, chunk): chunk
+        for chunk in (employee_ids[i:i + ROW_CHUNK] for i in range(0, len(employee_ids), ROW_CHUNK))
+    }
+    found = cache.get_many(chunks)
+
+    rows: dict[int, str] = {}
+    missing = []
+    for key, chunk in chunks.items():
+        cached = found.get(key, {})
+        for employee_id in chunk:
+            version, html = cached.get(employee_id, (None, None))
+            if version == versions[employee_id]:
+                rows[employee_id] = html
+            else:
+                missing.append(employee_id)
+    _count("row_hits", len(rows))
+    _count("row_misses", len(missing))
+
+    if missing:
+        rows.update(render(missing))
+        stale = set(missing)
+        cache.set_many(
+            {
+                key: {employee_id: (versions[employee_id], rows[employee_id]) for employee_id in chunk}
+                for key, chunk in chunks.items()
+                if stale.intersection(chunk)
+            },
+            CACHE_TIMEOUT,
+        )
+    return rows
+
+
+def _stats_key(name: str) -> str:
+    return f"month-cache:stats:{name}"
+
+
+def _count(name: str, delta: int = 1) -> None:
+    if not delta:
+        return
+    with _stats_lock:
+        _pending_stats[name] += delta
+        due = time.monotonic() - _stats_flushed_at >= STATS_FLUSH_INTERVAL
+    if due:
+        flush_cache_stats()
+
+
+def flush_cache_stats() -> None:
+    """Add this process's pending hit/miss counts to the shared counters."""
+    global _stats_flushed_at
+    with _stats_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+        _stats_flushed_at = time.monotonic()
+    if not pending:
+        return
+    keys = {name: _stats_key(name) for name in pending}
+    found = cache.get_many(keys.values())
+    # Not atomic across processes; a flush racing another may lose its counts.
+    cache.set_many({key: found.get(key, 0) + pending[name] for name, key in keys.items()}, timeout=None)
+
+
+def cache_stats() -> dict[str, int]:
+    """Hit/miss counters since the last reset, summed over all processes
+    sharing the cache backend. Other processes add theirs every
+    ``STATS_FLUSH_INTERVAL`` seconds of activity."""
+    flush_cache_stats()
+    found = cache.get_many([_stats_key(name) for name in STATS])
+    return {name: found.get(_stats_key(name), 0) for name in STATS}
+
+
+def reset_cache_stats() -> None:
+    with _stats_lock:
+        _pending_stats.clear()
+    cache.delete_many([_stats_key(name) for name in STATS])
+
+
+def get_month_schedule(first_day: date, department_id=None) -> MonthSchedule:
+    return cached_month(
+        "schedule", first_day, department_id,
+        lambda: MonthSchedule.load(first_day, department_id=department_id),
+    )
+
+
+def get_month_payroll(first_day: date, department_id=None) -> dict[int, dict]:
+    """Cached month payroll: the snapshot of a closed month, else the rollup."""
+    def compute():
+        payroll = snapshot_payroll(first_day, department_id)
+        return read_month_payroll(first_day, department_id) if payroll is None else payroll
+
+    return cached_month("payroll", first_day, department_id, compute)
+
+
+def read_payroll(first_day: date, employee_ids) -> dict[int, dict]:
+    """Month payroll of some employees, read directly rather than through
+    the whole-month cache entry; for rendering a few rows."""
+    employee_ids = list(employee_ids)
+    payroll = snapshot_payroll(first_day, employee_ids=employee_ids)
+    return read_month_payroll(first_day, employee_ids=employee_ids) if payroll is None else payroll
+
+
+def get_payroll_rows(first_day: date, department_id=None) -> list[tuple]:
+    """``(employee, pay)`` pairs for reports, ordered by department and name.
+
+    Closed months are served from their snapshot, so employees added,
+    moved or deleted after closing do not change the report.
+    """
+    if get_closed_month(first_day) is not None:
+        return snapshot_rows(first_day, department_id)
+    payroll = get_month_payroll(first_day, department_id)
+    employees = get_employees_queryset().order_by("department__name", "full_name")
+    if department_id:
+        employees = employees.filter(department_id=department_id)
+    return [(employee, payroll[employee.id]) for employee in employees]
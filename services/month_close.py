@@ -0,0 +1,83 @@
+from datetime import date
+from decimal import Decimal
+
+from django.core.files import File
+from django.db import transaction
+
+from core.models import ClosedMonth, PayrollSnapshot
+from helpers.utils import get_employees_queryset
+from services.payroll import COUNT_COLUMNS, MONEY_COLUMNS, compute_month_payroll
+from services.snapshots import MonthClosedError, get_closed_month
+from utils.excel_export import build_salary_report_workbook, build_salary_workbook, workbook_to_file
+
+
+BATCH_SIZE = 1000
+
+
+def artifact_filenames(first_day: date) -> dict[str, str]:
+    """File name of each pre-generated workbook of a closed month."""
+    suffix = f"{first_day.year}_{first_day.month:02d}.xlsx"
+    return {
+        "salary_file": f"zarplata_{suffix}",
+        "advance_file": f"avans_{suffix}",
+        "report_file": f"zarplata_otchet_{suffix}",
+    }
+
+
+def close_month(first_day: date, user=None) -> ClosedMonth:
+    """Freeze the month's payroll into a snapshot and pre-generate its workbooks.
+
+    The payroll is computed from the raw schedule and service records, so the
+    snapshot does not depend on the state of the rollup. Afterwards writes to
+    the month are rejected until :func:`reopen_month`.
+    """
+    first_day = first_day.replace(day=1)
+    if get_closed_month(first_day) is not None:
+        raise MonthClosedError(f"Месяц {first_day:%m.%Y} уже закрыт")
+
+    with transaction.atomic():
+        closed = ClosedMonth.objects.create(
+            month=first_day, closed_by=user if user is not None and user.is_authenticated else None,
+        )
+        payroll = compute_month_payroll(first_day).to_dict("index")
+        PayrollSnapshot.objects.bulk_create(
+            [
+                PayrollSnapshot(
+                    closed_month=closed,
+                    employee_id=employee.id,
+                    department_id=employee.department_id,
+                    full_name=employee.full_name,
+                    department_name=employee.department.name,
+                    position_name=employee.position.name,
+                    **{column: int(payroll[employee.id][column]) for column in COUNT_COLUMNS},
+                    **{column: Decimal(str(round(payroll[employee.id][column], 2))) for column in MONEY_COLUMNS},
+                )
+                for employee in get_employees_queryset().iterator(chunk_size=BATCH_SIZE)
+                if employee.id in payroll
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+        # The builders now read the snapshot just written.
+        workbooks = {
+            "salary_file": build_salary_workbook(first_day, full_month=True),
+            "advance_file": build_salary_workbook(first_day, full_month=False),
+            "report_file": build_salary_report_workbook(first_day),
+        }
+        for field, filename in artifact_filenames(first_day).items():
+            with workbook_to_file(workbooks[field]) as tmp:
+                getattr(closed, field).save(filename, File(tmp), save=False)
+        closed.save()
+    return closed
+
+
+def reopen_month(first_day: date) -> bool:
+    """Drop the month's snapshot and workbooks so it can be edited again."""
+    closed = get_closed_month(first_day)
+    if closed is None:
+        return False
+    with transaction.atomic():
+        files = [getattr(closed, field) for field in artifact_filenames(first_day)]
+        closed.delete()
+        transaction.on_commit(lambda: [f.delete(save=False) for f in files if f])
+    return True
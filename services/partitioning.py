@@ -0,0 +1,237 @@
+"""Optional monthly range partitioning of the schedule tables (PostgreSQL only).
+
+``core_workschedule`` and its history table are split by the schedule
+``date`` into one partition per month plus a default partition for dates
+outside of them. Converting changes the primary keys to ``(pk, date)``
+because PostgreSQL requires the partition key in every unique constraint;
+Django keeps using the id alone, which stays unique through its sequence.
+Other backends are left as they are.
+"""
+import re
+from datetime import date
+
+from django.db import connection, transaction
+
+from core.models import WorkSchedule
+from helpers.utils import add_months, month_bounds
+from services.month_cache import bump_month, bump_month_rows
+
+
+PARTITION_KEY = "date"
+DEFAULT_AHEAD = 3
+
+_PARTITION_RE = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def is_supported() -> bool:
+    return connection.vendor == "postgresql"
+
+
+def partitioned_models() -> list:
+    return [WorkSchedule, WorkSchedule.history.model]
+
+
+def partition_name(table: str, first_day: date) -> str:
+    return f"{table}_p{first_day:%Y_%m}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def _qn(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [table])
+    return cursor.fetchone() is not None
+
+
+def list_partitions(cursor, table: str) -> dict[date, str]:
+    """Monthly partitions of ``table`` as ``{first day: partition name}``."""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass",
+        [table],
+    )
+    result = {}
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_RE.search(name)
+        if match:
+            result[date(int(match[1]), int(match[2]), 1)] = name
+    return result
+
+
+def _bounds_sql(first_day: date) -> str:
+    start, end = month_bounds(first_day)
+    return f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+
+
+def _create_partition(cursor, table: str, first_day: date) -> str:
+    """Create the month partition, moving its rows out of the default one."""
+    name = partition_name(table, first_day)
+    start, end = month_bounds(first_day)
+    default = default_partition_name(table)
+    cursor.execute(f"CREATE TABLE {_qn(name)} (LIKE {_qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    # Attaching fails while the default partition holds rows of the range.
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {_qn(default)} WHERE {_qn(PARTITION_KEY)} >= %s "
+        f"AND {_qn(PARTITION_KEY)} < %s RETURNING *) INSERT INTO {_qn(name)} SELECT * FROM moved",
+        [start, end],
+    )
+    cursor.execute(f"ALTER TABLE {_qn(table)} ATTACH PARTITION {_qn(name)} {_bounds_sql(first_day)}")
+    return name
+
+
+def _unique_columns(definition: str) -> list[str]:
+    inner = definition[definition.index("(") + 1:definition.rindex(")")]
+    return [column.strip().strip('"') for column in inner.split(",")]
+
+
+def _convert(cursor, model) -> list[str]:
+    """Rebuild ``model``'s table as a partitioned one with the same data."""
+    table = model._meta.db_table
+    legacy = f"{table}_unpartitioned"
+    pk_column = model._meta.pk.column
+
+    cursor.execute("SELECT 1 FROM pg_constraint WHERE confrelid = %s::regclass", [table])
+    if cursor.fetchone():
+        raise PartitioningError(f"{table} is referenced by foreign keys")
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = %s",
+        [table],
+    )
+    constraint_names = {name for name, _, _ in constraints}
+    indexes = [(name, sql) for name, sql in cursor.fetchall() if name not in constraint_names]
+    cursor.execute(
+        "SELECT is_identity = 'YES', pg_get_serial_sequence(%s, %s) FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s",
+        [table, pk_column, table, pk_column],
+    )
+    is_identity, sequence = cursor.fetchone()
+
+    cursor.execute(f"ALTER TABLE {_qn(table)} RENAME TO {_qn(legacy)}")
+    # Free the index names for the new table; the old one is dropped below.
+    for name, _ in indexes:
+        cursor.execute(f"DROP INDEX {_qn(name)}")
+    for name, kind, _ in constraints:
+        if kind in "pu":
+            cursor.execute(f"ALTER TABLE {_qn(legacy)} DROP CONSTRAINT {_qn(name)}")
+
+    cursor.execute(
+        f"CREATE TABLE {_qn(table)} (LIKE {_qn(legacy)} INCLUDING DEFAULTS INCLUDING IDENTITY "
+        f"INCLUDING CONSTRAINTS) PARTITION BY RANGE ({_qn(PARTITION_KEY)})"
+    )
+    for name, kind, definition in constraints:
+        if kind in "pu":
+            columns = _unique_columns(definition)
+            if PARTITION_KEY not in columns:
+                columns.append(PARTITION_KEY)
+            keyword = "PRIMARY KEY" if kind == "p" else "UNIQUE"
+            definition = f"{keyword} ({', '.join(_qn(column) for column in columns)})"
+        cursor.execute(f"ALTER TABLE {_qn(table)} ADD CONSTRAINT {_qn(name)} {definition}")
+    for _, sql in indexes:
+        cursor.execute(sql)
+
+    default = default_partition_name(table)
+    cursor.execute(f"CREATE TABLE {_qn(default)} PARTITION OF {_qn(table)} DEFAULT")
+    cursor.execute(
+        f"SELECT DISTINCT date_trunc('month', {_qn(PARTITION_KEY)})::date FROM {_qn(legacy)} "
+        f"WHERE {_qn(PARTITION_KEY)} IS NOT NULL ORDER BY 1"
+    )
+    months = [row[0] for row in cursor.fetchall()]
+    for first_day in months:
+        cursor.execute(
+            f"CREATE TABLE {_qn(partition_name(table, first_day))} PARTITION OF {_qn(table)} "
+            + _bounds_sql(first_day)
+        )
+    cursor.execute(f"INSERT INTO {_qn(table)} SELECT * FROM {_qn(legacy)}")
+
+    if is_identity:
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(MAX({_qn(pk_column)}), 0) + 1, false) "
+            f"FROM {_qn(table)}",
+            [table, pk_column],
+        )
+    elif sequence:
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {_qn(table)}.{_qn(pk_column)}")
+    cursor.execute(f"DROP TABLE {_qn(legacy)}")
+    return [partition_name(table, first_day) for first_day in months]
+
+
+def convert_tables() -> list[str]:
+    """Partition the schedule tables that are not partitioned yet.
+
+    Copies every row in one transaction, so run it in a maintenance window.
+    Returns the names of the created month partitions.
+    """
+    if not is_supported():
+        return []
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in partitioned_models():
+            if not is_partitioned(cursor, model._meta.db_table):
+                created += _convert(cursor, model)
+    return created
+
+
+def ensure_partitions(first_day: date, months: int = DEFAULT_AHEAD) -> list[str]:
+    """Create missing partitions from ``first_day``'s month for ``months`` months."""
+    if not is_supported():
+        return []
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in partitioned_models():
+            table = model._meta.db_table
+            if not is_partitioned(cursor, table):
+                continue
+            existing = list_partitions(cursor, table)
+            for offset in range(months):
+                month = add_months(first_day.replace(day=1), offset)
+                if month not in existing:
+                    created.append(_create_partition(cursor, table, month))
+    return created
+
+
+def detach_partitions(before: date, archive_schema: str | None = None) -> list[str]:
+    """Detach month partitions older than ``before``'s month.
+
+    Detached tables keep their rows but drop out of the application; with
+    ``archive_schema`` they are also moved into that schema.
+    """
+    if not is_supported():
+        return []
+    before = before.replace(day=1)
+    detached = []
+    months = set()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if archive_schema:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {_qn(archive_schema)}")
+        for model in partitioned_models():
+            table = model._meta.db_table
+            if not is_partitioned(cursor, table):
+                continue
+            for first_day, name in sorted(list_partitions(cursor, table).items()):
+                if first_day >= before:
+                    continue
+                cursor.execute(f"ALTER TABLE {_qn(table)} DETACH PARTITION {_qn(name)}")
+                if archive_schema:
+                    cursor.execute(f"ALTER TABLE {_qn(name)} SET SCHEMA {_qn(archive_schema)}")
+                detached.append(name)
+                months.add(first_day)
+        for first_day in months:
+            bump_month(first_day)
+            bump_month_rows(first_day)
+    return detached
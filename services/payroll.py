@@ -1,39 +1,22 @@
+from datetime import date
 from decimal import Decimal
 from typing import Iterable, Dict
 
-from core.models import Service, WorkSchedule
+import numpy as np
+import pandas as pd
+
+from core.models import Employee, Service, WorkSchedule, EmployeeServiceRecord, ShiftType
+from helpers.utils import get_working_days, get_shift_counts
 
 
 SHIFT_DAY = 'day'
 SHIFT_NIGHT = 'night'
 WORK_SHIFTS = {SHIFT_DAY, SHIFT_NIGHT}
+ADVANCE_LAST_DAY = 15
 
-
-def count_shifts(shifts: Dict[int, str], period_days: Iterable[int] | None = None) -> tuple[int, int]:
-    """Return number of day and night shifts in the given period."""
-    day_count = night_count = 0
-    for day, shift in shifts.items():
-        if period_days is not None and day not in period_days:
-            continue
-        if shift == SHIFT_DAY:
-            day_count += 1
-        elif shift == SHIFT_NIGHT:
-            night_count += 1
-    return day_count, night_count
-
-
-def calculate_shift_salary(employee, day_count: int, night_count: int, *, worked_days: int | None = None, working_days_total: int | None = None) -> Decimal:
-    """Calculate salary for shifts for the given employee."""
-    if employee.is_fixed_salary:
-        if worked_days is not None and working_days_total:
-            base = (Decimal(employee.fixed_salary) / working_days_total) * worked_days
-        else:
-            base = Decimal(employee.fixed_salary)
-        return base + Decimal(employee.bonus or 0)
-    return (
-        Decimal(day_count) * Decimal(employee.day_shift_rate)
-        + Decimal(night_count) * Decimal(employee.night_shift_rate)
-    )
+MONEY_COLUMNS = ["shift_pay", "bonus", "services", "total", "advance"]
+COUNT_COLUMNS = list(ShiftType.values) + [f"{shift}_1_{ADVANCE_LAST_DAY}" for shift in (SHIFT_DAY, SHIFT_NIGHT)]
+PAYROLL_COLUMNS = COUNT_COLUMNS + MONEY_COLUMNS
 
 
 def calculate_service_sum(services: Iterable[Service], quantities: Dict[int, int]) -> Decimal:
@@ -44,3 +27,114 @@ def calculate_service_sum(services: Iterable[Service], quantities: Dict[int, int
         total += Decimal(qty) * Decimal(service.price)
     return total
 
+
+def _to_cents(values) -> np.ndarray:
+    return np.round(np.asarray(values, dtype=float) * 100).astype(np.int64)
+
+
+def _prorate(amount_cents: np.ndarray, worked: np.ndarray, working_days: int) -> np.ndarray:
+    """``amount * worked / working_days`` in whole cents, rounding half up."""
+    if not working_days:
+        return np.zeros_like(amount_cents)
+    return (amount_cents * worked * 2 + working_days) // (2 * working_days)
+
+
+EMPLOYEE_PAY_FIELDS = ["day_shift_rate", "night_shift_rate", "is_fixed_salary", "fixed_salary", "bonus"]
+
+
+def _service_sums(first_day: date, department_id=None, employee_ids=None) -> pd.Series:
+    """Service amounts in cents per employee for the month."""
+    records = EmployeeServiceRecord.objects.filter(month=first_day)
+    if department_id:
+        records = records.filter(employee__department_id=department_id)
+    if employee_ids is not None:
+        records = records.filter(employee_id__in=list(employee_ids))
+    df = pd.DataFrame.from_records(
+        records.values_list("employee_id", "quantity", "service__price"),
+        columns=["employee_id", "quantity", "price"],
+    )
+    amounts = df["quantity"].to_numpy(dtype=np.int64) * _to_cents(df["price"])
+    return pd.Series(amounts, index=df["employee_id"], dtype=np.int64).groupby(level=0).sum()
+
+
+def employee_pay_frame(employees) -> pd.DataFrame:
+    """Rates of an Employee queryset as a DataFrame indexed by employee id."""
+    return pd.DataFrame.from_records(
+        employees.values_list("id", *EMPLOYEE_PAY_FIELDS),
+        columns=["id", "day_rate", "night_rate", "is_fixed", "fixed_salary", "bonus"],
+        index="id",
+    )
+
+
+def payroll_money(counts: pd.DataFrame, emp: pd.DataFrame, services: pd.Series, working_days: int) -> pd.DataFrame:
+    """Money columns in roubles for ``counts`` rows (see :func:`compute_month_payroll`).
+
+    ``emp`` comes from :func:`employee_pay_frame` and ``services`` holds
+    service amounts in cents; both are aligned to ``counts.index``.
+    """
+    emp = emp.reindex(counts.index)
+    is_fixed = emp["is_fixed"].fillna(False).to_numpy(dtype=bool)
+    day_rate = _to_cents(emp["day_rate"].fillna(0))
+    night_rate = _to_cents(emp["night_rate"].fillna(0))
+    fixed_salary = _to_cents(emp["fixed_salary"].fillna(0))
+
+    def shift_pay(day, night):
+        hourly = day * day_rate + night * night_rate
+        return np.where(is_fixed, _prorate(fixed_salary, day + night, working_days), hourly)
+
+    pay = shift_pay(counts[SHIFT_DAY].to_numpy(dtype=np.int64), counts[SHIFT_NIGHT].to_numpy(dtype=np.int64))
+    advance = shift_pay(
+        counts[f"{SHIFT_DAY}_1_{ADVANCE_LAST_DAY}"].to_numpy(dtype=np.int64),
+        counts[f"{SHIFT_NIGHT}_1_{ADVANCE_LAST_DAY}"].to_numpy(dtype=np.int64),
+    )
+    bonus = _to_cents(emp["bonus"].fillna(0))
+    services = services.reindex(counts.index, fill_value=0).to_numpy(dtype=np.int64)
+
+    return pd.DataFrame({
+        "shift_pay": pay / 100,
+        "bonus": bonus / 100,
+        "services": services / 100,
+        "total": (pay + bonus + services) / 100,
+        "advance": advance / 100,
+    }, index=counts.index)
+
+
+def compute_month_payroll(first_day: date, department_id=None, employee_ids=None) -> pd.DataFrame:
+    """Compute the month's payroll for all employees (or one department) at once.
+
+    Returns a DataFrame indexed by employee id with a count column per shift
+    type, ``day_1_15``/``night_1_15`` for the advance period and money columns
+    in roubles:
+
+    * ``shift_pay`` – hourly employees: day and night shifts times their rates;
+      salaried employees: ``fixed_salary`` prorated by worked (day + night)
+      shifts over the month's working days;
+    * ``bonus`` and ``services`` – paid with the final salary only;
+    * ``total`` – ``shift_pay + bonus + services``;
+    * ``advance`` – shift pay for days 1-15 computed by the same rules.
+
+    Money is computed in integer cents and converted to roubles at the end,
+    so rounding is exact. ``employee_ids`` limits the result to those employees.
+    """
+    working_days = get_working_days(first_day.year, first_day.month)
+
+    employees = Employee.objects.all()
+    if department_id:
+        employees = employees.filter(department_id=department_id)
+    if employee_ids is not None:
+        employees = employees.filter(id__in=list(employee_ids))
+    emp = employee_pay_frame(employees)
+    result = pd.DataFrame(0, index=emp.index, columns=PAYROLL_COLUMNS, dtype=np.int64)
+    if emp.empty:
+        return result.astype({c: float for c in MONEY_COLUMNS})
+
+    counts = pd.DataFrame.from_dict(
+        get_shift_counts(first_day, department_id, ADVANCE_LAST_DAY, employee_ids),
+        orient="index",
+        columns=COUNT_COLUMNS,
+    )
+    result.update(counts)
+    result = result.astype(np.int64).astype({c: float for c in MONEY_COLUMNS})
+    services = _service_sums(first_day, department_id, employee_ids)
+    result[MONEY_COLUMNS] = payroll_money(result, emp, services, working_days)[MONEY_COLUMNS]
+    return result
@@ -0,0 +1,189 @@
+"""Per-employee month payroll kept in EmployeePayrollMonth.
+
+Shift counts are maintained from the changed cells only; money columns are
+recomputed from the stored counts, current rates and service records of the
+touched employees. Reads fill in rows that are missing (new employees, months
+not read since the table was added) from the raw data.
+"""
+from collections import Counter
+from datetime import date
+from decimal import Decimal
+from typing import Iterable
+
+import pandas as pd
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Employee, EmployeePayrollMonth, EmployeeServiceRecord, ShiftType, WorkSchedule
+from helpers.utils import get_working_days
+from services.payroll import (
+    ADVANCE_LAST_DAY,
+    COUNT_COLUMNS,
+    MONEY_COLUMNS,
+    PAYROLL_COLUMNS,
+    WORK_SHIFTS,
+    _service_sums,
+    compute_month_payroll,
+    employee_pay_frame,
+    payroll_money,
+)
+
+
+BATCH_SIZE = 1000
+VALID_SHIFTS = set(ShiftType.values)
+
+
+def _count_fields(day: date, shift: str | None) -> list[str]:
+    if shift not in VALID_SHIFTS:
+        return []
+    if shift in WORK_SHIFTS and day.day <= ADVANCE_LAST_DAY:
+        return [shift, f"{shift}_1_{ADVANCE_LAST_DAY}"]
+    return [shift]
+
+
+def _set_money(rows: list[EmployeePayrollMonth], first_day: date) -> None:
+    """Recompute money fields of ``rows`` (one month) from their counts."""
+    if not rows:
+        return
+    now = timezone.now()
+    employee_ids = [row.employee_id for row in rows]
+    counts = pd.DataFrame.from_records(
+        [[getattr(row, column) for column in COUNT_COLUMNS] for row in rows],
+        columns=COUNT_COLUMNS,
+        index=employee_ids,
+    )
+    money = payroll_money(
+        counts,
+        employee_pay_frame(Employee.objects.filter(id__in=employee_ids)),
+        _service_sums(first_day, employee_ids=employee_ids),
+        get_working_days(first_day.year, first_day.month),
+    )
+    for row, values in zip(rows, money[MONEY_COLUMNS].itertuples(index=False)):
+        for column, value in zip(MONEY_COLUMNS, values):
+            setattr(row, column, Decimal(str(round(value, 2))))
+        row.updated_at = now
+
+
+def rebuild_rollup(first_day: date, department_id=None, employee_ids=None, *, batch_size: int = BATCH_SIZE) -> int:
+    """Recompute rows of the month from raw schedule and service data.
+
+    Without ``department_id``/``employee_ids`` the whole month is replaced.
+    Returns the number of rows written.
+    """
+    first_day = first_day.replace(day=1)
+    payroll = compute_month_payroll(first_day, department_id, employee_ids)
+    rows = [
+        EmployeePayrollMonth(
+            employee_id=employee_id,
+            month=first_day,
+            **{column: int(values[column]) for column in COUNT_COLUMNS},
+            **{column: Decimal(str(round(values[column], 2))) for column in MONEY_COLUMNS},
+        )
+        for employee_id, values in payroll.to_dict("index").items()
+    ]
+    with transaction.atomic():
+        if department_id is None and employee_ids is None:
+            EmployeePayrollMonth.objects.filter(month=first_day).exclude(
+                employee_id__in=[row.employee_id for row in rows]
+            ).delete()
+        EmployeePayrollMonth.objects.bulk_create(
+            rows,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["employee", "month"],
+            update_fields=PAYROLL_COLUMNS + ["updated_at"],
+        )
+    return len(rows)
+
+
+def rollup_months() -> list[date]:
+    """Months that have schedule or service data."""
+    months = set(WorkSchedule.objects.dates("date", "month"))
+    months.update(EmployeeServiceRecord.objects.order_by().values_list("month", flat=True).distinct())
+    return sorted({month.replace(day=1) for month in months})
+
+
+def apply_cell_changes(changes: Iterable[tuple[int, date, str | None, str | None]]) -> None:
+    """Update counts and money for ``(employee_id, date, old shift, new shift)`` changes.
+
+    Employees without a row for the month are skipped; the row is computed
+    from the raw data when the month is read.
+    """
+    deltas: dict[date, dict[int, Counter]] = {}
+    for employee_id, day, old, new in changes:
+        if old == new:
+            continue
+        delta = deltas.setdefault(day.replace(day=1), {}).setdefault(employee_id, Counter())
+        delta.subtract(_count_fields(day, old))
+        delta.update(_count_fields(day, new))
+
+    for first_day, by_employee in deltas.items():
+        with transaction.atomic():
+            rows = list(
+                EmployeePayrollMonth.objects.select_for_update()
+                .filter(month=first_day, employee_id__in=list(by_employee))
+            )
+            for row in rows:
+                for column, change in by_employee[row.employee_id].items():
+                    setattr(row, column, max(getattr(row, column) + change, 0))
+            _set_money(rows, first_day)
+            EmployeePayrollMonth.objects.bulk_update(rows, PAYROLL_COLUMNS + ["updated_at"], batch_size=BATCH_SIZE)
+
+
+def refresh_rollup(first_day: date | None = None, employee_ids=None) -> int:
+    """Recompute money of stored rows after rates, prices or services changed.
+
+    Limited to one month and/or some employees when given. Returns the
+    number of rows updated.
+    """
+    rows = EmployeePayrollMonth.objects.all()
+    if first_day is not None:
+        rows = rows.filter(month=first_day.replace(day=1))
+    if employee_ids is not None:
+        rows = rows.filter(employee_id__in=list(employee_ids))
+
+    updated = 0
+    with transaction.atomic():
+        by_month: dict[date, list[EmployeePayrollMonth]] = {}
+        for row in rows.select_for_update().order_by("month", "employee_id"):
+            by_month.setdefault(row.month, []).append(row)
+        for month, month_rows in by_month.items():
+            _set_money(month_rows, month)
+            EmployeePayrollMonth.objects.bulk_update(month_rows, MONEY_COLUMNS + ["updated_at"], batch_size=BATCH_SIZE)
+            updated += len(month_rows)
+    return updated
+
+
+def read_month_payroll(first_day: date, department_id=None, employee_ids=None) -> dict[int, dict]:
+    """Payroll of the month as ``{employee_id: {column: value}}`` from the rollup.
+
+    Same shape as ``compute_month_payroll(...).to_dict("index")``: counts are
+    ints and money columns floats in roubles. Limited to a department and/or
+    some employees when given.
+    """
+    first_day = first_day.replace(day=1)
+    employees = Employee.objects.all()
+    rows = EmployeePayrollMonth.objects.filter(month=first_day)
+    if department_id:
+        employees = employees.filter(department_id=department_id)
+        rows = rows.filter(employee__department_id=department_id)
+    if employee_ids is not None:
+        employee_ids = list(employee_ids)
+        employees = employees.filter(id__in=employee_ids)
+        rows = rows.filter(employee_id__in=employee_ids)
+
+    def load(queryset):
+        return {
+            values.pop("employee_id"): {
+                **values, **{column: float(values[column]) for column in MONEY_COLUMNS}
+            }
+            for values in queryset.values("employee_id", *PAYROLL_COLUMNS)
+        }
+
+    payroll = load(rows)
+    missing = set(employees.values_list("id", flat=True)) - set(payroll)
+    if missing:
+        rebuild_rollup(first_day, employee_ids=missing)
+        payroll.update(load(rows.filter(employee_id__in=missing)))
+    return payroll
@@ -0,0 +1,124 @@
+"""Per-request profiles kept on local disk.
+
+Each profile is a ``.pstats`` file with the cProfile data and a ``.json``
+file with the summary: wall time, SQL grouped by normalised statement,
+template render time and peak memory. Only the last ``PROFILING_KEEP``
+profiles are kept.
+"""
+import json
+import pstats
+import re
+import uuid
+from datetime import datetime
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+TOKEN_SALT = "core.profiling"
+NAME_RE = re.compile(r"^\d{8}T\d{12}_[0-9a-f]{8}$")
+# Django's template backend entry point; its cumulative time covers the
+# whole render, nested {% include %} tags included.
+TEMPLATE_RENDER = ("django/template/backends/django.py", "render")
+TOP_FUNCTIONS = 40
+
+_IN_LIST_RE = re.compile(r"%s(?:, %s)+")
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+
+
+def profile_dir() -> Path:
+    return Path(settings.PROFILING_DIR)
+
+
+def profile_token() -> str:
+    """Signed value of the ``_profile`` query flag for users who are not staff."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign("profile")
+
+
+def check_token(value: str) -> bool:
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(value, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def normalize_sql(sql: str) -> str:
+    """Statement with literals and the length of ``IN`` lists removed."""
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("N", sql)
+    return _IN_LIST_RE.sub("%s, ...", sql)
+
+
+def template_time(stats: pstats.Stats) -> float:
+    """Seconds spent rendering templates, from the profile itself."""
+    path, name = TEMPLATE_RENDER
+    return sum(
+        cumulative
+        for (filename, _, function), (_, _, _, cumulative, _) in stats.stats.items()
+        if function == name and filename.replace("\\", "/").endswith(path)
+    )
+
+
+def save_profile(profiler, summary: dict) -> str:
+    """Write the profile and its summary, drop the oldest beyond ``PROFILING_KEEP``."""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    now = timezone.now()
+    name = f"{now:%Y%m%dT%H%M%S%f}_{uuid.uuid4().hex[:8]}"
+    stats = pstats.Stats(profiler)
+    summary = {
+        **summary,
+        "name": name,
+        "created_at": now.isoformat(),
+        "template_ms": round(template_time(stats) * 1000, 1),
+    }
+    stats.dump_stats(directory / f"{name}.pstats")
+    (directory / f"{name}.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    for stale in list_profile_names()[settings.PROFILING_KEEP:]:
+        for suffix in (".pstats", ".json"):
+            (directory / f"{stale}{suffix}").unlink(missing_ok=True)
+    return name
+
+
+def list_profile_names() -> list[str]:
+    """Stored profile names, newest first."""
+    directory = profile_dir()
+    if not directory.exists():
+        return []
+    return sorted((path.stem for path in directory.glob("*.json") if NAME_RE.match(path.stem)), reverse=True)
+
+
+def list_profiles() -> list[dict]:
+    return [summary for name in list_profile_names() if (summary := load_summary(name))]
+
+
+def profile_path(name: str, suffix: str = ".pstats") -> Path | None:
+    """Path of a stored profile file; ``None`` for unknown or malformed names."""
+    if not NAME_RE.match(name):
+        return None
+    path = profile_dir() / f"{name}{suffix}"
+    return path if path.exists() else None
+
+
+def load_summary(name: str) -> dict | None:
+    path = profile_path(name, ".json")
+    if path is None:
+        return None
+    summary = json.loads(path.read_text())
+    summary["created_at"] = datetime.fromisoformat(summary["created_at"])
+    return summary
+
+
+def top_functions(name: str, sort: str = "cumulative", limit: int = TOP_FUNCTIONS) -> str:
+    """Text table of the most expensive functions, as printed by pstats."""
+    path = profile_path(name)
+    if path is None:
+        return ""
+    stream = StringIO()
+    pstats.Stats(str(path), stream=stream).strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
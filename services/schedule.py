@@ -0,0 +1,254 @@
+from datetime import date, datetime, timedelta
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from core.models import WorkSchedule, ShiftType
+from services.month_cache import bump_month, bump_rows
+from services.payroll_rollup import apply_cell_changes
+from services.snapshots import ensure_months_open
+
+
+BATCH_SIZE = 1000
+# Employees whose history is ranked in one window query during compaction.
+HISTORY_EMPLOYEE_CHUNK = 200
+VALID_SHIFTS = set(ShiftType.values)
+
+
+def bulk_upsert_schedule(
+    cells: Iterable[tuple[int, date, str]],
+    *,
+    batch_size: int = BATCH_SIZE,
+) -> dict[str, int]:
+    """Write (employee_id, date, shift) cells, touching only changed rows.
+
+    Existing rows for the affected range are read in one query and diffed
+    against the submitted cells. New and changed cells are written with a
+    single ``INSERT ... ON CONFLICT (employee_id, date) DO UPDATE`` per batch
+    and history rows are created in bulk for them only. Unknown shift codes
+    are skipped. Returns counts of inserted, updated and unchanged cells.
+    Raises MonthClosedError if a cell falls into a closed month.
+    """
+    wanted: dict[tuple[int, date], str] = {}
+    for employee_id, day, shift in cells:
+        if shift in VALID_SHIFTS:
+            wanted[(int(employee_id), day)] = shift
+
+    result = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not wanted:
+        return result
+
+    employee_ids = {employee_id for employee_id, _ in wanted}
+    dates = [day for _, day in wanted]
+    ensure_months_open(dates)
+    existing = {
+        (employee_id, day): (pk, shift)
+        for pk, employee_id, day, shift in WorkSchedule.objects.filter(
+            employee_id__in=employee_ids,
+            date__range=(min(dates), max(dates)),
+        ).values_list("id", "employee_id", "date", "shift")
+    }
+
+    created: list[WorkSchedule] = []
+    changed: list[WorkSchedule] = []
+    for (employee_id, day), shift in wanted.items():
+        current = existing.get((employee_id, day))
+        if current is None:
+            created.append(WorkSchedule(employee_id=employee_id, date=day, shift=shift))
+        elif current[1] != shift:
+            changed.append(WorkSchedule(employee_id=employee_id, date=day, shift=shift))
+        else:
+            result["unchanged"] += 1
+
+    if not created and not changed:
+        return result
+
+    with transaction.atomic():
+        WorkSchedule.objects.bulk_create(
+            created + changed,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["employee", "date"],
+            update_fields=["shift"],
+        )
+        for obj in changed:
+            obj.pk = existing[(obj.employee_id, obj.date)][0]
+        _fill_missing_pks(created)
+        WorkSchedule.history.bulk_history_create(created, batch_size=batch_size)
+        WorkSchedule.history.bulk_history_create(changed, batch_size=batch_size, update=True)
+        apply_cell_changes(
+            [(obj.employee_id, obj.date, None, obj.shift) for obj in created]
+            + [(obj.employee_id, obj.date, existing[(obj.employee_id, obj.date)][1], obj.shift) for obj in changed]
+        )
+        # bulk_create sends no post_save, so invalidate the cached months here.
+        touched: dict[date, set[int]] = {}
+        for obj in created + changed:
+            touched.setdefault(obj.date.replace(day=1), set()).add(obj.employee_id)
+        for first_day, employee_ids in touched.items():
+            bump_month(first_day)
+            bump_rows(first_day, employee_ids)
+
+    result["inserted"] = len(created)
+    result["updated"] = len(changed)
+    return result
+
+
+def _fill_missing_pks(objs: list[WorkSchedule]) -> None:
+    """Load primary keys for rows the backend did not return from the insert."""
+    missing = {(obj.employee_id, obj.date): obj for obj in objs if obj.pk is None}
+    if not missing:
+        return
+    dates = [day for _, day in missing]
+    rows = WorkSchedule.objects.filter(
+        employee_id__in={employee_id for employee_id, _ in missing},
+        date__range=(min(dates), max(dates)),
+    ).values_list("id", "employee_id", "date")
+    for pk, employee_id, day in rows:
+        obj = missing.get((employee_id, day))
+        if obj is not None:
+            obj.pk = pk
+
+
+def apply_schedule_delta(
+    cells: Iterable[tuple[int, date, str]],
+    loaded_at: datetime | dict[int, datetime],
+) -> tuple[dict[str, int] | None, list[dict]]:
+    """Apply edited cells unless another write touched them after ``loaded_at``.
+
+    ``loaded_at`` is either one time for all cells or ``{employee_id: time}``
+    when rows were loaded at different moments (pages of the timesheet).
+    The latest history record of each cell serves as its version. When any
+    submitted cell was changed after the client loaded it, nothing is written
+    and the conflicting cells are returned with their current value.
+    """
+    cells = list(cells)
+    if not cells:
+        return {"inserted": 0, "updated": 0, "unchanged": 0}, []
+
+    keys = {(int(employee_id), day) for employee_id, day, _ in cells}
+    employee_ids = {employee_id for employee_id, _ in keys}
+    dates = [day for _, day in keys]
+    if isinstance(loaded_at, dict):
+        loaded = {employee_id: loaded_at[employee_id] for employee_id in employee_ids}
+    else:
+        loaded = dict.fromkeys(employee_ids, loaded_at)
+
+    with transaction.atomic():
+        # Lock existing rows so a concurrent delta cannot slip in between the
+        # version check and the write.
+        list(
+            WorkSchedule.objects.select_for_update()
+            .filter(employee_id__in=employee_ids, date__range=(min(dates), max(dates)))
+            .values_list("id", flat=True)
+        )
+        newer = (
+            WorkSchedule.history.filter(
+                employee_id__in=employee_ids,
+                date__range=(min(dates), max(dates)),
+                history_date__gt=min(loaded.values()),
+            )
+            .order_by("history_date", "history_id")
+            .values_list("employee_id", "date", "shift", "history_type", "history_date")
+        )
+        latest = {
+            (employee_id, day): (shift, kind)
+            for employee_id, day, shift, kind, changed_at in newer
+            if changed_at > loaded[employee_id]
+        }
+        conflicts = [
+            {
+                "employee": employee_id,
+                "day": day.day,
+                "shift": "" if kind == "-" else shift,
+            }
+            for (employee_id, day), (shift, kind) in latest.items()
+            if (employee_id, day) in keys
+        ]
+        if conflicts:
+            return None, conflicts
+        return bulk_upsert_schedule(cells), []
+
+
+def rotation_offsets(sequence: list[str], employee_ids: Iterable[int], first_day: date) -> dict[int, int]:
+    """Continue each employee's rotation from their last shift of the previous month."""
+    if not sequence:
+        return {}
+    prev_last_day = first_day - timedelta(days=1)
+    last_shifts = WorkSchedule.objects.filter(
+        employee_id__in=list(employee_ids), date=prev_last_day
+    ).values_list("employee_id", "shift")
+    return {
+        employee_id: (sequence.index(shift) + 1) % len(sequence)
+        for employee_id, shift in last_shifts
+        if shift in sequence
+    }
+
+
+def rotation_cells(
+    employee_ids: Iterable[int],
+    first_day: date,
+    days: range,
+    sequence: list[str],
+    offsets: dict[int, int] | None = None,
+) -> list[tuple[int, date, str]]:
+    """Expand a ScheduleTemplate sequence into cells for the given days of a month.
+
+    Day N of the month gets ``sequence[(offset + N - 1) % len(sequence)]``,
+    which matches the auto-fill on the timesheet page.
+    """
+    if not sequence:
+        return []
+    offsets = offsets or {}
+    return [
+        (employee_id, first_day.replace(day=d), sequence[(offsets.get(employee_id, 0) + d - 1) % len(sequence)])
+        for employee_id in employee_ids
+        for d in days
+    ]
+
+
+def compact_schedule_history(
+    older_than: datetime,
+    *,
+    batch_size: int = BATCH_SIZE,
+    dry_run: bool = False,
+) -> dict[str, int]:
+    """Keep only the first and last history record of each cell before ``older_than``.
+
+    Records written after ``older_than`` are left alone, so the edit
+    conflict check of :func:`apply_schedule_delta` is unaffected. Employees
+    are ranked a chunk at a time and rows are deleted ``batch_size`` at a
+    time, each batch in its own transaction. Returns counts of compacted
+    cells and deleted (or, with ``dry_run``, deletable) rows.
+    """
+    history = WorkSchedule.history.model
+    old = history.objects.filter(history_date__lt=older_than, employee_id__isnull=False).order_by()
+    employee_ids = list(old.values_list("employee_id", flat=True).distinct().order_by("employee_id"))
+    cell = [F("employee_id"), F("date")]
+
+    result = {"cells": 0, "deleted": 0}
+    for start in range(0, len(employee_ids), HISTORY_EMPLOYEE_CHUNK):
+        redundant = (
+            old.filter(employee_id__in=employee_ids[start:start + HISTORY_EMPLOYEE_CHUNK])
+            .annotate(
+                position=Window(RowNumber(), partition_by=cell, order_by=[F("history_date").asc(), F("history_id").asc()]),
+                from_end=Window(RowNumber(), partition_by=cell, order_by=[F("history_date").desc(), F("history_id").desc()]),
+            )
+            .filter(position__gt=1, from_end__gt=1)
+            .values_list("history_id", "employee_id", "date")
+        )
+        ids = []
+        cells = set()
+        for history_id, employee_id, day in redundant:
+            ids.append(history_id)
+            cells.add((employee_id, day))
+        result["cells"] += len(cells)
+        if dry_run:
+            result["deleted"] += len(ids)
+            continue
+        for offset in range(0, len(ids), batch_size):
+            with transaction.atomic():
+                deleted, _ = history.objects.filter(history_id__in=ids[offset:offset + batch_size]).delete()
+            result["deleted"] += deleted
+    return result
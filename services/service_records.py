@@ -0,0 +1,72 @@
+from datetime import date
+from typing import Iterable
+
+from django.db import transaction
+
+from core.models import EmployeeServiceRecord
+from services.month_cache import bump_month, bump_rows
+from services.payroll_rollup import refresh_rollup
+from services.schedule import BATCH_SIZE
+from services.snapshots import ensure_months_open
+
+
+def bulk_upsert_service_records(
+    rows: Iterable[tuple[int, int, date, int]],
+    *,
+    batch_size: int = BATCH_SIZE,
+) -> dict[str, int]:
+    """Write (employee_id, service_id, month, quantity) rows, touching only changed ones.
+
+    Existing records of the affected months are read in one query; new and
+    changed quantities are written with ``INSERT ... ON CONFLICT DO UPDATE``.
+    Returns counts of inserted, updated and unchanged records. Raises
+    MonthClosedError if a record falls into a closed month.
+    """
+    wanted: dict[tuple[int, int, date], int] = {}
+    for employee_id, service_id, month, quantity in rows:
+        wanted[(int(employee_id), int(service_id), month.replace(day=1))] = int(quantity)
+
+    result = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not wanted:
+        return result
+    ensure_months_open(month for _, _, month in wanted)
+
+    existing = dict(
+        ((employee_id, service_id, month), quantity)
+        for employee_id, service_id, month, quantity in EmployeeServiceRecord.objects.filter(
+            employee_id__in={employee_id for employee_id, _, _ in wanted},
+            month__in={month for _, _, month in wanted},
+        ).values_list("employee_id", "service_id", "month", "quantity")
+    )
+
+    objs = []
+    for (employee_id, service_id, month), quantity in wanted.items():
+        current = existing.get((employee_id, service_id, month))
+        if current == quantity:
+            result["unchanged"] += 1
+            continue
+        result["inserted" if current is None else "updated"] += 1
+        objs.append(EmployeeServiceRecord(
+            employee_id=employee_id, service_id=service_id, month=month, quantity=quantity,
+        ))
+
+    if not objs:
+        return result
+
+    with transaction.atomic():
+        EmployeeServiceRecord.objects.bulk_create(
+            objs,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["employee", "service", "month"],
+            update_fields=["quantity"],
+        )
+        # bulk_create sends no post_save, so invalidate the cached months here.
+        touched: dict[date, set[int]] = {}
+        for obj in objs:
+            touched.setdefault(obj.month, set()).add(obj.employee_id)
+        for month, employee_ids in touched.items():
+            refresh_rollup(month, employee_ids)
+            bump_month(month)
+            bump_rows(month, employee_ids)
+    return result
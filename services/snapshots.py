@@ -0,0 +1,77 @@
+"""Reading frozen payroll of closed months and guarding them against writes."""
+from datetime import date
+from typing import Iterable
+
+from core.models import ClosedMonth, Department, Employee, PayrollSnapshot, Position
+from services.payroll import MONEY_COLUMNS, PAYROLL_COLUMNS
+
+
+class MonthClosedError(Exception):
+    """Raised on a write to a month that has been closed."""
+
+
+def ensure_months_open(dates: Iterable[date]) -> None:
+    """Raise :class:`MonthClosedError` if any of ``dates`` falls into a closed month."""
+    months = {day.replace(day=1) for day in dates}
+    if not months:
+        return
+    closed = sorted(ClosedMonth.objects.filter(month__in=months).values_list("month", flat=True))
+    if closed:
+        raise MonthClosedError(
+            "Месяц закрыт, изменения запрещены: " + ", ".join(f"{month:%m.%Y}" for month in closed)
+        )
+
+
+def get_closed_month(first_day: date) -> ClosedMonth | None:
+    return ClosedMonth.objects.filter(month=first_day.replace(day=1)).first()
+
+
+def _snapshot_queryset(first_day: date, department_id=None, employee_ids=None):
+    rows = PayrollSnapshot.objects.filter(closed_month__month=first_day.replace(day=1))
+    if department_id:
+        rows = rows.filter(department_id=department_id)
+    if employee_ids is not None:
+        rows = rows.filter(employee_id__in=list(employee_ids))
+    return rows
+
+
+def _pay(values: dict) -> dict:
+    return {column: float(values[column]) if column in MONEY_COLUMNS else values[column] for column in PAYROLL_COLUMNS}
+
+
+def snapshot_payroll(first_day: date, department_id=None, employee_ids=None) -> dict[int, dict] | None:
+    """Frozen ``{employee_id: {column: value}}`` of a closed month, else ``None``.
+
+    Same shape as ``read_month_payroll``.
+    """
+    if not ClosedMonth.objects.filter(month=first_day.replace(day=1)).exists():
+        return None
+    return {
+        values["employee_id"]: _pay(values)
+        for values in _snapshot_queryset(first_day, department_id, employee_ids).values("employee_id", *PAYROLL_COLUMNS)
+    }
+
+
+def snapshot_rows(first_day: date, department_id=None) -> list[tuple[Employee, dict]]:
+    """``(employee, pay)`` pairs of a closed month ordered by department and name.
+
+    Employees are unsaved instances built from the copied names, so reports
+    can use them like live ones.
+    """
+    rows = _snapshot_queryset(first_day, department_id).order_by("department_name", "full_name").values(
+        "employee_id", "department_id", "full_name", "department_name", "position_name", *PAYROLL_COLUMNS
+    )
+    departments: dict[int, Department] = {}
+    result = []
+    for values in rows:
+        department = departments.setdefault(
+            values["department_id"], Department(id=values["department_id"], name=values["department_name"])
+        )
+        employee = Employee(
+            id=values["employee_id"],
+            full_name=values["full_name"],
+            department=department,
+            position=Position(name=values["position_name"]),
+        )
+        result.append((employee, _pay(values)))
+    return result
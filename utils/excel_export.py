@@ -1,79 +1,229 @@
-from io import BytesIO
+import tempfile
 from calendar import monthrange
 from datetime import date
 
-from django.http import HttpResponse
+from django.http import FileResponse
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
 
-from helpers.utils import get_employees_queryset, get_schedule_maps
-from services.payroll import calculate_shift_salary
+from core.models import Service, EmployeeServiceRecord
+from helpers.utils import get_employees_queryset, build_service_data
+from services.month_cache import get_month_schedule, get_month_payroll, get_payroll_rows
+from services.payroll import calculate_service_sum
 
 
-def autofit_columns(ws):
-    """Auto adjust column width based on cell contents."""
-    for col in ws.columns:
-        max_len = max((len(str(cell.value)) for cell in col), default=0)
-        ws.column_dimensions[col[0].column_letter].width = max_len + 2
+WIDTH_SAMPLE_ROWS = 1000
+BOLD = Font(bold=True)
 
 
-def workbook_to_response(wb, filename: str) -> HttpResponse:
-    """Save workbook to HTTP response with given filename."""
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    response = HttpResponse(
-        buffer,
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+class SheetWriter:
+    """Append rows to a new sheet while tracking the widest value per column.
+
+    Only the first ``sample_rows`` rows are measured. ``wb`` is expected to be
+    write-only, where column widths must be set before the first row is
+    written, so sampled rows are held back until the sample is complete (or
+    :meth:`close` is called) and every later row goes straight to the file.
+    """
+
+    def __init__(self, wb: Workbook, title: str, sample_rows: int = WIDTH_SAMPLE_ROWS):
+        self.ws = wb.create_sheet(title)
+        self.sample_rows = sample_rows
+        self.widths: list[int] = []
+        self._pending: list[list] | None = []
+
+    def append(self, row, bold: bool = False):
+        if self._pending is None:
+            self.ws.append(self._cells(row, bold))
+            return
+        for i, value in enumerate(row):
+            length = len(str(value)) if value is not None else 0
+            if i < len(self.widths):
+                self.widths[i] = max(self.widths[i], length)
+            else:
+                self.widths.append(length)
+        self._pending.append(self._cells(row, bold))
+        if len(self._pending) >= self.sample_rows:
+            self._flush()
+
+    def close(self):
+        if self._pending is not None:
+            self._flush()
+
+    def _flush(self):
+        for i, width in enumerate(self.widths, start=1):
+            self.ws.column_dimensions[get_column_letter(i)].width = width + 2
+        for row in self._pending:
+            self.ws.append(row)
+        self._pending = None
+
+    def _cells(self, row, bold):
+        if not bold:
+            return row
+        cells = []
+        for value in row:
+            cell = WriteOnlyCell(self.ws, value=value)
+            cell.font = BOLD
+            cells.append(cell)
+        return cells
+
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def workbook_to_file(wb):
+    """Save workbook to an anonymous temporary file rewound to the start."""
+    tmp = tempfile.TemporaryFile()
+    wb.save(tmp)
+    tmp.seek(0)
+    return tmp
+
+
+def workbook_to_response(wb, filename: str) -> FileResponse:
+    """Stream workbook from a temporary file as an attachment with given filename."""
+    return FileResponse(
+        workbook_to_file(wb),
+        as_attachment=True,
+        filename=filename,
+        content_type=XLSX_CONTENT_TYPE,
     )
-    response["Content-Disposition"] = f"attachment; filename=\"{filename}\""
-    return response
 
 
 def build_timesheet_workbook(first_day: date) -> Workbook:
-    """Create workbook with timesheet data for given month."""
+    """Create write-only workbook with timesheet data for given month."""
     year, month = first_day.year, first_day.month
     days_in_month = monthrange(year, month)[1]
 
     employees = get_employees_queryset().order_by("department__name", "full_name")
-    schedule_map, _ = get_schedule_maps(first_day)
+    schedule = get_month_schedule(first_day)
+    payroll = get_month_payroll(first_day)
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Табель_{year}_{month:02d}"
+    wb = Workbook(write_only=True)
+    sheet = SheetWriter(wb, f"Табель_{year}_{month:02d}")
 
     headers = ["ФИО", "Отдел", "Должность"]
     headers += [str(d) for d in range(1, days_in_month + 1)]
     headers += ["Дневных", "Ночных", "Итого (₽)"]
-    ws.append(headers)
+    sheet.append(headers, bold=True)
 
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-
-    for employee in employees:
+    labels = {"day": "Д", "night": "Н", "vacation": "О", "sick": "Б", "weekend": "В"}
+    for employee in employees.iterator(chunk_size=2000):
         row = [employee.full_name, employee.department.name, employee.position.name]
-        shifts = schedule_map.get(employee.id, {})
-        day_count = night_count = 0
-        for d in range(1, days_in_month + 1):
-            shift = shifts.get(d, "")
-            if shift == "day":
-                row.append("Д")
-                day_count += 1
-            elif shift == "night":
-                row.append("Н")
-                night_count += 1
-            elif shift == "vacation":
-                row.append("О")
-            elif shift == "sick":
-                row.append("Б")
-            elif shift == "weekend":
-                row.append("В")
-            else:
-                row.append("")
+        row += [labels.get(shift, "") for shift in schedule.row(employee.id)]
+        # Employees added after a month was closed are not in its snapshot.
+        pay = payroll.get(employee.id, {})
+        row += [pay.get("day", 0), pay.get("night", 0), pay.get("total", 0)]
+        sheet.append(row)
+
+    sheet.close()
+    return wb
+
+
+def build_services_workbook(first_day: date) -> Workbook:
+    """Create workbook with service quantities and sums for given month."""
+    year, month = first_day.year, first_day.month
+
+    employees = get_employees_queryset()
+    services = list(Service.objects.all())
+    raw_data = build_service_data(EmployeeServiceRecord.objects.filter(month=first_day))
+
+    wb = Workbook(write_only=True)
+    sheet = SheetWriter(wb, f"Услуги_{year}_{month:02d}")
+
+    headers = ["ФИО", "Отдел", "Должность"] + [s.name for s in services] + ["Итого (₽)"]
+    sheet.append(headers, bold=True)
+
+    for emp in employees.iterator(chunk_size=2000):
+        row = [emp.full_name, emp.department.name, emp.position.name]
+        quantities = raw_data.get(emp.id, {})
+        for s in services:
+            row.append(quantities.get(s.id, 0))
+        total = calculate_service_sum(services, quantities)
+        row.append(round(float(total), 2))
+        sheet.append(row)
+
+    sheet.close()
+    return wb
+
+
+def build_salary_report_workbook(first_day: date) -> Workbook:
+    """Create salary workbook with per-department subtotals for given month."""
+    year, month = first_day.year, first_day.month
+
+    wb = Workbook(write_only=True)
+    sheet = SheetWriter(wb, f"Зарплата_{year}_{month:02d}")
+
+    headers = [
+        "ФИО", "Отдел", "Должность",
+        "Дневных", "Ночных", "Сумма смен (₽)", "Сумма услуг (₽)", "Итого (₽)"
+    ]
+    sheet.append(headers, bold=True)
+
+    current_dept = None
+    dept_day = dept_night = dept_shift_sum = dept_service_sum = dept_total = 0
+    for emp, pay in get_payroll_rows(first_day):
+        if current_dept and emp.department_id != current_dept.id:
+            sheet.append([
+                "",
+                f"Итого по отделу {current_dept.name}",
+                "",
+                dept_day,
+                dept_night,
+                round(dept_shift_sum, 2),
+                round(dept_service_sum, 2),
+                round(dept_total, 2),
+            ])
+            dept_day = dept_night = dept_shift_sum = dept_service_sum = dept_total = 0
+
+        sheet.append([
+            emp.full_name,
+            emp.department.name,
+            emp.position.name,
+            pay["day"],
+            pay["night"],
+            pay["shift_pay"],
+            pay["services"],
+            pay["total"],
+        ])
+
+        dept_day += pay["day"]
+        dept_night += pay["night"]
+        dept_shift_sum += pay["shift_pay"]
+        dept_service_sum += pay["services"]
+        dept_total += pay["total"]
+        current_dept = emp.department
+
+    if current_dept:
+        sheet.append([
+            "",
+            f"Итого по отделу {current_dept.name}",
+            "",
+            dept_day,
+            dept_night,
+            round(dept_shift_sum, 2),
+            round(dept_service_sum, 2),
+            round(dept_total, 2),
+        ])
+
+    sheet.close()
+    return wb
+
+
+def build_salary_workbook(first_day: date, full_month: bool = True, department_id=None) -> Workbook:
+    """Create final salary (or advance for days 1-15) workbook for given month."""
+    wb = Workbook(write_only=True)
+    sheet = SheetWriter(wb, "Аванс" if not full_month else "Зарплата")
+
+    headers = ["ФИО", "Отдел", "Должность", "Дневных", "Ночных", "Сумма смен (₽)", "Сумма услуг (₽)", "Премия", "Итого (₽)"]
+    sheet.append(headers, bold=True)
 
-        total_salary = calculate_shift_salary(employee, day_count, night_count)
-        row += [day_count, night_count, round(float(total_salary), 2)]
-        ws.append(row)
+    for emp, pay in get_payroll_rows(first_day, department_id):
+        if full_month:
+            values = [pay["day"], pay["night"], pay["shift_pay"], pay["services"], pay["bonus"], pay["total"]]
+        else:
+            values = [pay["day_1_15"], pay["night_1_15"], pay["advance"], 0, 0, pay["advance"]]
+        sheet.append([emp.full_name, emp.department.name, emp.position.name] + values)
 
-    autofit_columns(ws)
+    sheet.close()
     return wb